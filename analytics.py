@@ -0,0 +1,245 @@
+"""
+analytics.py
+
+In-memory sales analytics on NumPy arrays.
+
+Every sale line, live and archived, is held as one row of six compact int32
+columns: business day, medicine, sale, quantity, and revenue and cost in
+pesewas. They are loaded once per worker and then extended from the
+highest loaded line id, so keeping them current normally costs one indexed
+query that returns nothing. Group-by and time-bucket questions (revenue by
+category per week, margin by brand, ...) are answered with `np.unique` /
+`np.bincount` over those columns instead of a new SQL query each.
+
+Medicine attributes (name, category, brand) are looked up when a report
+runs, so renames and re-categorisations show up at once. The arrays are
+reloaded in full every FULL_RELOAD_SECONDS to pick up changes that do not
+add lines: business dates recomputed by another process, or on Postgres a
+line committed after one with a higher id.
+"""
+import threading
+import time
+from datetime import date
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Medicine, Sale, SaleItem, ArchivedSale, ArchivedSaleItem
+
+LOAD_CHUNK_SIZE = 50_000
+FULL_RELOAD_SECONDS = 600
+
+DIMENSIONS = ('medicine', 'category', 'brand')
+BUCKETS = ('day', 'week', 'month', 'year')
+
+_COLUMNS = ('day', 'medicine_id', 'sale_id', 'quantity', 'revenue', 'cost')
+
+_lock = threading.Lock()
+_facts = None
+
+
+class SalesFacts:
+    """The loaded sale lines. `columns` is replaced, never mutated, so readers can keep a reference."""
+
+    def __init__(self):
+        self.columns = {name: np.empty(0, dtype=np.int32) for name in _COLUMNS}
+        self.last_id = 0
+        self.loaded_at = time.monotonic()
+
+    def _read(self, sale_model, item_model, after_id):
+        """Chunks of column arrays for lines of `item_model` with id > `after_id`."""
+        chunks = []
+        while True:
+            rows = db.session.execute(
+                select(item_model.id, sale_model.sale_date, item_model.medicine_id, item_model.sale_id,
+                       item_model.quantity, item_model.total_price, item_model.total_cost)
+                .join(sale_model, item_model.sale_id == sale_model.id)
+                .where(item_model.id > after_id, sale_model.sale_date.isnot(None))
+                .order_by(item_model.id)
+                .limit(LOAD_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                return chunks
+            ids, days, meds, sales, qty, revenue, cost = zip(*rows)
+            chunks.append({
+                'day': np.array(days, dtype='datetime64[D]').astype(np.int32),
+                'medicine_id': np.array(meds, dtype=np.int32),
+                'sale_id': np.array(sales, dtype=np.int32),
+                'quantity': np.array(qty, dtype=np.int32),
+                'revenue': np.rint(np.array(revenue, dtype=np.float64) * 100).astype(np.int32),
+                'cost': np.rint(np.array([c or 0 for c in cost], dtype=np.float64) * 100).astype(np.int32),
+            })
+            after_id = ids[-1]
+            self.last_id = max(self.last_id, after_id)
+
+    def _append(self, chunks):
+        if chunks:
+            self.columns = {name: np.concatenate([self.columns[name]] + [c[name] for c in chunks])
+                            for name in _COLUMNS}
+
+    def load_all(self):
+        self._append(self._read(ArchivedSale, ArchivedSaleItem, 0) + self._read(Sale, SaleItem, 0))
+        return self
+
+    def extend(self):
+        """Append lines recorded since the last load (archiving only moves lines already loaded)."""
+        self._append(self._read(Sale, SaleItem, self.last_id))
+
+
+def columns():
+    """Up-to-date fact columns {name: array}; all arrays have the same length."""
+    global _facts
+    with _lock:
+        if _facts is None or time.monotonic() - _facts.loaded_at > FULL_RELOAD_SECONDS:
+            _facts = SalesFacts().load_all()
+        else:
+            _facts.extend()
+        return _facts.columns
+
+
+def reset():
+    """Drop the loaded facts; the next report reloads them (after rewriting past sales)."""
+    global _facts
+    with _lock:
+        _facts = None
+
+
+def _day_number(d):
+    return (d - date(1970, 1, 1)).days
+
+
+def _bucket(days, bucket):
+    """(codes, label function) putting day numbers into day/week/month/year buckets."""
+    if bucket == 'day':
+        return days.astype(np.int64), lambda c: str(np.datetime64(int(c), 'D'))
+    if bucket == 'week':
+        # Day 0 (1970-01-01) was a Thursday; weeks start on Monday
+        return (days - (days + 3) % 7).astype(np.int64), lambda c: str(np.datetime64(int(c), 'D'))
+    unit = 'M' if bucket == 'month' else 'Y'
+    codes = days.astype('datetime64[D]').astype(f'datetime64[{unit}]').astype(np.int64)
+    return codes, lambda c: str(np.datetime64(int(c), unit))
+
+
+def _medicine_attributes():
+    return db.session.query(Medicine.id, Medicine.name, Medicine.category, Medicine.brand).all()
+
+
+def _dimension(medicine_ids, dimension, medicines):
+    """(codes, label function) for grouping lines by a medicine attribute."""
+    if dimension == 'medicine':
+        names = {m.id: m.name for m in medicines}
+        return medicine_ids.astype(np.int64), lambda c: names.get(int(c))
+    labels = sorted({getattr(m, dimension) or '' for m in medicines})
+    size = max([m.id for m in medicines] + [int(medicine_ids.max(initial=0))]) + 1
+    lut = np.full(size, -1, dtype=np.int64)  # -1: medicine deleted since
+    codes = {label: i for i, label in enumerate(labels)}
+    for m in medicines:
+        lut[m.id] = codes[getattr(m, dimension) or '']
+    return lut[medicine_ids], lambda c: (labels[c] or None) if c >= 0 else None
+
+
+def _money(cents):
+    return round(float(cents) / 100, 2)
+
+
+def report(group_by=(), bucket=None, start=None, end=None):
+    """Sales metrics grouped by medicine attributes and/or a time bucket, between two business dates.
+
+    Each row has the bucket (when given), one value per `group_by`
+    dimension, and revenue, cost, profit, margin (%), quantity, lines and
+    sales (distinct sales with a line in the group). Rows are ordered by
+    bucket, then revenue, highest first.
+    """
+    for dimension in group_by:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f'Unknown dimension {dimension!r}; use {", ".join(DIMENSIONS)}')
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f'Unknown bucket {bucket!r}; use {", ".join(BUCKETS)}')
+
+    cols = columns()
+    mask = np.ones(len(cols['day']), dtype=bool)
+    if start is not None:
+        mask &= cols['day'] >= _day_number(start)
+    if end is not None:
+        mask &= cols['day'] <= _day_number(end)
+    cols = {name: values[mask] for name, values in cols.items()}
+
+    keys = []  # (name, codes, label function)
+    if bucket is not None:
+        keys.append((bucket, *_bucket(cols['day'], bucket)))
+    if group_by:
+        medicines = _medicine_attributes()
+        for dimension in group_by:
+            keys.append((dimension, *_dimension(cols['medicine_id'], dimension, medicines)))
+
+    n = len(cols['day'])
+    if n == 0:
+        return []
+    if keys:
+        groups, inverse = np.unique(np.vstack([codes for _, codes, _ in keys]), axis=1, return_inverse=True)
+        inverse = inverse.reshape(-1)
+    else:
+        groups, inverse = np.zeros((0, 1), dtype=np.int64), np.zeros(n, dtype=np.int64)
+    count = groups.shape[1]
+
+    revenue = np.bincount(inverse, weights=cols['revenue'], minlength=count)
+    cost = np.bincount(inverse, weights=cols['cost'], minlength=count)
+    quantity = np.bincount(inverse, weights=cols['quantity'], minlength=count)
+    lines = np.bincount(inverse, minlength=count)
+    # Distinct (group, sale) pairs give the number of sales per group
+    stride = int(cols['sale_id'].max()) + 1
+    pairs = np.unique(inverse * stride + cols['sale_id'])
+    sales = np.bincount(pairs // stride, minlength=count)
+
+    rows = []
+    for g in range(count):
+        row = {name: label(groups[k, g]) for k, (name, _, label) in enumerate(keys)}
+        if 'medicine' in group_by:
+            row['medicine_id'] = int(groups[[name for name, _, _ in keys].index('medicine'), g])
+        profit = revenue[g] - cost[g]
+        row.update({
+            'revenue': _money(revenue[g]),
+            'cost': _money(cost[g]),
+            'profit': _money(profit),
+            'margin': round(float(profit / revenue[g] * 100), 1) if revenue[g] else 0.0,
+            'quantity': int(quantity[g]),
+            'lines': int(lines[g]),
+            'sales': int(sales[g]),
+        })
+        rows.append(row)
+    if bucket is not None:
+        # np.unique sorted the groups by bucket first; keep that order, biggest revenue first within it
+        rows.sort(key=lambda r: -r['revenue'])
+        rows.sort(key=lambda r: r[bucket])
+    else:
+        rows.sort(key=lambda r: -r['revenue'])
+    return rows
+
+
+# ----- Report page sections (same shapes as the rollups helpers) -----
+
+def totals(start=None, end=None):
+    """Summed revenue/cost/quantity/sale count, optionally between two business dates."""
+    rows = report(start=start, end=end)
+    if not rows:
+        return {'revenue': 0.0, 'cost': 0.0, 'quantity': 0, 'sale_count': 0}
+    row = rows[0]
+    return {'revenue': row['revenue'], 'cost': row['cost'], 'quantity': row['quantity'], 'sale_count': row['sales']}
+
+
+def daily(start, end=None):
+    """(day, revenue, sale_count) rows in date order."""
+    return [(date.fromisoformat(r['day']), r['revenue'], r['sales'])
+            for r in report(bucket='day', start=start, end=end)]
+
+
+def best_sellers(limit=10):
+    """(id, name, price, total_qty, total_revenue) for the top medicines by units sold."""
+    cols = columns()
+    quantity = np.bincount(cols['medicine_id'], weights=cols['quantity'])
+    revenue = np.bincount(cols['medicine_id'], weights=cols['revenue'], minlength=len(quantity))
+    # A few spare candidates in case some of the top sellers were deleted since
+    top = [int(i) for i in np.argsort(-quantity, kind='stable')[:limit * 2] if quantity[i] > 0]
+    medicines = {m.id: m for m in db.session.query(Medicine.id, Medicine.name, Medicine.price).filter(Medicine.id.in_(top))}
+    return [(i, medicines[i].name, medicines[i].price, int(quantity[i]), _money(revenue[i]))
+            for i in top if i in medicines][:limit]
@@ -1,19 +1,84 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort
 from datetime import datetime, date, timedelta
 import os
 import secrets
+import click
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-from models import db, Medicine, Customer, Sale
-from sqlalchemy import func, text
-from io import BytesIO
-from flask import send_file
+from models import db, Medicine, Customer, Sale, SaleItem, ArchivedSale, Job
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import joinedload, selectinload
+import rollups
+import cache
+import sales
+import perf
+import inventory_import
+import archive
+import changes
+import business_day
+import migrations
+import analytics
+import engine_profiles
+from engine_profiles import replica_reads
+import http_cache
+import live
+import exports
+import jobs
+from http_cache import conditional
+import tempfile
+from flask import send_file, send_from_directory, Response, stream_with_context
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Largest number of queued offline sales accepted by /sales/sync/batch
+SYNC_BATCH_LIMIT = 500
+
+
+def _format_cursor(sale):
+    """Keyset cursor for a sale row: '<iso timestamp>_<id>'."""
+    return f"{sale.timestamp.isoformat()}_{sale.id}"
+
+
+def _parse_cursor(value):
+    """Inverse of `_format_cursor`; returns (timestamp, id) or None if missing/invalid."""
+    if not value:
+        return None
+    try:
+        ts, sid = value.rsplit('_', 1)
+        return datetime.fromisoformat(ts), int(sid)
+    except ValueError:
+        return None
+
+
+def _prefix_filter(column, prefix):
+    """`column` starts with `prefix`, written as a range so a b-tree index can serve it."""
+    return and_(column >= prefix, column < prefix + '\uffff')
+
+
+def _client_ref(data):
+    """Idempotency key of an offline-queued sale: its client operation id.
+
+    Tills send `op_id` ('<device id>:<queue key>'); older ones sent
+    `client_ref`, or only the queue `timestamp`.
+    """
+    ref = data.get('op_id') or data.get('client_ref') or data.get('timestamp')
+    return str(ref)[:64] if ref else None
+
+
+def _op_seq(data):
+    """Position of an offline operation in its till's queue (the IndexedDB key), or None."""
+    try:
+        return int(data.get('seq', data.get('timestamp')))
+    except (TypeError, ValueError):
+        return None
+
+
+# Sync results after which the till may drop the operation from its queue
+ACKNOWLEDGED = ('ok', 'duplicate')
+
 def create_app():
     from models import Admin
     from werkzeug.security import generate_password_hash, check_password_hash
@@ -24,18 +89,19 @@ def create_app():
     database_url = os.environ.get('DATABASE_URL')
     if database_url:
         # Fix PostgreSQL URL scheme for SQLAlchemy
-        if database_url.startswith('postgres://'):
-            database_url = database_url.replace('postgres://', 'postgresql://', 1)
-        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+        app.config['SQLALCHEMY_DATABASE_URI'] = engine_profiles.normalize_url(database_url)
     else:
         # Local development with SQLite
         DB_PATH = os.path.join(BASE_DIR, 'pharmacy.db')
         app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.secret_key = os.environ.get('SECRET_KEY', 'dev-key-for-demo')
+    # Pool/pragma settings per dialect and the optional read replica
+    engine_profiles.configure(app)
 
     # Initialize database object from models.py
     db.init_app(app)
+    engine_profiles.init_engines(app, db)
 
     # Initialize CSRF protection
     csrf = CSRFProtect(app)
@@ -50,30 +116,73 @@ def create_app():
         default_limits=["200 per day", "50 per hour"]
     )
 
+    # Opt-in request/SQL profiling: Server-Timing headers and /admin/perf
+    app.config['PERF_PROFILING'] = os.environ.get('PERF_PROFILING') == '1'
+    if app.config['PERF_PROFILING']:
+        perf.init_app(app)
+
+    # Catalog change versions for /api/medicines/changes
+    changes.init_app(app)
+    sales.init_app(app)
+
+    # gzip/brotli for large HTML and JSON bodies (ETags: @conditional on the views)
+    http_cache.init_app(app)
+
+    # Background exports and report snapshots (/jobs)
+    jobs.init_app(app)
+
     with app.app_context():
+        # One version query when the schema is current; pending migrations run once
+        migrations.ensure_current()
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations (run once per deploy, before starting workers)."""
+        applied = migrations.migrate()
+        print(f'Schema at version {migrations.current_version()} of {migrations.LATEST}'
+              f' ({len(applied)} migrations applied).')
+
+    @app.cli.command('rebuild-rollups')
+    def rebuild_rollups_command():
+        """Recompute the per-day and per-medicine sales rollups from Sale history."""
+        days = rollups.rebuild()
+        print(f'Rebuilt sales rollups ({days} days).')
+
+    @app.cli.command('recompute-sale-dates')
+    def recompute_sale_dates_command():
+        """Recompute every stored business date (after changing SHOP_TIMEZONE or DAY_CUTOFF_HOUR)."""
+        updated = business_day.backfill(Sale, only_missing=False) + business_day.backfill(ArchivedSale, only_missing=False)
+        days = rollups.rebuild()
+        cache.sales_changed()
+        analytics.reset()
+        print(f'Recomputed business dates of {updated} sales; rebuilt rollups ({days} days).')
+
+    @app.cli.command('archive-sales')
+    @click.option('--days', type=int, required=True, help='Archive sales older than this many days.')
+    def archive_sales_command(days):
+        """Move old sales into the archive tables (report totals are kept)."""
+        cutoff = datetime.now() - timedelta(days=days)
+        count, total = archive.summary(cutoff)
+        print(f'Archiving {count} sales (₵{total:.2f}) from before {cutoff:%Y-%m-%d %H:%M}...')
+        moved = archive.archive_sales(cutoff, progress=lambda n: print(f'  {n}/{count}'))
+        cache.sales_changed()
+        print(f'Archived {moved} sales.')
+
+    @app.cli.command('import-medicines')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--set-quantity', is_flag=True, help='Replace stock levels instead of adding the file quantities.')
+    def import_medicines_command(path, set_quantity):
+        """Add or update medicines from a CSV or XLSX file."""
         try:
-            # Create tables if they don't exist
-            db.create_all()
-        except Exception as e:
-            print(f"Warning: Could not create database tables: {e}")
-            # Continue anyway - tables might already exist
-        # Ensure `cost_price` column exists for backward compatibility
-        try:
-            with db.engine.connect() as conn:
-                dialect = conn.dialect.name
-                if dialect == 'sqlite':
-                    res = conn.execute(text("PRAGMA table_info('medicine')")).fetchall()
-                    cols = [r[1] for r in res]
-                    if 'cost_price' not in cols:
-                        conn.execute(text("ALTER TABLE medicine ADD COLUMN cost_price FLOAT DEFAULT 0"))
-                        print('Added cost_price column to medicine (sqlite)')
-                elif dialect in ('postgres', 'postgresql'):
-                    # Postgres supports IF NOT EXISTS
-                    conn.execute(text("ALTER TABLE medicine ADD COLUMN IF NOT EXISTS cost_price DOUBLE PRECISION DEFAULT 0"))
-                    print('Ensured cost_price column exists in medicine (postgres)')
-        except Exception as e:
-            # Non-fatal: log and continue
-            print(f"Warning: could not ensure cost_price column exists: {e}")
+            with open(path, 'rb') as f:
+                result = inventory_import.import_medicines(inventory_import.read_rows(f, path), set_quantity)
+        except inventory_import.ImportFileError as e:
+            raise click.ClickException(str(e))
+        cache.medicines_changed()
+        for number, message in result['errors']:
+            print(f'Row {number}: {message}')
+        print(f"Imported {result['rows']} rows: {result['inserted']} added, "
+              f"{result['updated']} updated, {len(result['errors'])} rejected.")
 
     # Add context processor to inject current date and time in 12-hour format
     @app.context_processor
@@ -160,6 +269,17 @@ def create_app():
                 return redirect(url_for('admin_login'))
         return render_template('admin_register.html', error=error)
 
+    # Per-route timing collected by perf.py (only when PERF_PROFILING=1)
+    @app.route('/admin/perf', methods=['GET', 'POST'])
+    @admin_required
+    def admin_perf():
+        if request.method == 'POST':
+            perf.reset()
+            flash('Performance statistics cleared.', 'info')
+            return redirect(url_for('admin_perf'))
+        return render_template('perf.html', enabled=app.config['PERF_PROFILING'], rows=perf.snapshot(),
+                               repeat_threshold=perf.REPEAT_THRESHOLD)
+
     # Admin password reset routes
     @app.route('/admin/forgot-password', methods=['GET', 'POST'])
     def forgot_password():
@@ -234,156 +354,82 @@ def create_app():
     # Serve Service Worker from root for proper scope
     @app.route('/service-worker.js')
     def service_worker():
-        # Inline Service Worker code to avoid file path issues
-        sw_code = """
-// Simple, reliable Service Worker for offline functionality
-const CACHE_NAME = 'pharmacy-v1';
-
-// Install
-self.addEventListener('install', (event) => {
-  console.log('[SW] Installing');
-  self.skipWaiting();
-});
-
-// Activate
-self.addEventListener('activate', (event) => {
-  console.log('[SW] Activating');
-  event.waitUntil(
-    caches.keys().then((names) => {
-      return Promise.all(
-        names.map((name) => {
-          if (name !== CACHE_NAME) {
-            console.log('[SW] Deleting old cache:', name);
-            return caches.delete(name);
-          }
-        })
-      );
-    })
-  );
-  self.clients.claim();
-});
-
-// Fetch - network first for HTML, cache first for assets
-self.addEventListener('fetch', (event) => {
-  const { request } = event;
-  const url = new URL(request.url);
-
-  // Skip non-GET
-  if (request.method !== 'GET') {
-    return;
-  }
-
-  // For HTML pages: network first
-  if (request.headers.get('accept')?.includes('text/html')) {
-    event.respondWith(
-      fetch(request)
-        .then((response) => {
-          if (response && response.status === 200) {
-            const clone = response.clone();
-            caches.open(CACHE_NAME).then((cache) => {
-              cache.put(request, clone);
-            });
-          }
-          return response;
-        })
-        .catch(() => {
-          return caches.match(request)
-            .then((cached) => {
-              if (cached) return cached;
-              return caches.match('/static/offline.html')
-                .then((offline) => offline || new Response('Offline'));
-            });
-        })
-    );
-    return;
-  }
-
-  // For other requests: cache first, fallback to network
-  event.respondWith(
-    caches.match(request)
-      .then((cached) => {
-        if (cached) return cached;
-
-        return fetch(request)
-          .then((response) => {
-            if (response && response.status === 200) {
-              const clone = response.clone();
-              caches.open(CACHE_NAME).then((cache) => {
-                cache.put(request, clone);
-              });
-            }
-            return response;
-          })
-          .catch(() => {
-            return new Response('Offline - Resource not available', {
-              status: 503,
-              statusText: 'Service Unavailable'
-            });
-          });
-      })
-  );
-});
-"""
-        response = app.response_class(
-            response=sw_code,
-            status=200,
-            mimetype='application/javascript'
-        )
+        # static/service-worker.js is the only copy; served here so its scope is the whole site
+        response = send_from_directory(app.static_folder, 'service-worker.js', mimetype='application/javascript')
         response.cache_control.max_age = 0
         response.cache_control.no_cache = True
         response.cache_control.must_revalidate = True
         return response
 
     # ---------- DASHBOARD ROUTE ----------
+    def build_dashboard_payload():
+        """Everything the dashboard shows, as JSON-ready values."""
+        # Sales trend data (last 7 business days)
+        today = date.today()
+        seven_days_ago = business_day.today() - timedelta(days=7)
+        sales_by_date = rollups.daily(seven_days_ago)
+
+        # Stock levels (first 10 medicines)
+        stock = db.session.query(Medicine.name, Medicine.quantity).order_by(Medicine.id).limit(10).all()
+
+        # Expiry alerts
+        def expiry_rows(*criteria):
+            rows = db.session.query(Medicine.name, Medicine.expiry_date).filter(
+                Medicine.expiry_date.isnot(None), *criteria
+            ).order_by(Medicine.expiry_date).all()
+            return [{'name': name, 'expiry_date': d.isoformat(), 'expiry_label': d.strftime('%b %d, %Y')} for name, d in rows]
+
+        thirty_days = today + timedelta(days=30)
+        expiring_soon = expiry_rows(Medicine.expiry_date <= thirty_days, Medicine.expiry_date > today)
+        expired = expiry_rows(Medicine.expiry_date <= today)
+
+        # Statistics
+        total_medicines, total_stock = db.session.query(
+            func.count(Medicine.id), func.coalesce(func.sum(Medicine.quantity), 0)
+        ).one()
+
+        return {
+            'sales_dates': [str(s[0]) for s in sales_by_date],
+            'sales_amounts': [float(s[1]) if s[1] else 0 for s in sales_by_date],
+            'stock_labels': [name for name, _ in stock],
+            'stock_quantities': [qty for _, qty in stock],
+            'expiring_soon': expiring_soon,
+            'expired': expired,
+            'total_medicines': total_medicines,
+            'total_stock': int(total_stock),
+            'total_sales': rollups.totals()['revenue'],
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def dashboard_payload():
+        # One computation per cache window no matter how many screens are open
+        return cache.dashboard_payload.get_or_set('dashboard', build_dashboard_payload)
+
+    # Pushes dashboard deltas to open screens (/api/live)
+    publisher = live.init_app(app, build_dashboard_payload)
+
+    @app.route('/api/live')
+    @limiter.exempt
+    def live_events():
+        """Server-Sent Events: 'sales', 'stock' and 'expiry' sections of the dashboard as they change.
+
+        204 when this worker already serves live.MAX_STREAMS streams: the page then polls instead.
+        """
+        if not publisher.acquire_slot():
+            return Response(status=204)
+        response = Response(publisher.stream(request.headers.get('Last-Event-ID')), mimetype='text/event-stream')
+        # Called by the WSGI server when the stream ends or the client goes away
+        response.call_on_close(publisher.release_slot)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # no proxy buffering
+        return response
+
     @app.route('/dashboard')
+    @conditional
     def dashboard():
         """Dashboard with charts and analytics"""
         try:
-            # Sales trend data (last 7 days)
-            today = date.today()
-            seven_days_ago = today - timedelta(days=7)
-            sales_by_date = db.session.query(
-                func.date(Sale.timestamp).label('date'),
-                func.sum(Sale.total_price).label('total')
-            ).filter(Sale.timestamp >= seven_days_ago).group_by(func.date(Sale.timestamp)).all()
-            
-            sales_dates = [str(s[0]) for s in sales_by_date]
-            sales_amounts = [float(s[1]) if s[1] else 0 for s in sales_by_date]
-            
-            # Stock levels
-            medicines = Medicine.query.all()
-            stock_labels = [m.name for m in medicines[:10]]  # Top 10
-            stock_quantities = [m.quantity for m in medicines[:10]]
-            
-            # Expiry alerts
-            today = date.today()
-            thirty_days = today + timedelta(days=30)
-            expiring_soon = Medicine.query.filter(
-                Medicine.expiry_date.isnot(None),
-                Medicine.expiry_date <= thirty_days,
-                Medicine.expiry_date > today
-            ).all()
-            
-            expired = Medicine.query.filter(
-                Medicine.expiry_date.isnot(None),
-                Medicine.expiry_date <= today
-            ).all()
-            
-            # Statistics
-            total_medicines = Medicine.query.count()
-            total_stock = db.session.query(func.sum(Medicine.quantity)).scalar() or 0
-            total_sales = db.session.query(func.sum(Sale.total_price)).scalar() or 0
-            
-            return render_template('dashboard.html',
-                                 sales_dates=sales_dates,
-                                 sales_amounts=sales_amounts,
-                                 stock_labels=stock_labels,
-                                 stock_quantities=stock_quantities,
-                                 expiring_soon=expiring_soon,
-                                 expired=expired,
-                                 total_medicines=total_medicines,
-                                 total_stock=total_stock,
-                                 total_sales=total_sales)
+            return render_template('dashboard.html', **dashboard_payload())
         except Exception as e:
             flash(f'Dashboard error: {str(e)}', 'danger')
             return render_template('dashboard.html',
@@ -397,19 +443,149 @@ self.addEventListener('fetch', (event) => {
                                  total_stock=0,
                                  total_sales=0)
 
+    @app.route('/api/dashboard')
+    @limiter.exempt
+    @conditional
+    def api_dashboard():
+        """Dashboard data as JSON (cached briefly, cleared on sale and medicine writes).
+
+        Polled by every open dashboard, so exempt from the rate limit; unchanged
+        data is answered with a 304.
+        """
+        response = jsonify(dashboard_payload())
+        response.cache_control.max_age = cache.dashboard_payload.ttl
+        return response
+
     # ---------- Medicine Inventory Routes ----------
+    # Default "low stock" level and "expiring soon" window of the medicines list
+    LOW_STOCK_THRESHOLD = 5
+    EXPIRY_WINDOW_DAYS = 30
+
+    def medicine_filters(args):
+        """Parse the medicines list filters from the query string."""
+        def number(name, default, lo, hi):
+            try:
+                return min(max(int(args.get(name, default)), lo), hi)
+            except (TypeError, ValueError):
+                return default
+        return {
+            'q': args.get('q', '').strip(),
+            'category': args.get('category', '').strip(),
+            'stock': args.get('stock', '') if args.get('stock') in ('low', 'out') else '',
+            'low': number('low', LOW_STOCK_THRESHOLD, 0, 100000),
+            'expiry': args.get('expiry', '') if args.get('expiry') in ('expired', 'expiring') else '',
+            'days': number('days', EXPIRY_WINDOW_DAYS, 1, 3650),
+            'page': number('page', 1, 1, 1000000),
+            'per_page': number('per_page', 50, 1, 200),
+        }
+
+    def medicine_page(f, today):
+        """One page of the medicines list as JSON-ready dicts, plus pagination info.
+
+        Every filter is a range or equality on an indexed column (lower(name),
+        category, quantity, expiry_date), and only the first 100 characters of
+        the description are fetched.
+        """
+        query = db.session.query(
+            Medicine.id, Medicine.name, Medicine.brand, Medicine.category,
+            func.substr(Medicine.description, 1, 101).label('description'),
+            Medicine.cost_price, Medicine.price, Medicine.quantity, Medicine.expiry_date,
+        )
+        if f['q']:
+            query = query.filter(_prefix_filter(func.lower(Medicine.name), f['q'].lower()))
+        if f['category']:
+            query = query.filter(Medicine.category == f['category'])
+        if f['stock'] == 'out':
+            query = query.filter(Medicine.quantity <= 0)
+        elif f['stock'] == 'low':
+            query = query.filter(Medicine.quantity <= f['low'])
+        if f['expiry'] == 'expired':
+            query = query.filter(Medicine.expiry_date < today)
+        elif f['expiry'] == 'expiring':
+            query = query.filter(Medicine.expiry_date >= today, Medicine.expiry_date <= today + timedelta(days=f['days']))
+
+        total = query.order_by(None).count()
+        per_page = f['per_page']
+        pages = max((total + per_page - 1) // per_page, 1)
+        page = min(f['page'], pages)
+        rows = query.order_by(Medicine.name, Medicine.id).offset((page - 1) * per_page).limit(per_page).all()
+
+        near = today + timedelta(days=EXPIRY_WINDOW_DAYS)
+        items = []
+        for r in rows:
+            description = r.description or ''
+            cost = r.cost_price or 0
+            items.append({
+                'id': r.id,
+                'name': r.name,
+                'brand': r.brand,
+                'category': r.category,
+                'description': description[:100] + ('...' if len(description) > 100 else ''),
+                'cost_price': cost,
+                'price': r.price,
+                'quantity': r.quantity,
+                'stock_cost': round(cost * r.quantity, 2),
+                'expiry_date': r.expiry_date.isoformat() if r.expiry_date else None,
+                'low_stock': 0 < r.quantity <= f['low'],
+                'expired': r.expiry_date is not None and r.expiry_date < today,
+                'near_expiry': r.expiry_date is not None and today <= r.expiry_date <= near,
+            })
+        pagination = {
+            'page': page,
+            'pages': pages,
+            'total': total,
+            'per_page': per_page,
+            'has_prev': page > 1,
+            'has_next': page < pages,
+        }
+        return items, pagination
+
     @app.route('/medicines')
+    @conditional
     def medicines():
-        medicines = Medicine.query.order_by(Medicine.name).all()
-        low_stock_threshold = 5
-        return render_template('medicines.html', medicines=medicines, low_stock_threshold=low_stock_threshold, today=date.today())
+        f = medicine_filters(request.args)
+        items, pagination = medicine_page(f, date.today())
+        if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+            return jsonify({'items': items, 'pagination': pagination, 'filters': f})
+        categories = [c for (c,) in db.session.query(Medicine.category).filter(
+            Medicine.category.isnot(None), Medicine.category != ''
+        ).distinct().order_by(Medicine.category)]
+        return render_template('medicines.html', medicines=items, pagination=pagination, filters=f, categories=categories)
+
+    # Fields sent to offline tills, in row order
+    SYNC_MEDICINE_FIELDS = ('id', 'name', 'brand', 'category', 'price', 'quantity', 'expiry_date')
+    SYNC_CUSTOMER_FIELDS = ('id', 'name', 'phone')
+
+    @app.route('/api/medicines/changes')
+    @limiter.exempt
+    def medicine_changes():
+        """Medicines and customers changed after `since` (omit it for the full catalog)."""
+        since = request.args.get('since', type=int)
+        version = changes.current_version()
+        etag = f'{version}-{since if since is not None else "all"}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        medicines, deleted_medicines = changes.changed_since(Medicine, SYNC_MEDICINE_FIELDS, since)
+        customers, deleted_customers = changes.changed_since(Customer, SYNC_CUSTOMER_FIELDS, since)
+        response = jsonify({
+            'version': version,
+            'full': since is None,
+            'medicines': {'fields': SYNC_MEDICINE_FIELDS, 'rows': medicines, 'deleted': deleted_medicines},
+            'customers': {'fields': SYNC_CUSTOMER_FIELDS, 'rows': customers, 'deleted': deleted_customers},
+        })
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
 
     @app.route('/medicines/add', methods=['GET', 'POST'])
     @admin_required
     def add_medicine():
         if request.method == 'POST':
             try:
-                name = request.form['name']
+                name = request.form['name'].strip()
                 brand = request.form.get('brand')
                 cost_price = float(request.form['cost_price'])
                 price = float(request.form['price'])
@@ -422,6 +598,7 @@ self.addEventListener('fetch', (event) => {
                 med = Medicine(name=name, brand=brand, cost_price=cost_price, price=price, quantity=quantity, expiry_date=expiry_date, category=category, description=description)
                 db.session.add(med)
                 db.session.commit()
+                cache.medicines_changed()
                 flash('Medicine added successfully.', 'success')
                 return redirect(url_for('medicines'))
             except ValueError as e:
@@ -434,6 +611,32 @@ self.addEventListener('fetch', (event) => {
 
         return render_template('add_medicine.html')
 
+    @app.route('/medicines/import', methods=['GET', 'POST'])
+    @admin_required
+    def import_medicines():
+        result = None
+        if request.method == 'POST':
+            upload = request.files.get('file')
+            if not upload or not upload.filename:
+                flash('Choose a CSV or Excel file to import.', 'warning')
+                return redirect(url_for('import_medicines'))
+            try:
+                result = inventory_import.import_medicines(
+                    inventory_import.read_rows(upload.stream, upload.filename),
+                    set_quantity=request.form.get('mode') == 'set',
+                )
+            except inventory_import.ImportFileError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('import_medicines'))
+            except Exception as e:
+                flash(f'Error importing medicines: {str(e)}', 'danger')
+                return redirect(url_for('import_medicines'))
+            cache.medicines_changed()
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({**result, 'errors': [{'row': n, 'error': m} for n, m in result['errors']]})
+            flash(f"Imported {result['inserted']} new and {result['updated']} existing medicines.", 'success')
+        return render_template('import_medicines.html', result=result, columns=inventory_import.COLUMNS)
+
     @app.route('/medicines/update/<int:med_id>', methods=['GET', 'POST'])
     @admin_required
     def update_medicine(med_id):
@@ -441,7 +644,7 @@ self.addEventListener('fetch', (event) => {
         if request.method == 'POST':
             try:
                 # Update all editable fields
-                med.name = request.form.get('name') or med.name
+                med.name = (request.form.get('name') or '').strip() or med.name
                 med.brand = request.form.get('brand') or med.brand
                 med.category = request.form.get('category') or med.category
                 med.cost_price = float(request.form.get('cost_price') or med.cost_price)
@@ -451,6 +654,7 @@ self.addEventListener('fetch', (event) => {
                 med.expiry_date = datetime.strptime(expiry, '%Y-%m-%d').date() if expiry else None
                 med.description = request.form.get('description') or med.description
                 db.session.commit()
+                cache.medicines_changed()
                 flash('Medicine updated.', 'success')
                 return redirect(url_for('medicines'))
             except ValueError as e:
@@ -469,15 +673,56 @@ self.addEventListener('fetch', (event) => {
         med = Medicine.query.get_or_404(med_id)
         db.session.delete(med)
         db.session.commit()
+        cache.medicines_changed()
         flash('Medicine deleted.', 'info')
         return redirect(url_for('medicines'))
 
     # ---------- Sales & Billing Routes ----------
+    # Largest number of suggestions a lookup returns
+    LOOKUP_LIMIT = 25
+
+    def lookup_args():
+        q = request.args.get('q', '').strip().lower()
+        limit = min(max(request.args.get('limit', 10, type=int), 1), LOOKUP_LIMIT)
+        return q, limit
+
+    @app.route('/api/medicines/lookup')
+    @limiter.exempt
+    def medicine_lookup():
+        """In-stock medicines whose name starts with `q` (typeahead on the sale form)."""
+        q, limit = lookup_args()
+
+        def compute():
+            query = db.session.query(Medicine.id, Medicine.name, Medicine.brand, Medicine.price, Medicine.quantity)
+            query = query.filter(Medicine.quantity > 0)
+            if q:
+                query = query.filter(_prefix_filter(func.lower(Medicine.name), q))
+            rows = query.order_by(func.lower(Medicine.name), Medicine.id).limit(limit).all()
+            return [{'id': r.id, 'name': r.name, 'brand': r.brand, 'price': r.price, 'quantity': r.quantity} for r in rows]
+
+        return jsonify(cache.medicine_lookup.get_or_set((q, limit), compute))
+
+    @app.route('/api/customers/lookup')
+    @limiter.exempt
+    def customer_lookup():
+        """Customers whose name (or phone number, for digits) starts with `q`."""
+        q, limit = lookup_args()
+
+        def compute():
+            query = db.session.query(Customer.id, Customer.name, Customer.phone)
+            if q.isdigit():
+                query = query.filter(_prefix_filter(Customer.phone, q)).order_by(Customer.phone, Customer.id)
+            else:
+                if q:
+                    query = query.filter(_prefix_filter(func.lower(Customer.name), q))
+                query = query.order_by(func.lower(Customer.name), Customer.id)
+            return [{'id': r.id, 'name': r.name, 'phone': r.phone} for r in query.limit(limit).all()]
+
+        return jsonify(cache.customer_lookup.get_or_set((q, limit), compute))
+
     @app.route('/sales/new', methods=['GET', 'POST'])
     def new_sale():
-        medicines = Medicine.query.filter(Medicine.quantity > 0).order_by(Medicine.name).all()
-        customers = Customer.query.order_by(Customer.name).all()
-        
+        # Medicines and customers are picked with /api/*/lookup, so nothing is preloaded here
         if request.method == 'POST':
             # Handle both form submissions and JSON API requests (from offline mode)
             is_json = request.is_json
@@ -487,37 +732,31 @@ self.addEventListener('fetch', (event) => {
                     med_id = int(data.get('medicine_id'))
                     qty = int(data.get('quantity'))
                     customer_id = data.get('customer_id')
+                    lines = [(med_id, qty)]
                 else:
-                    med_id = int(request.form['medicine_id'])
-                    qty = int(request.form['quantity'])
+                    # The form can carry several medicine_id/quantity pairs (a cart)
+                    lines = [(int(m), int(q)) for m, q in zip(request.form.getlist('medicine_id'), request.form.getlist('quantity')) if m]
+                    if not lines:
+                        raise ValueError('no items')
                     customer_id = request.form.get('customer_id') or None
 
-                med = Medicine.query.get_or_404(med_id)
-                if qty <= 0:
-                    msg = 'Quantity must be positive.'
-                    if is_json:
-                        return jsonify({'error': msg}), 400
-                    flash(msg, 'danger')
-                    return redirect(url_for('new_sale'))
-                if med.quantity < qty:
-                    msg = 'Not enough stock for that medicine.'
+                try:
+                    sale = sales.record_cart(lines, customer_id=int(customer_id) if customer_id else None)
+                except sales.UnknownMedicine:
+                    db.session.rollback()
+                    abort(404)
+                except sales.SaleError as e:
+                    db.session.rollback()
+                    msg = 'Not enough stock for that medicine.' if isinstance(e, sales.InsufficientStock) else str(e)
                     if is_json:
                         return jsonify({'error': msg}), 400
                     flash(msg, 'danger')
                     return redirect(url_for('new_sale'))
-
-                price_per_unit = med.price
-                total_price = round(price_per_unit * qty, 2)
-
-                # Reduce stock
-                med.quantity -= qty
-
-                sale = Sale(medicine=med, quantity=qty, price_per_unit=price_per_unit, total_price=total_price, customer_id=int(customer_id) if customer_id else None)
-                db.session.add(sale)
                 db.session.commit()
+                cache.sales_changed()
                 
                 if is_json:
-                  return jsonify({'success': True, 'sale_id': sale.id, 'total': total_price}), 201
+                  return jsonify({'success': True, 'sale_id': sale.id, 'total': sale.total_price}), 201
                 
                 flash('Sale recorded.', 'success')
                 return redirect(url_for('receipt', sale_id=sale.id))
@@ -535,7 +774,43 @@ self.addEventListener('fetch', (event) => {
                 flash(msg, 'danger')
                 return redirect(url_for('new_sale'))
 
-        return render_template('new_sale.html', medicines=medicines, customers=customers)
+        return render_template('new_sale.html')
+
+    @app.route('/sales/cart', methods=['POST'])
+    def cart_sale():
+        """Record a multi-line sale in one transaction.
+
+        Expects JSON `{"items": [{"medicine_id": 1, "quantity": 2}, ...], "customer_id": null}`.
+        Either every line is recorded or none is.
+        """
+        data = request.get_json(silent=True) or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'No items provided'}), 400
+        try:
+            lines = [(int(item['medicine_id']), int(item['quantity'])) for item in items]
+            customer_id = int(data['customer_id']) if data.get('customer_id') else None
+        except (KeyError, ValueError, TypeError):
+            return jsonify({'error': 'Invalid medicine, quantity or customer.'}), 400
+
+        try:
+            sale = sales.record_cart(lines, customer_id=customer_id)
+            db.session.commit()
+        except sales.SaleError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e), 'status': e.status}), 404 if isinstance(e, sales.UnknownMedicine) else 400
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': f'Error recording sale: {str(e)}'}), 500
+        cache.sales_changed()
+
+        return jsonify({
+            'success': True,
+            'sale_id': sale.id,
+            'total': sale.total_price,
+            'items': [{'medicine_id': i.medicine_id, 'quantity': i.quantity, 'total': i.total_price} for i in sale.items],
+            'receipt_url': url_for('receipt', sale_id=sale.id),
+        }), 201
 
     # Offline sync endpoint - CSRF exempt for JSON requests
     @app.route('/sales/sync', methods=['POST'])
@@ -553,6 +828,14 @@ self.addEventListener('fetch', (event) => {
             med_id = data.get('medicine_id')
             qty = data.get('quantity')
             customer_id = data.get('customer_id')
+            client_ref = _client_ref(data)
+
+            # A retried sync of an already recorded sale returns the original
+            if client_ref:
+                existing = sales.recorded_refs([client_ref]).get(client_ref)
+                if existing:
+                    return jsonify({'success': True, 'sale_id': existing[0], 'total': existing[1], 'duplicate': True,
+                                    'op_id': client_ref, 'acked_through': _op_seq(data)}), 200
             
             if not med_id or not qty:
                 return jsonify({'error': 'Missing medicine_id or quantity'}), 400
@@ -567,38 +850,120 @@ self.addEventListener('fetch', (event) => {
             if (datetime.now() - start_time).total_seconds() > timeout:
                 return jsonify({'error': 'Request timeout'}), 504
             
-            med = Medicine.query.filter_by(id=med_id).first()
-            if not med:
-                return jsonify({'error': f'Medicine not found'}), 404
+            try:
+                sale = sales.record_sale(med_id, qty, customer_id=int(customer_id) if customer_id else None, client_ref=client_ref)
+            except sales.SaleError as e:
+                db.session.rollback()
+                return jsonify({'error': str(e)}), 404 if isinstance(e, sales.UnknownMedicine) else 400
+            db.session.commit()
+            cache.sales_changed()
+            
+            return jsonify({'success': True, 'sale_id': sale.id, 'total': sale.total_price,
+                            'op_id': client_ref, 'acked_through': _op_seq(data) if client_ref else None}), 201
             
-            if qty <= 0:
-                return jsonify({'error': 'Quantity must be positive'}), 400
-            if med.quantity < qty:
-                return jsonify({'error': f'Insufficient stock. Available: {med.quantity}, Requested: {qty}'}), 400
-
-            price_per_unit = med.price
-            total_price = round(price_per_unit * qty, 2)
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-            # Reduce stock
-            med.quantity -= qty
+    # Bulk offline sync - one transaction for a whole chunk of the queue
+    @app.route('/sales/sync/batch', methods=['POST'])
+    @csrf.exempt
+    def sync_sales_batch():
+        """Record many queued offline sales at once.
+
+        Accepts `{"sales": [...]}` (or a bare list) where each item looks like a
+        `/sales/sync` payload plus its client operation id (`op_id`) and queue
+        position (`seq`), sent in queue order. Every item gets its own result,
+        echoing its `op_id`; items already recorded are reported as duplicates.
+
+        `acked_through` is the `seq` of the last item of the longest leading
+        run that is now recorded (ok or duplicate): the till can drop all of
+        those from its queue with one range delete. It is null when the first
+        item was not recorded.
+        """
+        data = request.get_json(silent=True)
+        items = data.get('sales') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'No sales provided'}), 400
+        if len(items) > SYNC_BATCH_LIMIT:
+            return jsonify({'error': f'Too many sales in one batch (max {SYNC_BATCH_LIMIT})'}), 413
 
-            sale = Sale(medicine=med, quantity=qty, price_per_unit=price_per_unit, total_price=total_price, customer_id=int(customer_id) if customer_id else None)
-            db.session.add(sale)
+        try:
+            # Live or archived: a retried queue entry is a duplicate whenever it was recorded
+            already = {ref: sale_id for ref, (sale_id, _) in
+                       sales.recorded_refs(_client_ref(item) for item in items if isinstance(item, dict)).items()}
+
+            med_ids = set()
+            for item in items:
+                try:
+                    med_ids.add(int(item.get('medicine_id')))
+                except (AttributeError, ValueError, TypeError):
+                    pass
+            # Lock each medicine row once for the whole batch; record_sale skips rows already locked
+            sales.lock_medicines(med_ids)
+
+            results = []
+            recorded = []  # (result, sale) pairs whose sale id is known after commit
+            batch_sales = {}
+            for item in items:
+                if not isinstance(item, dict):
+                    results.append({'status': 'invalid', 'error': 'Sale must be an object'})
+                    continue
+                client_ref = _client_ref(item)
+                result = {'op_id': client_ref, 'client_ref': client_ref}
+                results.append(result)
+                if client_ref and client_ref in already:
+                    result.update(status='duplicate', sale_id=already[client_ref])
+                    continue
+                if client_ref and client_ref in batch_sales:
+                    # The same queue entry appearing twice in one batch
+                    result.update(status='duplicate')
+                    recorded.append((result, batch_sales[client_ref]))
+                    continue
+                try:
+                    med_id = int(item.get('medicine_id'))
+                    qty = int(item.get('quantity'))
+                    customer_id = int(item['customer_id']) if item.get('customer_id') else None
+                except (ValueError, TypeError):
+                    result.update(status='invalid', error='Invalid medicine_id, quantity or customer_id')
+                    continue
+                try:
+                    sale = sales.record_sale(med_id, qty, customer_id=customer_id, client_ref=client_ref)
+                except sales.SaleError as e:
+                    result.update(status=e.status, error=str(e))
+                    continue
+                recorded.append((result, sale))
+                if client_ref:
+                    batch_sales[client_ref] = sale
+                result.update(status='ok', total=sale.total_price)
+
+            # Read the new ids before commit expires the sales (one SELECT each afterwards)
+            db.session.flush()
+            for result, sale in recorded:
+                result['sale_id'] = sale.id
             db.session.commit()
-            
-            return jsonify({'success': True, 'sale_id': sale.id, 'total': total_price}), 201
-            
+            if recorded:
+                cache.sales_changed()
+            synced = sum(1 for r in results if r.get('status') in ACKNOWLEDGED)
+            acked_through = None
+            for item, result in zip(items, results):
+                seq = _op_seq(item) if isinstance(item, dict) else None
+                if result.get('status') not in ACKNOWLEDGED or not result.get('op_id') or seq is None:
+                    break
+                acked_through = seq
+            return jsonify({'success': True, 'synced': synced, 'results': results, 'acked_through': acked_through}), 200
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': f'Server error: {str(e)}'}), 500
 
     @app.route('/sales/receipt/<int:sale_id>')
     def receipt(sale_id):
-        sale = Sale.query.get_or_404(sale_id)
+        sale = Sale.query.options(selectinload(Sale.items).joinedload(SaleItem.medicine), joinedload(Sale.customer)).filter_by(id=sale_id).first_or_404()
         return render_template('receipt.html', sale=sale)
 
     # ---------- Customers ----------
     @app.route('/customers', methods=['GET', 'POST'])
+    @conditional
     def customers():
         if request.method == 'POST':
             try:
@@ -610,6 +975,7 @@ self.addEventListener('fetch', (event) => {
                 cust = Customer(name=name, phone=phone)
                 db.session.add(cust)
                 db.session.commit()
+                cache.customers_changed()
                 flash('Customer added.', 'success')
                 return redirect(url_for('customers'))
             except Exception as e:
@@ -622,44 +988,28 @@ self.addEventListener('fetch', (event) => {
     # ---------- Reports (MVP level) ----------
     @app.route('/reports')
     @admin_required
+    @replica_reads
+    @conditional
     def reports():
         """Main reports page with advanced analytics"""
-        today = date.today()
+        # Sales are bucketed by their stored business date (shop timezone, day cutoff)
+        today = business_day.today()
         
         # ===== DAILY SALES =====
-        start = datetime(today.year, today.month, today.day)
-        end = datetime(today.year, today.month, today.day, 23, 59, 59)
-        daily_sales = Sale.query.filter(Sale.timestamp >= start, Sale.timestamp <= end).order_by(Sale.timestamp.desc()).all()
-        total_daily = sum(s.total_price for s in daily_sales)
+        daily_sales = Sale.query.options(selectinload(Sale.items).joinedload(SaleItem.medicine)).filter(Sale.sale_date == today).order_by(Sale.timestamp.desc()).all()
+        # Sales figures come from the in-memory analytics arrays (analytics.py)
+        total_daily = analytics.totals(today, today)['revenue']
 
         # ===== WEEKLY SALES =====
-        seven_days_ago = today - timedelta(days=7)
-        week_start = datetime(seven_days_ago.year, seven_days_ago.month, seven_days_ago.day)
-        weekly_sales = db.session.query(
-            func.date(Sale.timestamp).label('date'),
-            func.sum(Sale.total_price).label('total'),
-            func.count(Sale.id).label('count')
-        ).filter(Sale.timestamp >= week_start).group_by(func.date(Sale.timestamp)).order_by('date').all()
+        weekly_sales = analytics.daily(today - timedelta(days=7))
         total_weekly = sum(w[1] for w in weekly_sales) if weekly_sales else 0
 
         # ===== MONTHLY SALES =====
-        thirty_days_ago = today - timedelta(days=30)
-        month_start = datetime(thirty_days_ago.year, thirty_days_ago.month, thirty_days_ago.day)
-        monthly_sales = db.session.query(
-            func.date(Sale.timestamp).label('date'),
-            func.sum(Sale.total_price).label('total'),
-            func.count(Sale.id).label('count')
-        ).filter(Sale.timestamp >= month_start).group_by(func.date(Sale.timestamp)).order_by('date').all()
+        monthly_sales = analytics.daily(today - timedelta(days=30))
         total_monthly = sum(m[1] for m in monthly_sales) if monthly_sales else 0
 
         # ===== BEST-SELLING MEDICINES =====
-        best_sellers = db.session.query(
-            Medicine.id,
-            Medicine.name,
-            Medicine.price,
-            func.sum(Sale.quantity).label('total_qty'),
-            func.sum(Sale.total_price).label('total_revenue')
-        ).join(Sale).group_by(Medicine.id, Medicine.name, Medicine.price).order_by(func.sum(Sale.quantity).desc()).limit(10).all()
+        best_sellers = analytics.best_sellers(10)
 
         # ===== EXPIRED STOCK REPORT =====
         today = date.today()
@@ -675,17 +1025,16 @@ self.addEventListener('fetch', (event) => {
         ).order_by(Medicine.expiry_date).all()
 
         # ===== PROFIT & LOSS =====
-        all_sales = Sale.query.all()
-        total_revenue = sum(s.total_price for s in all_sales)
-        
-        # Calculate total cost using actual cost price from medicine (with fallback to 0)
-        total_cost = sum((getattr(sale.medicine, 'cost_price', None) or 0) * sale.quantity for sale in all_sales)
-        
+        # All-time totals, from the cost stored on each sale
+        all_time = analytics.totals()
+        total_revenue = all_time['revenue']
+        total_cost = all_time['cost']
+
         total_profit = total_revenue - total_cost
         profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
 
         # Total sales summary (all time)
-        total_all = sum(s.total_price for s in all_sales)
+        total_all = total_revenue
 
         # Stock report
         medicines = Medicine.query.order_by(Medicine.name).all()
@@ -712,128 +1061,187 @@ self.addEventListener('fetch', (event) => {
                              total_stock_cost=total_stock_cost,
                              today=today)
 
+    @app.route('/api/reports/custom')
+    @admin_required
+    @replica_reads
+    @conditional
+    def custom_report():
+        """Ad-hoc sales report: ?group=category,brand&bucket=week&from=YYYY-MM-DD&to=YYYY-MM-DD.
+
+        `group` takes any of medicine, category, brand; `bucket` one of day,
+        week, month, year. Dates are business dates and both are optional.
+        """
+        group_by = tuple(g.strip() for g in request.args.get('group', '').split(',') if g.strip())
+        bucket = request.args.get('bucket') or None
+        try:
+            start = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+            end = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+            rows = analytics.report(group_by=group_by, bucket=bucket, start=start, end=end)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'group': list(group_by),
+            'bucket': bucket,
+            'from': start.isoformat() if start else None,
+            'to': end.isoformat() if end else None,
+            'rows': rows,
+        })
+
     @app.route('/sales/search')
     @admin_required
+    @replica_reads
+    @conditional
     def search_sales():
         # Dedicated sales search endpoint, separate from reports
         q = request.args.get('q', '').strip()
         from_date = request.args.get('from_date')
         to_date = request.args.get('to_date')
 
-        all_sales_q = Sale.query
-        # Filter by date range if provided
-        try:
-            if from_date:
-                fd = datetime.strptime(from_date, '%Y-%m-%d')
-                all_sales_q = all_sales_q.filter(Sale.timestamp >= fd)
-            if to_date:
-                td = datetime.strptime(to_date, '%Y-%m-%d')
-                td_end = datetime(td.year, td.month, td.day, 23, 59, 59)
-                all_sales_q = all_sales_q.filter(Sale.timestamp <= td_end)
-        except Exception:
-            pass
-
-        if q:
-            if q.isdigit():
-                all_sales_q = all_sales_q.filter(Sale.id == int(q))
-            else:
-                all_sales_q = all_sales_q.join(Sale.medicine).outerjoin(Sale.customer).filter(
-                    (Medicine.name.ilike(f"%{q}%")) |
-                    (Customer.name.ilike(f"%{q}%"))
-                )
+        # Filter by date range and text if provided
+        all_sales_q = exports.filter_sales(Sale.query, q, from_date, to_date)
 
         try:
-            page = int(request.args.get('page', 1))
+            page = max(int(request.args.get('page', 1)), 1)
         except Exception:
             page = 1
         try:
-            per_page = int(request.args.get('per_page', 10))
+            per_page = min(max(int(request.args.get('per_page', 10)), 1), 200)
         except Exception:
             per_page = 10
 
-        pagination = all_sales_q.order_by(Sale.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
-        all_sales = pagination.items
+        # Keyset pagination on (timestamp, id): `after` walks forward, `before` walks back
+        after = _parse_cursor(request.args.get('after'))
+        before = _parse_cursor(request.args.get('before'))
+        page_q = all_sales_q.options(selectinload(Sale.items).joinedload(SaleItem.medicine), joinedload(Sale.customer))
+        if before:
+            ts, sid = before
+            page_q = page_q.filter(or_(Sale.timestamp > ts, and_(Sale.timestamp == ts, Sale.id > sid)))
+            rows = page_q.order_by(Sale.timestamp.asc(), Sale.id.asc()).limit(per_page + 1).all()
+            has_more_before = len(rows) > per_page
+            all_sales = list(reversed(rows[:per_page]))
+            has_prev, has_next = has_more_before, True
+        else:
+            if after:
+                ts, sid = after
+                page_q = page_q.filter(or_(Sale.timestamp < ts, and_(Sale.timestamp == ts, Sale.id < sid)))
+            rows = page_q.order_by(Sale.timestamp.desc(), Sale.id.desc()).limit(per_page + 1).all()
+            all_sales = rows[:per_page]
+            has_prev, has_next = after is not None, len(rows) > per_page
+        if not has_prev:
+            page = 1
 
-        total_all_val = db.session.query(func.coalesce(func.sum(Sale.total_price), 0.0)).select_from(all_sales_q.subquery()).scalar()
-        try:
-            total_all = float(total_all_val)
-        except Exception:
-            total_all = sum(s.total_price for s in all_sales)
+        # Count and sum for the whole filter set are cached briefly and cleared on sale writes
+        cache_key = (q, from_date or '', to_date or '')
+        totals = cache.sales_search_totals.get(cache_key)
+        if totals is None:
+            totals_q = db.session.query(func.count(Sale.id), func.coalesce(func.sum(Sale.total_price), 0.0)).select_from(Sale)
+            count, total = exports.filter_sales(totals_q, q, from_date, to_date).one()
+            totals = (int(count), float(total))
+            cache.sales_search_totals.set(cache_key, totals)
+        total_count, total_all = totals
+
+        pagination = {
+            'page': page,
+            'pages': max((total_count + per_page - 1) // per_page, 1),
+            'total': total_count,
+            'per_page': per_page,
+            'has_prev': has_prev,
+            'has_next': has_next,
+            'prev_cursor': _format_cursor(all_sales[0]) if all_sales and has_prev else None,
+            'next_cursor': _format_cursor(all_sales[-1]) if all_sales and has_next else None,
+        }
 
         return render_template('search_sales.html', all_sales=all_sales, pagination=pagination, total_all=total_all, q=q, from_date=from_date, to_date=to_date)
 
     @app.route('/sales/export')
     @admin_required
+    @replica_reads
     def export_sales():
-        # Export sales matching the search filters to an Excel file
-        try:
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, Alignment
-        except ImportError:
-            flash('The Excel export feature requires the openpyxl package. Please run `pip install openpyxl` in your virtualenv.', 'warning')
-            return redirect(url_for('search_sales'))
+        """Stream sales matching the search filters as .xlsx (default) or .csv.
+
+        One row per sale line. Rows are fetched in chunks with medicine and
+        customer names joined in, so memory stays flat however many sales are exported.
+        """
+        fmt = request.args.get('format', 'xlsx').lower()
         q = request.args.get('q', '').strip()
         from_date = request.args.get('from_date')
         to_date = request.args.get('to_date')
 
-        all_sales_q = Sale.query
-        try:
-            if from_date:
-                fd = datetime.strptime(from_date, '%Y-%m-%d')
-                all_sales_q = all_sales_q.filter(Sale.timestamp >= fd)
-            if to_date:
-                td = datetime.strptime(to_date, '%Y-%m-%d')
-                td_end = datetime(td.year, td.month, td.day, 23, 59, 59)
-                all_sales_q = all_sales_q.filter(Sale.timestamp <= td_end)
-        except Exception:
-            pass
+        rows = exports.sales_cells(exports.sales_lines(q, from_date, to_date))
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
 
-        if q:
-            if q.isdigit():
-                all_sales_q = all_sales_q.filter(Sale.id == int(q))
-            else:
-                all_sales_q = all_sales_q.join(Sale.medicine).outerjoin(Sale.customer).filter(
-                    (Medicine.name.ilike(f"%{q}%")) |
-                    (Customer.name.ilike(f"%{q}%"))
-                )
+        if fmt == 'csv':
+            response = Response(stream_with_context(exports.csv_chunks(exports.SALES_HEADERS, rows)), mimetype='text/csv')
+            response.headers['Content-Disposition'] = f'attachment; filename=sales_export_{stamp}.csv'
+            return response
 
-        sales = all_sales_q.order_by(Sale.timestamp.desc()).all()
-
-        # Build Excel workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = 'Sales'
-
-        headers = ['ID', 'Medicine', 'Customer', 'Quantity', 'Price per Unit', 'Total Price', 'Timestamp']
-        bold = Font(bold=True)
-        for col, h in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col, value=h)
-            cell.font = bold
-            cell.alignment = Alignment(horizontal='center')
-
-        for r, s in enumerate(sales, start=2):
-            ws.cell(row=r, column=1, value=s.id)
-            ws.cell(row=r, column=2, value=s.medicine.name if s.medicine else '')
-            ws.cell(row=r, column=3, value=s.customer.name if s.customer else '')
-            ws.cell(row=r, column=4, value=s.quantity)
-            pcu = ws.cell(row=r, column=5, value=s.price_per_unit)
-            pcu.number_format = '#,##0.00'
-            tot = ws.cell(row=r, column=6, value=s.total_price)
-            tot.number_format = '#,##0.00'
-            ts = ws.cell(row=r, column=7, value=s.timestamp.strftime('%Y-%m-%d %H:%M:%S') if s.timestamp else '')
-            ts.alignment = Alignment(horizontal='center')
-
-        # Simple column widths
-        widths = [8, 30, 25, 10, 15, 15, 20]
-        for i, w in enumerate(widths, start=1):
-            ws.column_dimensions[ws.cell(row=1, column=i).column_letter].width = w
-
-        out = BytesIO()
-        wb.save(out)
+        # The xlsx zip can only be finished once all rows are in; spool it to disk
+        out = tempfile.TemporaryFile()
+        try:
+            exports.write_xlsx(out, 'Sales', exports.SALES_HEADERS, rows, exports.SALES_WIDTHS)
+        except ImportError:
+            out.close()
+            flash('The Excel export feature requires the openpyxl package. Please run `pip install openpyxl` in your virtualenv.', 'warning')
+            return redirect(url_for('search_sales'))
         out.seek(0)
 
-        filename = f"sales_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        return send_file(out, download_name=filename, as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        filename = f"sales_export_{stamp}.xlsx"
+        return send_file(out, download_name=filename, as_attachment=True, mimetype=exports.XLSX_MIMETYPE)
+
+    # ---------- Background jobs ----------
+    def job_status(job):
+        status = jobs.describe(job)
+        status['url'] = url_for('job_detail', job_id=job.id)
+        status['download_url'] = url_for('job_download', job_id=job.id) if job.status == 'done' else None
+        return status
+
+    @app.route('/jobs', methods=['POST'])
+    @admin_required
+    def create_job():
+        """Queue an export or report snapshot; returns 202 and the job to poll.
+
+        `kind` is 'export' (q, from_date, to_date, format as on /sales/export)
+        or 'report' (group, bucket, from, to, format as on /api/reports/custom).
+        An identical request for unchanged data returns the existing job.
+        """
+        data = request.get_json(silent=True) or request.form.to_dict()
+        try:
+            job, created = jobs.enqueue(data.get('kind', ''), data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        status = job_status(job)
+        status['deduplicated'] = not created
+        response = jsonify(status)
+        response.status_code = 202
+        response.headers['Location'] = status['url']
+        return response
+
+    @app.route('/jobs/<int:job_id>')
+    @limiter.exempt
+    @admin_required
+    def job_detail(job_id):
+        """Progress of a background job (polled by the page that queued it)."""
+        job = db.session.get(Job, job_id)
+        if job is None:
+            abort(404)
+        if job.status in jobs.ACTIVE:
+            # Picks up jobs left behind by a worker that has since exited
+            jobs.kick()
+        return jsonify(job_status(job))
+
+    @app.route('/jobs/<int:job_id>/download')
+    @admin_required
+    def job_download(job_id):
+        job = db.session.get(Job, job_id)
+        if job is None or job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+            abort(404)
+        mimetype = 'text/csv' if job.result_path.endswith('.csv') else exports.XLSX_MIMETYPE
+        return send_file(job.result_path, download_name=job.result_name, as_attachment=True, mimetype=mimetype)
+
+    def reset_cutoff(period):
+        """Sales older than this are archived by a reset of `period` (None if unknown)."""
+        days = {'daily': 1, 'weekly': 7, 'monthly': 30, 'half_yearly': 180, 'yearly': 365}.get(period)
+        return datetime.now() - timedelta(days=days) if days else None
 
     @app.route('/reports/reset/confirm', methods=['POST'])
     @admin_required
@@ -844,25 +1252,13 @@ self.addEventListener('fetch', (event) => {
                 flash('Please select a reset period.', 'danger')
                 return redirect(url_for('reports'))
 
-            now = datetime.now()
-            if period == 'daily':
-                cutoff = now - timedelta(hours=24)
-            elif period == 'weekly':
-                cutoff = now - timedelta(days=7)
-            elif period == 'monthly':
-                cutoff = now - timedelta(days=30)
-            elif period == 'half_yearly':
-                cutoff = now - timedelta(days=180)
-            elif period == 'yearly':
-                cutoff = now - timedelta(days=365)
-            else:
+            cutoff = reset_cutoff(period)
+            if cutoff is None:
                 flash('Invalid period selected.', 'danger')
                 return redirect(url_for('reports'))
 
-            # Calculate what will be deleted
-            sales_to_delete = Sale.query.filter(Sale.timestamp < cutoff).all()
-            sales_count = len(sales_to_delete)
-            total_value = sum(s.total_price for s in sales_to_delete)
+            # Calculate what will be archived
+            sales_count, total_value = archive.summary(cutoff)
 
             return render_template('reset_confirm.html', period=period, sales_count=sales_count, total_value=total_value, cutoff_date=cutoff.strftime('%Y-%m-%d %H:%M:%S'))
         except Exception as e:
@@ -877,30 +1273,20 @@ self.addEventListener('fetch', (event) => {
             flash('Please select a reset period.', 'danger')
             return redirect(url_for('reports'))
 
-        now = datetime.now()
-        if period == 'daily':
-            cutoff = now - timedelta(hours=24)
-        elif period == 'weekly':
-            cutoff = now - timedelta(days=7)    
-        elif period == 'monthly':
-            cutoff = now - timedelta(days=30)
-        elif period == 'half_yearly':
-            cutoff = now - timedelta(days=180)
-        elif period == 'yearly':
-            cutoff = now - timedelta(days=365)
-        else:
+        cutoff = reset_cutoff(period)
+        if cutoff is None:
             flash('Invalid period selected.', 'danger')
             return redirect(url_for('reports'))
 
         try:
-            # Delete sales older than cutoff
-            deleted_count = Sale.query.filter(Sale.timestamp < cutoff).delete()
-            db.session.commit()
+            # Move the old sales to the archive in chunks; report totals are kept
+            moved = archive.archive_sales(cutoff)
+            cache.sales_changed()
 
-            flash(f'Sales reset successfully. Deleted {deleted_count} old sales records.', 'success')
+            flash(f'Sales reset successfully. Archived {moved} old sales records.', 'success')
             return redirect(url_for('reports'))
         except Exception as e:
-            db.session.rollback()
+            cache.sales_changed()
             flash(f'Error resetting sales: {str(e)}', 'danger')
             return redirect(url_for('reports'))
 
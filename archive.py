@@ -0,0 +1,71 @@
+"""
+archive.py
+
+Moves old sales out of the live `sale` / `sale_item` tables into
+`sale_archive` / `sale_item_archive`.
+
+Sales are moved oldest first in chunks of `ARCHIVE_CHUNK_SIZE`, each chunk
+in its own short transaction (INSERT ... SELECT into the archive, then
+DELETE from the live tables), so the sales table is never locked for long
+and an interrupted run simply continues where it stopped. The rollup
+tables are left alone: archived sales keep counting in the reports.
+"""
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import aliased
+
+from models import db, Sale, SaleItem, ArchivedSale, ArchivedSaleItem
+
+ARCHIVE_CHUNK_SIZE = 2000
+
+
+def summary(cutoff):
+    """(count, total value) of the sales an archive run would move, in one query."""
+    count, total = db.session.query(
+        func.count(Sale.id), func.coalesce(func.sum(Sale.total_price), 0.0)
+    ).filter(*_criteria(cutoff)).one()
+    return count, float(total)
+
+
+def _criteria(cutoff):
+    criteria = [Sale.timestamp < cutoff]
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # SQLite gives a new row max(id) + 1, so removing the newest sale would let
+        # the next one reuse an id that is already in the archive; leave it in place.
+        # A subquery, so the caller's query reads the newest id itself.
+        newest = aliased(Sale)
+        criteria.append(Sale.id < select(func.max(newest.id)).scalar_subquery())
+    return criteria
+
+
+def _copy(source, target, where):
+    """INSERT INTO target (cols) SELECT cols FROM source WHERE ..."""
+    columns = [c.name for c in target.__table__.columns]
+    db.session.execute(insert(target).from_select(
+        columns, select(*(source.__table__.c[name] for name in columns)).where(where)
+    ))
+
+
+def archive_sales(cutoff, chunk_size=ARCHIVE_CHUNK_SIZE, progress=None):
+    """Move every sale older than `cutoff` to the archive; returns how many moved.
+
+    Commits after each chunk. `progress(moved_so_far)` is called after each commit.
+    """
+    criteria = _criteria(cutoff)
+    moved = 0
+    while True:
+        ids = [sid for (sid,) in db.session.query(Sale.id).filter(*criteria)
+               .order_by(Sale.id).limit(chunk_size)]
+        if not ids:
+            return moved
+        try:
+            _copy(Sale, ArchivedSale, Sale.id.in_(ids))
+            _copy(SaleItem, ArchivedSaleItem, SaleItem.sale_id.in_(ids))
+            db.session.execute(delete(SaleItem).where(SaleItem.sale_id.in_(ids)))
+            db.session.execute(delete(Sale).where(Sale.id.in_(ids)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        moved += len(ids)
+        if progress:
+            progress(moved)
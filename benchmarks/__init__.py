@@ -0,0 +1,41 @@
+"""
+Benchmark tooling for the pharmacy app.
+
+- `python -m benchmarks.generate` fills a database with synthetic medicines,
+  customers and sales (10k / 100k / 1M sales).
+- `python -m benchmarks.run` drives the heavy routes through the Flask test
+  client and reports latency percentiles, SQL statement counts and peak
+  memory, saving a JSON baseline to compare later runs against.
+"""
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+
+# Named dataset sizes (number of sales)
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+
+def db_path_for(size):
+    return os.path.join(DATA_DIR, f'bench_{size}.db')
+
+
+def load_app(db_path, profiling=True):
+    """Import the app bound to `db_path`.
+
+    app.py builds its app at import time from the environment, so this must
+    run before anything else imports `app`.
+    """
+    if 'app' in sys.modules:
+        raise RuntimeError('app was imported before the benchmark database was configured')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    if profiling:
+        os.environ['PERF_PROFILING'] = '1'
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    import app as app_module
+    flask_app = app_module.app
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    for limiter in flask_app.extensions.get('limiter', ()):
+        limiter.enabled = False
+    return flask_app
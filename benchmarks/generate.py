@@ -0,0 +1,174 @@
+"""
+Synthetic pharmacy data generator.
+
+    python -m benchmarks.generate --size 100k
+    python -m benchmarks.generate --sales 250000 --days 730 --db /tmp/pharmacy_bench.db
+
+Sales are spread over `days` days with more trade on recent days, on
+weekdays and in shop hours; about a third of sales have several lines and
+about a third have a customer. Output is deterministic for a given seed.
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import DATA_DIR, SIZES, db_path_for, load_app
+
+BASES = [
+    'Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Metformin', 'Amlodipine', 'Omeprazole',
+    'Ciprofloxacin', 'Artemether', 'Lumefantrine', 'Azithromycin', 'Loratadine', 'Cetirizine',
+    'Diclofenac', 'Metronidazole', 'Salbutamol', 'Vitamin C', 'Zinc', 'Folic Acid',
+    'Ferrous Sulphate', 'Losartan', 'Atorvastatin', 'Doxycycline', 'Fluconazole', 'Prednisolone',
+]
+FORMS = ['Tablets', 'Capsules', 'Syrup', 'Suspension', 'Injection', 'Cream']
+BRANDS = ['Ernest Chemists', 'Kinapharma', 'Tobinco', 'Danadams', 'M&G', 'Letap', 'Pfizer', 'GSK', 'Sanofi']
+CATEGORIES = ['Analgesic', 'Antibiotic', 'Antimalarial', 'Antihypertensive', 'Antidiabetic',
+              'Antihistamine', 'Supplement', 'Antifungal', 'Respiratory', 'Gastrointestinal']
+FIRST_NAMES = ['Kwame', 'Ama', 'Kofi', 'Akua', 'Yaw', 'Abena', 'Kojo', 'Efua', 'Kwesi', 'Adwoa',
+               'Elvis', 'Grace', 'Samuel', 'Mary', 'John', 'Esther', 'Daniel', 'Joyce']
+LAST_NAMES = ['Mensah', 'Owusu', 'Boateng', 'Asante', 'Osei', 'Addo', 'Appiah', 'Agyeman',
+              'Darko', 'Ofori', 'Amoah', 'Quaye', 'Tetteh', 'Annan']
+
+# Relative trade per hour of day (shop open 07:00-22:00)
+HOUR_WEIGHTS = {h: w for h, w in zip(range(7, 22), [2, 5, 8, 9, 9, 10, 9, 8, 8, 9, 10, 9, 7, 5, 2])}
+# Relative trade per weekday (Monday=0)
+WEEKDAY_WEIGHTS = [1.0, 0.95, 0.95, 1.0, 1.15, 1.2, 0.6]
+
+CHUNK = 10_000
+
+
+def _medicines(rng, n, today):
+    rows = []
+    for i in range(n):
+        cost = round(rng.uniform(0.5, 60), 2)
+        rows.append({
+            'id': i + 1,
+            'name': f'{BASES[i % len(BASES)]} {rng.choice([5, 10, 20, 100, 250, 500])}mg {FORMS[(i // len(BASES)) % len(FORMS)]} #{i + 1}',
+            'brand': rng.choice(BRANDS),
+            'cost_price': cost,
+            'price': round(cost * rng.uniform(1.2, 1.8), 2),
+            'quantity': rng.choice([0, 2, 5, 8] + [rng.randint(10, 800)] * 8),
+            'expiry_date': today + timedelta(days=rng.randint(-60, 720)) if rng.random() < 0.95 else None,
+            'category': rng.choice(CATEGORIES),
+            'description': None,
+        })
+    return rows
+
+
+def _customers(rng, n):
+    return [{
+        'id': i + 1,
+        'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+        'phone': f'0{rng.choice([20, 24, 26, 27, 50, 54, 55])}{rng.randint(1000000, 9999999)}',
+    } for i in range(n)]
+
+
+def _day_weights(days, today):
+    """Weight for each day offset: gentle growth towards today times the weekday pattern."""
+    weights = []
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        growth = 1.0 - 0.5 * offset / max(days, 1)
+        weights.append(growth * WEEKDAY_WEIGHTS[day.weekday()])
+    return weights
+
+
+def generate(db, n_sales, n_medicines=None, n_customers=None, days=365, seed=42):
+    """Fill the database behind `db` (the Flask-SQLAlchemy object) with synthetic data."""
+    from sqlalchemy import insert
+    from models import Medicine, Customer, Sale, SaleItem
+    import business_day
+    import rollups
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    today = now.date()
+    n_medicines = n_medicines or min(max(50, n_sales // 2000), 5000)
+    n_customers = n_customers or min(max(20, n_sales // 50), 20000)
+
+    medicines = _medicines(rng, n_medicines, today)
+    db.session.execute(insert(Medicine), medicines)
+    db.session.execute(insert(Customer), _customers(rng, n_customers))
+    db.session.commit()
+
+    # Popularity follows a long tail: a few medicines make most of the sales
+    popularity = [1.0 / (rank + 1) ** 0.8 for rank in range(n_medicines)]
+    rng.shuffle(popularity)
+    day_offsets = list(range(days))
+    day_weights = _day_weights(days, today)
+    hours = list(HOUR_WEIGHTS)
+    hour_weights = list(HOUR_WEIGHTS.values())
+
+    sale_id = item_id = 0
+    sales, items = [], []
+    for _ in range(n_sales):
+        sale_id += 1
+        day = today - timedelta(days=rng.choices(day_offsets, day_weights)[0])
+        ts = datetime(day.year, day.month, day.day, rng.choices(hours, hour_weights)[0], rng.randint(0, 59), rng.randint(0, 59))
+        if ts > now:
+            ts = now - timedelta(minutes=rng.randint(1, 600))
+        n_lines = 1 if rng.random() < 0.7 else rng.randint(2, 6)
+        lines = []
+        for med_index in rng.choices(range(n_medicines), popularity, k=n_lines):
+            med = medicines[med_index]
+            qty = rng.choice([1, 1, 1, 2, 2, 3, 5, 10])
+            item_id += 1
+            lines.append({'id': item_id, 'sale_id': sale_id, 'medicine_id': med['id'], 'quantity': qty,
+                          'price_per_unit': med['price'], 'total_price': round(med['price'] * qty, 2),
+                          'cost_per_unit': med['cost_price'], 'total_cost': round(med['cost_price'] * qty, 2)})
+        items.extend(lines)
+        sales.append({
+            'id': sale_id,
+            'medicine_id': lines[0]['medicine_id'],
+            'quantity': sum(line['quantity'] for line in lines),
+            'price_per_unit': lines[0]['price_per_unit'],
+            'total_price': round(sum(line['total_price'] for line in lines), 2),
+            'cost_per_unit': lines[0]['cost_per_unit'],
+            'total_cost': round(sum(line['total_cost'] for line in lines), 2),
+            'timestamp': ts,
+            'sale_date': business_day.business_date(ts),
+            'customer_id': rng.randint(1, n_customers) if rng.random() < 0.35 else None,
+        })
+        if len(sales) >= CHUNK:
+            db.session.execute(insert(Sale), sales)
+            db.session.execute(insert(SaleItem), items)
+            db.session.commit()
+            sales, items = [], []
+    if sales:
+        db.session.execute(insert(Sale), sales)
+        db.session.execute(insert(SaleItem), items)
+        db.session.commit()
+
+    rollups.rebuild()
+    return {'medicines': n_medicines, 'customers': n_customers, 'sales': n_sales, 'sale_items': item_id}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic pharmacy database for benchmarks.')
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k', help='named dataset size')
+    parser.add_argument('--sales', type=int, help='number of sales (overrides --size)')
+    parser.add_argument('--medicines', type=int)
+    parser.add_argument('--customers', type=int)
+    parser.add_argument('--days', type=int, default=365, help='spread sales over this many days')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='SQLite file to create (default: benchmarks/data/bench_<size>.db)')
+    args = parser.parse_args(argv)
+
+    db_path = args.db or db_path_for(args.size)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)) or DATA_DIR, exist_ok=True)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    flask_app = load_app(db_path, profiling=False)
+    from models import db
+    started = time.perf_counter()
+    with flask_app.app_context():
+        counts = generate(db, args.sales or SIZES[args.size], args.medicines, args.customers, args.days, args.seed)
+    print(f"Generated {counts} in {time.perf_counter() - started:.1f}s -> {db_path}")
+    return db_path
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Benchmark runner.
+
+    python -m benchmarks.run --size 10k                        # generates the data if missing
+    python -m benchmarks.run --size 100k --save benchmarks/baseline.json
+    python -m benchmarks.run --size 100k --compare benchmarks/baseline.json
+
+Each scenario is requested `--iterations` times through the Flask test
+client with profiling on (so SQL counts come from the X-SQL-Queries header).
+In-process caches - the TTL caches and the analytics arrays behind the
+reports - are cleared before every request unless `--warm` is given, so the
+numbers measure the real work (for reports: a worker's first, full load). Streamed responses (exports) run
+their queries after the headers are sent, so their SQL count only covers
+the setup. Peak Python memory is measured in a
+separate pass with tracemalloc so it does not distort the timings.
+
+The `startup` scenario boots the app in fresh child processes against the
+already-migrated database and times `create_app()` (what every worker pays
+before serving), counting the SQL it runs.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from benchmarks import BENCH_DIR, SIZES, db_path_for, load_app
+
+# Latency/SQL growth beyond this fraction of the baseline counts as a regression
+REGRESSION_TOLERANCE = 0.20
+
+
+def scenarios():
+    """(name, method, url, json body) for every benchmarked route."""
+    today = date.today()
+    month_ago = (today - timedelta(days=30)).isoformat()
+    return [
+        ('reports', 'GET', '/reports', None),
+        ('dashboard', 'GET', '/dashboard', None),
+        ('api_dashboard', 'GET', '/api/dashboard', None),
+        ('search_first_page', 'GET', '/sales/search', None),
+        ('search_text', 'GET', '/sales/search?q=para', None),
+        ('search_month', 'GET', f'/sales/search?from_date={month_ago}&to_date={today.isoformat()}', None),
+        ('export_csv_month', 'GET', f'/sales/export?format=csv&from_date={month_ago}', None),
+        ('export_xlsx_month', 'GET', f'/sales/export?from_date={month_ago}', None),
+        ('medicines_page', 'GET', '/medicines', None),
+        ('medicines_low_stock_json', 'GET', '/medicines?stock=low&format=json', None),
+        ('sales_sync', 'POST', '/sales/sync', {'medicine_id': 1, 'quantity': 1}),
+    ]
+
+
+def _percentile(values, pct):
+    import perf
+    return perf.percentile(values, pct)
+
+
+def _clear_caches():
+    import analytics
+    import cache
+    cache.sales_changed()
+    cache.medicines_changed()
+    # Reports then pay the full load of the sales arrays, as a worker's first report does
+    analytics.reset()
+
+
+def _prepare(flask_app):
+    """Give the synced medicine enough stock for every sync iteration."""
+    from models import db, Medicine
+    with flask_app.app_context():
+        med = db.session.get(Medicine, 1)
+        med.quantity = 10_000_000
+        db.session.commit()
+
+
+def _request(client, method, url, body):
+    if method == 'POST':
+        resp = client.post(url, json=body)
+    else:
+        resp = client.get(url)
+    resp.get_data()  # drain streamed bodies so their queries are included in the timing
+    return resp
+
+
+def _startup_child(db_path):
+    """Child process body: import the app, then time one more `create_app()` with SQL counting."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    started = time.perf_counter()
+    load_app(db_path, profiling=False)
+    import_ms = (time.perf_counter() - started) * 1000
+    import app as app_module
+
+    statements = []
+    event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    started = time.perf_counter()
+    app_module.create_app()
+    boot_ms = (time.perf_counter() - started) * 1000
+    print(json.dumps({'import_ms': import_ms, 'boot_ms': boot_ms, 'sql': len(statements)}))
+
+
+def measure_startup(db_path, runs=5):
+    """Worker boot time over `runs` fresh processes (the first import migrates the database if needed)."""
+    code = f'from benchmarks.run import _startup_child; _startup_child({db_path!r})'
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True,
+                             cwd=os.path.dirname(BENCH_DIR)).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    boots = [s['boot_ms'] for s in samples]
+    result = {
+        'p50_ms': round(_percentile(boots, 50), 2),
+        'p95_ms': round(_percentile(boots, 95), 2),
+        'p99_ms': round(_percentile(boots, 99), 2),
+        'mean_ms': round(sum(boots) / len(boots), 2),
+        'import_p50_ms': round(_percentile([s['import_ms'] for s in samples], 50), 2),
+        'sql_statements': max(s['sql'] for s in samples),
+    }
+    print(f"{'startup':20} p50 {result['p50_ms']:9.2f}ms  p95 {result['p95_ms']:9.2f}ms  p99 {result['p99_ms']:9.2f}ms  "
+          f"sql {result['sql_statements']:4}  import+boot p50 {result['import_p50_ms']:.2f}ms")
+    return result
+
+
+def run(flask_app, iterations=20, warm=False, only=None):
+    client = flask_app.test_client()
+    with client.session_transaction() as s:
+        s['is_admin'] = True
+    _prepare(flask_app)
+
+    results = {}
+    for name, method, url, body in scenarios():
+        if only and name not in only:
+            continue
+        _request(client, method, url, body)  # warm-up: template compile, connection pool
+        latencies, queries, statuses = [], [], set()
+        for _ in range(iterations):
+            if not warm:
+                _clear_caches()
+            started = time.perf_counter()
+            resp = _request(client, method, url, body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(int(resp.headers.get('X-SQL-Queries', 0)))
+            statuses.add(resp.status_code)
+
+        if not warm:
+            _clear_caches()
+        tracemalloc.start()
+        _request(client, method, url, body)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {
+            'url': url,
+            'status': sorted(statuses),
+            'p50_ms': round(_percentile(latencies, 50), 2),
+            'p95_ms': round(_percentile(latencies, 95), 2),
+            'p99_ms': round(_percentile(latencies, 99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'sql_statements': max(queries),
+            'peak_mem_kb': round(peak / 1024, 1),
+        }
+        r = results[name]
+        print(f"{name:20} p50 {r['p50_ms']:9.2f}ms  p95 {r['p95_ms']:9.2f}ms  p99 {r['p99_ms']:9.2f}ms  "
+              f"sql {r['sql_statements']:4}  peak {r['peak_mem_kb']:10.1f}KB  status {r['status']}")
+    return results
+
+
+def compare(results, baseline):
+    """Print changes against a saved baseline; returns the names of regressed scenarios."""
+    regressed = []
+    print('\nCompared with baseline:')
+    for name, r in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            print(f'{name:20} (new)')
+            continue
+        change = (r['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0
+        flags = []
+        if change > REGRESSION_TOLERANCE:
+            flags.append('SLOWER')
+        if r['sql_statements'] > base['sql_statements']:
+            flags.append('MORE SQL')
+        if flags:
+            regressed.append(name)
+        print(f"{name:20} p95 {base['p95_ms']:9.2f} -> {r['p95_ms']:9.2f}ms ({change:+.0%})  "
+              f"sql {base['sql_statements']} -> {r['sql_statements']}  {' '.join(flags)}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the heavy pharmacy routes.')
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k')
+    parser.add_argument('--db', help='benchmark SQLite file (default: benchmarks/data/bench_<size>.db)')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warm', action='store_true', help='keep in-process caches between requests')
+    parser.add_argument('--only', nargs='*', help='scenario names to run (including "startup")')
+    parser.add_argument('--startup-runs', type=int, default=5, help='fresh processes for the startup scenario')
+    parser.add_argument('--save', help='write results to this JSON baseline file')
+    parser.add_argument('--compare', help='compare with this JSON baseline; exit 1 on regression')
+    args = parser.parse_args(argv)
+
+    db_path = args.db or db_path_for(args.size)
+    if not os.path.exists(db_path):
+        # Generate in a child process: the app can only be bound to one database per process
+        subprocess.run([sys.executable, '-m', 'benchmarks.generate', '--size', args.size, '--db', db_path],
+                       check=True, cwd=os.path.dirname(BENCH_DIR))
+    results = {}
+    if not args.only or 'startup' in args.only:
+        # Before load_app: the children must not inherit an imported app
+        results['startup'] = measure_startup(db_path, args.startup_runs)
+    flask_app = load_app(db_path)
+
+    results.update(run(flask_app, args.iterations, args.warm, args.only))
+    report = {
+        'size': args.size,
+        'db': db_path,
+        'iterations': args.iterations,
+        'warm': args.warm,
+        'python': platform.python_version(),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nSaved baseline to {args.save}')
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(results, json.load(f))
+        if regressed:
+            print(f"\nRegressions: {', '.join(regressed)}")
+            sys.exit(1)
+    return report
+
+
+if __name__ == '__main__':
+    main()
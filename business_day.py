@@ -0,0 +1,73 @@
+"""
+business_day.py
+
+The shop's business date for a sale.
+
+Sale timestamps are naive local server time. SHOP_TIMEZONE (an IANA name
+such as "Africa/Accra") sets the clock the shop's day follows when the
+server runs on another one, and DAY_CUTOFF_HOUR moves the day boundary:
+with 4, a sale at 01:30 still belongs to the previous day. The date is
+worked out once when a sale is recorded and stored in `Sale.sale_date`,
+so reports group and filter on an indexed column instead of converting
+every timestamp at query time.
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, update
+
+from models import db
+
+DAY_CUTOFF_HOUR = int(os.environ.get('DAY_CUTOFF_HOUR', 0))
+
+# Rows updated per statement when (re)computing stored dates
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def _load_zone(name):
+    if not name:
+        return None
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except Exception as e:
+        print(f"Warning: unknown SHOP_TIMEZONE {name!r}, using server time: {e}")
+        return None
+
+
+SHOP_TIMEZONE = _load_zone(os.environ.get('SHOP_TIMEZONE'))
+
+
+def business_date(ts):
+    """Business date of a naive local timestamp."""
+    if SHOP_TIMEZONE is not None:
+        # astimezone() on a naive datetime treats it as server local time
+        ts = ts.astimezone(SHOP_TIMEZONE).replace(tzinfo=None)
+    return (ts - timedelta(hours=DAY_CUTOFF_HOUR)).date()
+
+
+def today():
+    """The current business date."""
+    return business_date(datetime.now())
+
+
+def backfill(model, only_missing=True, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Store `sale_date` on rows of `model` (Sale or ArchivedSale); returns rows updated.
+
+    Works through the table by id in chunks, committing after each one.
+    `only_missing=False` recomputes every row (after changing the timezone or cutoff).
+    """
+    table = model.__table__
+    stmt = update(table).where(table.c.id == bindparam('b_id')).values(sale_date=bindparam('b_date'))
+    updated, last_id = 0, 0
+    while True:
+        q = db.session.query(model.id, model.timestamp).filter(model.id > last_id, model.timestamp.isnot(None))
+        if only_missing:
+            q = q.filter(model.sale_date.is_(None))
+        rows = q.order_by(model.id).limit(chunk_size).all()
+        if not rows:
+            return updated
+        db.session.execute(stmt, [{'b_id': sid, 'b_date': business_date(ts)} for sid, ts in rows])
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
@@ -0,0 +1,88 @@
+"""
+cache.py
+
+Tiny in-process cache with a time-to-live, shared by the request threads
+of one worker. Each gunicorn worker has its own copy, so entries are kept
+short-lived and cleared explicitly when the data behind them changes.
+"""
+import threading
+import time
+
+
+class TTLCache:
+    """Dictionary-like cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl=30, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.max_entries:
+                # Drop the entry closest to expiry to make room
+                oldest = min(self._data, key=lambda k: self._data[k][0])
+                del self._data[oldest]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_set(self, key, compute):
+        """Return the cached value or compute it once, even with many concurrent callers."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._compute_lock:
+            # Another thread may have filled it while we waited
+            value = self.get(key)
+            if value is None:
+                value = compute()
+                self.set(key, value)
+            return value
+
+
+# Count and sum of total_price for a (q, from_date, to_date) sales search
+sales_search_totals = TTLCache(ttl=30)
+
+# Everything the dashboard shows (see /api/dashboard)
+dashboard_payload = TTLCache(ttl=15, max_entries=4)
+
+# Typeahead results of /api/medicines/lookup and /api/customers/lookup, by (q, limit)
+medicine_lookup = TTLCache(ttl=30, max_entries=512)
+customer_lookup = TTLCache(ttl=60, max_entries=512)
+
+
+def sales_changed():
+    """Forget cached values derived from the sales table. Call after committing a sale write."""
+    sales_search_totals.clear()
+    dashboard_payload.clear()
+    # Lookups show stock levels
+    medicine_lookup.clear()
+
+
+def medicines_changed():
+    """Forget cached values derived from the medicine table (stock, expiry, names)."""
+    # A rename changes which sales match a name search
+    sales_search_totals.clear()
+    dashboard_payload.clear()
+    medicine_lookup.clear()
+
+
+def customers_changed():
+    """Forget cached values derived from the customer table."""
+    customer_lookup.clear()
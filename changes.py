@@ -0,0 +1,139 @@
+"""
+changes.py
+
+Change versions for the offline catalog (medicines and customers).
+
+Every write to a medicine or customer stamps the row with a new catalog
+version; deletions leave a `SyncTombstone` with one. Offline tills then ask
+/api/medicines/changes?since=<version> for just the rows that changed.
+
+Versions come from the `catalog_version_seq` sequence on Postgres, so
+concurrent sales never wait for each other to take one, and from the
+'catalog' counter row on SQLite, where writes are serialized anyway.
+Because Postgres transactions can commit out of version order,
+`current_version()` reports a watermark rather than the newest version:
+every transaction that takes versions first holds a shared advisory lock
+keyed on the sequence position it started at, and the watermark stops below
+the oldest of those still running. A client that has seen version N can
+therefore never miss a row <= N.
+ORM writes are stamped by a before_flush hook; Core UPDATE/INSERT paths
+(stock taken by a sale, bulk import) set `version=next_version()` themselves.
+"""
+from sqlalchemy import event, insert, select, text, update
+from sqlalchemy.orm import Session
+
+from models import db, Medicine, Customer, ChangeCounter, SyncTombstone
+
+COUNTER = 'catalog'
+
+# Model -> tombstone table name
+TRACKED = {Medicine: 'medicine', Customer: 'customer'}
+
+_counter = ChangeCounter.__table__
+
+
+# Postgres only
+SEQUENCE = 'catalog_version_seq'
+# pg_advisory_xact_lock_shared(IN_FLIGHT_LOCK, <sequence position>) while a transaction takes versions.
+# The position is cast to int4, which is fine below two billion catalog writes.
+IN_FLIGHT_LOCK = 724_011_014
+
+_HANDED_OUT = f'SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {SEQUENCE}'
+
+
+def _is_postgres(conn):
+    return conn.dialect.name in ('postgres', 'postgresql')
+
+
+def current_version():
+    """Catalog version up to which every write is committed (0 before the first write)."""
+    conn = db.session.connection()
+    if not _is_postgres(conn):
+        value = conn.execute(select(_counter.c.value).where(_counter.c.name == COUNTER)).scalar()
+        return value or 0
+    handed_out = conn.execute(text(_HANDED_OUT)).scalar()
+    # Read after the sequence: a writer that locks later only takes versions above `handed_out`
+    oldest = conn.execute(text(
+        "SELECT min(objid::bigint) FROM pg_locks WHERE locktype = 'advisory' AND granted"
+        " AND classid = :ns AND objsubid = 2"
+        " AND database = (SELECT oid FROM pg_database WHERE datname = current_database())"
+    ), {'ns': IN_FLIGHT_LOCK}).scalar()
+    return handed_out if oldest is None else min(handed_out, oldest)
+
+
+def next_version(session=None):
+    """A catalog version for a row being written; call once per written row.
+
+    Postgres: `nextval` (no row lock). The first call of a transaction also
+    takes the shared in-flight lock read by `current_version`. SQLite: one
+    bump of the counter row per transaction, shared by all its rows.
+    """
+    session = session or db.session()
+    # Plain connection statements: no autoflush, so this is safe inside before_flush
+    conn = session.connection()
+    if _is_postgres(conn):
+        if 'change_version' not in session.info:
+            conn.execute(text(f'SELECT pg_advisory_xact_lock_shared(:ns, ({_HANDED_OUT})::int)'), {'ns': IN_FLIGHT_LOCK})
+        version = conn.execute(text(f"SELECT nextval('{SEQUENCE}')")).scalar()
+    else:
+        version = session.info.get('change_version')
+        if version is not None:
+            return version
+        bumped = conn.execute(
+            update(_counter).where(_counter.c.name == COUNTER).values(value=_counter.c.value + 1)
+        )
+        if bumped.rowcount == 0:
+            conn.execute(insert(_counter).values(name=COUNTER, value=1))
+        version = conn.execute(select(_counter.c.value).where(_counter.c.name == COUNTER)).scalar()
+    # Also tells live.py that this transaction wrote to the catalog
+    session.info['change_version'] = version
+    return version
+
+
+def create_sequence(conn):
+    """Postgres: create the version sequence, continuing after the counter row's value."""
+    conn.execute(text(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}'))
+    counter = conn.execute(select(_counter.c.value).where(_counter.c.name == COUNTER)).scalar() or 0
+    if counter > conn.execute(text(_HANDED_OUT)).scalar():
+        conn.execute(text('SELECT setval(:seq, :value)'), {'seq': SEQUENCE, 'value': counter})
+
+
+def _before_flush(session, flush_context, instances):
+    touched = [obj for obj in session.new if type(obj) in TRACKED]
+    touched += [obj for obj in session.dirty if type(obj) in TRACKED and session.is_modified(obj)]
+    deleted = [obj for obj in session.deleted if type(obj) in TRACKED]
+    if not touched and not deleted:
+        return
+    for obj in touched:
+        obj.version = next_version(session)
+    for obj in deleted:
+        session.add(SyncTombstone(table_name=TRACKED[type(obj)], record_id=obj.id, version=next_version(session)))
+
+
+def _end_transaction(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('change_version', None)
+
+
+def init_app(app):
+    """Stamp change versions on every ORM flush (registered once per process)."""
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_transaction_end', _end_transaction)
+
+
+def changed_since(model, fields, since):
+    """(rows as lists of `fields`, deleted ids) for `model` after version `since`.
+
+    `since=None` means a full download: every row and no tombstones.
+    """
+    columns = [getattr(model, f) for f in fields]
+    q = db.session.query(*columns)
+    deleted = []
+    if since is not None:
+        q = q.filter(model.version > since)
+        deleted = [rid for (rid,) in db.session.query(SyncTombstone.record_id).filter(
+            SyncTombstone.table_name == TRACKED[model], SyncTombstone.version > since
+        )]
+    rows = [[v.isoformat() if hasattr(v, 'isoformat') else v for v in row] for row in q.order_by(model.id)]
+    return rows, deleted
@@ -0,0 +1,100 @@
+"""
+Shared pytest fixtures.
+
+app.py builds its app at import time from DATABASE_URL, so this file
+points that at a scratch SQLite database before anything imports it: the
+whole run shares that one `app` and database. Tests there tag their rows
+(unique medicine names, device ids) and never assume the tables are
+otherwise empty. A test that needs every row to be its own (totals over
+the whole table, archiving) takes `fresh_app`, a second app on a new,
+empty database.
+"""
+import os
+import tempfile
+import time
+
+import pytest
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'tests.db')
+
+import app as app_module  # noqa: E402  (DATABASE_URL must be set first)
+from models import db, Medicine  # noqa: E402
+import analytics  # noqa: E402
+import cache  # noqa: E402
+import jobs  # noqa: E402
+import live  # noqa: E402
+
+# A script that drives a running server over HTTP, not a test module
+collect_ignore = ['test_app.py']
+
+
+def _for_tests(flask_app):
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    for limiter in flask_app.extensions.get('limiter', ()):
+        limiter.enabled = False
+    return flask_app
+
+
+def _forget_cached_data():
+    # Module-level caches outlive an app; drop them when the database changes
+    cache.sales_changed()
+    cache.medicines_changed()
+    cache.customers_changed()
+    analytics.reset()
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The app shared by the whole run."""
+    return _for_tests(app_module.app)
+
+
+@pytest.fixture
+def fresh_app(monkeypatch, tmp_path):
+    """An app of its own on a new, empty (migrated) database."""
+    monkeypatch.setenv('DATABASE_URL', 'sqlite:///' + str(tmp_path / 'fresh.db'))
+    # create_app replaces the process-wide job runner and live publisher
+    monkeypatch.setattr(jobs, '_runner', jobs._runner)
+    monkeypatch.setattr(live, '_publisher', live._publisher)
+    flask_app = _for_tests(app_module.create_app())
+    _forget_cached_data()
+    yield flask_app
+    _forget_cached_data()
+    with flask_app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['is_admin'] = True
+    return client
+
+
+@pytest.fixture
+def add_medicine(app):
+    """add_medicine(stock, **columns) -> id of a new medicine with a unique name.
+
+    Pass `flask_app=fresh_app` to add it to a test's own database.
+    """
+    def add(stock=10, name=None, flask_app=None, **columns):
+        with (flask_app or app).app_context():
+            med = Medicine(name=name or f'Test medicine {time.time_ns()}',
+                           **{'price': 2.0, 'cost_price': 1.0, **columns}, quantity=stock)
+            db.session.add(med)
+            db.session.commit()
+            return med.id
+    return add
+
+
+@pytest.fixture
+def inline_jobs(monkeypatch, tmp_path):
+    """Background jobs run only when the test claims and executes them, into tmp_path."""
+    monkeypatch.setattr(jobs, '_runner', None)
+    monkeypatch.setattr(jobs, 'RESULTS_DIR', str(tmp_path / 'jobs'))
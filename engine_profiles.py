@@ -0,0 +1,113 @@
+"""
+engine_profiles.py
+
+Per-dialect database engine settings.
+
+- SQLite: every new connection switches to WAL (readers no longer wait for
+  a sale being written), synchronous=NORMAL, a busy timeout instead of
+  immediate "database is locked" errors, and larger mmap/page caches.
+- Postgres: a connection pool sized from the gunicorn worker count so all
+  workers together stay within DB_CONNECTION_BUDGET, pre-ping to drop dead
+  connections, and a per-statement timeout.
+- Optional read replica: with DATABASE_REPLICA_URL set, routes marked
+  `@replica_reads` (reports, search, export) send their queries to it. The
+  replica may lag the primary by a moment, so only read-only routes use it.
+
+Every value can be overridden with the environment variable named below.
+"""
+import os
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_BIND = 'replica'
+
+# PRAGMA -> (environment variable, default)
+SQLITE_PRAGMAS = {
+    'journal_mode': ('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': ('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': ('SQLITE_BUSY_TIMEOUT_MS', '5000'),
+    'mmap_size': ('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)),
+    'cache_size': ('SQLITE_CACHE_SIZE', '-20000'),  # negative: KiB, so about 20 MB
+}
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def normalize_url(url):
+    """SQLAlchemy only accepts the postgresql:// scheme (Railway/Heroku hand out postgres://)."""
+    if url and url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the database at `url`."""
+    if not url.startswith('postgresql'):
+        return {}
+    workers = _env_int('WEB_CONCURRENCY', 1)  # gunicorn reads the same variable
+    per_worker = max(_env_int('DB_CONNECTION_BUDGET', 20) // workers, 2)
+    timeout_ms = _env_int('DB_STATEMENT_TIMEOUT_MS', 30000)
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', per_worker),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 0),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+        'connect_args': {'options': f'-c statement_timeout={timeout_ms}'},
+    }
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, (env, default) in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {os.environ.get(env, default)}')
+    finally:
+        cursor.close()
+
+
+def configure(app):
+    """Set engine options and the replica bind on `app`; call before `db.init_app(app)`."""
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    replica_url = normalize_url(os.environ.get('DATABASE_REPLICA_URL'))
+    if replica_url:
+        app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA_BIND: {'url': replica_url, **engine_options(replica_url)},
+        }
+
+
+def init_engines(app, db):
+    """Apply the SQLite connection pragmas; call after `db.init_app(app)`."""
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _apply_sqlite_pragmas):
+                event.listen(engine, 'connect', _apply_sqlite_pragmas)
+
+
+def replica_reads(view):
+    """Run a read-only view's queries on the replica (when one is configured)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """`db.session` that sends the queries of `@replica_reads` requests to the replica bind.
+
+    Flushes always go to the primary, so a stray write cannot land on the replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context() and g.get('use_replica')
+                and REPLICA_BIND in self._db.engines):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,147 @@
+"""
+exports.py
+
+Sales search filters and the CSV / Excel writers behind /sales/export.
+
+Shared by the export route (which streams the file straight to the
+browser) and the background export job (jobs.py, which writes it to disk
+and reports progress as it goes). Rows are fetched in chunks with medicine
+and customer names joined in, so memory stays flat however many sales are
+exported.
+"""
+import csv
+from datetime import datetime
+from io import StringIO
+
+from sqlalchemy import or_
+
+from models import db, Medicine, Customer, Sale, SaleItem
+import search_index
+
+# Rows fetched (and CSV bytes flushed) per chunk
+EXPORT_CHUNK_SIZE = 1000
+
+SALES_HEADERS = ['ID', 'Medicine', 'Customer', 'Quantity', 'Price per Unit', 'Total Price', 'Timestamp']
+SALES_WIDTHS = [8, 30, 25, 10, 15, 15, 20]
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def filter_sales(query, q, from_date, to_date):
+    """Apply the sales search filters (text, from/to date) to `query`.
+
+    Free text becomes subqueries of medicine/customer ids on the name search
+    index, so the sales table is only touched through its id indexes.
+    """
+    try:
+        # Dates are business dates, like the reports
+        if from_date:
+            fd = datetime.strptime(from_date, '%Y-%m-%d').date()
+            query = query.filter(Sale.sale_date >= fd)
+        if to_date:
+            td = datetime.strptime(to_date, '%Y-%m-%d').date()
+            query = query.filter(Sale.sale_date <= td)
+    except Exception:
+        pass
+
+    if q:
+        if q.isdigit():
+            query = query.filter(Sale.id == int(q))
+        else:
+            # A sale matches when any of its lines is for a matching medicine
+            med_sales = db.session.query(SaleItem.sale_id).filter(
+                SaleItem.medicine_id.in_(search_index.matching_ids(Medicine, q))
+            )
+            query = query.filter(or_(
+                Sale.id.in_(med_sales),
+                Sale.customer_id.in_(search_index.matching_ids(Customer, q)),
+            ))
+    return query
+
+
+def sales_lines_query(q, from_date, to_date):
+    """One row per matching sale line: (sale id, medicine, customer, qty, unit price, total, timestamp)."""
+    rows_q = db.session.query(
+        Sale.id, Medicine.name, Customer.name, SaleItem.quantity,
+        SaleItem.price_per_unit, SaleItem.total_price, Sale.timestamp
+    ).select_from(SaleItem).join(Sale, SaleItem.sale_id == Sale.id).outerjoin(
+        Medicine, SaleItem.medicine_id == Medicine.id
+    ).outerjoin(Customer, Sale.customer_id == Customer.id)
+    return filter_sales(rows_q, q, from_date, to_date)
+
+
+def sales_lines(q, from_date, to_date):
+    """`sales_lines_query` newest first, streamed from the database in chunks."""
+    return sales_lines_query(q, from_date, to_date).order_by(
+        Sale.timestamp.desc(), Sale.id.desc(), SaleItem.id
+    ).execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+
+
+def _fmt_ts(ts):
+    return ts.strftime('%Y-%m-%d %H:%M:%S') if ts else ''
+
+
+def sales_cells(rows):
+    """Export rows in display form (names filled in, timestamps formatted)."""
+    for sid, med_name, cust_name, qty, ppu, total, ts in rows:
+        yield [sid, med_name or '', cust_name or '', qty, ppu, total, _fmt_ts(ts)]
+
+
+def csv_chunks(headers, rows):
+    """CSV text for `headers` and `rows`, in pieces of EXPORT_CHUNK_SIZE rows.
+
+    Floats are written with two decimals (money columns).
+    """
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(headers)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow([f'{v:.2f}' if isinstance(v, float) else ('' if v is None else v) for v in row])
+        if i % EXPORT_CHUNK_SIZE == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+    yield buf.getvalue()
+
+
+def write_xlsx(out, title, headers, rows, widths=None):
+    """Write a one-sheet workbook to the binary file `out`.
+
+    Write-only mode streams rows to a temp file instead of keeping cells in
+    memory. Floats get a money number format. Raises ImportError without openpyxl.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+
+    # Column widths must be set before any rows are written
+    for i, w in enumerate(widths or [], start=1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+
+    bold = Font(bold=True)
+    center = Alignment(horizontal='center')
+    header_cells = []
+    for h in headers:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.font = bold
+        cell.alignment = center
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in rows:
+        cells = []
+        for value in row:
+            if isinstance(value, float):
+                cell = WriteOnlyCell(ws, value=value)
+                cell.number_format = '#,##0.00'
+                cells.append(cell)
+            else:
+                cells.append(value)
+        ws.append(cells)
+
+    # The xlsx zip can only be finished once all rows are in
+    wb.save(out)
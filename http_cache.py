@@ -0,0 +1,143 @@
+"""
+http_cache.py
+
+Conditional GET and compression for the heavy pages.
+
+Views decorated with `@conditional` get a weak ETag built from a data
+version (newest catalog change, highest live and archived sale ids, and
+the business date) plus who is asking. When the browser - or the service
+worker's network-first fetch, through the HTTP cache - sends it back in
+If-None-Match and nothing changed, the view is not run at all and the
+answer is an empty 304.
+
+`init_app` also gzip-compresses (brotli when the optional `brotli` package
+is installed and the client accepts it) HTML, JSON, CSS and JS bodies of
+at least COMPRESS_MIN_SIZE bytes. Streamed responses such as exports are
+left alone.
+"""
+import gzip
+import hashlib
+import os
+import time
+from datetime import date
+from functools import wraps
+
+from flask import request, session, make_response, current_app
+from sqlalchemy import func, select
+
+from models import db, Medicine, Customer, Sale, ArchivedSale, SyncTombstone
+import business_day
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESSIBLE = ('text/html', 'application/json', 'text/css', 'application/javascript', 'text/javascript')
+
+# Pages embed a CSRF token that expires after an hour; re-render at least this often
+MAX_ETAG_AGE = 30 * 60
+
+# Changes whenever the code or templates are deployed again
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _release():
+    release = os.environ.get('RAILWAY_GIT_COMMIT_SHA') or os.environ.get('RELEASE')
+    if release:
+        return release
+    newest = 0.0
+    for folder in (_BASE_DIR, os.path.join(_BASE_DIR, 'templates')):
+        for name in os.listdir(folder):
+            if name.endswith(('.py', '.html')):
+                newest = max(newest, os.path.getmtime(os.path.join(folder, name)))
+    return str(int(newest))
+
+
+RELEASE = _release()
+
+
+def data_version():
+    """Everything the cached pages are derived from, read in one query.
+
+    The catalog part is the newest version stamped on a committed medicine,
+    customer or tombstone, so it changes the moment a write commits (the
+    change feed's watermark can lag behind a still-running transaction).
+    """
+    def newest(column):
+        return select(func.max(column)).scalar_subquery()
+    row = db.session.execute(select(
+        newest(Medicine.version), newest(Customer.version), newest(SyncTombstone.version),
+        newest(Sale.id), newest(ArchivedSale.id),
+    )).one()
+    return (*(value or 0 for value in row),
+            business_day.today().isoformat(), date.today().isoformat())
+
+
+def _etag():
+    parts = (
+        RELEASE,
+        request.full_path,
+        request.accept_mimetypes.best or '',
+        bool(session.get('is_admin')),
+        session.get('csrf_token', ''),
+        int(time.time() // MAX_ETAG_AGE),
+        *data_version(),
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+
+
+def conditional(view):
+    """Answer GETs with 304 when the data behind the page has not changed."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes'):
+            # Flash messages are shown once; always render them
+            return view(*args, **kwargs)
+        etag = _etag()
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            token = session.get('csrf_token')
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if session.get('csrf_token') != token:
+                # The page created the session's CSRF token: tag it with the token it embeds
+                etag = _etag()
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        if response.cache_control.max_age is None:
+            response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+def _compress(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    if encoding == 'br':
+        body = brotli.compress(body, quality=5)
+    else:
+        body = gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    app.after_request(_compress)
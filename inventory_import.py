@@ -0,0 +1,229 @@
+"""
+inventory_import.py
+
+Bulk medicine import from a supplier CSV or XLSX file.
+
+Rows are read as a stream (csv reader / openpyxl read-only mode), checked
+one by one, and applied in batches: one lookup query per batch finds the
+existing medicines (matched on name + brand, ignoring case and outer
+spaces in the file), then one executemany INSERT adds the new ones and one executemany
+UPDATE adds the delivered quantity and new prices to the rest. Invalid rows are
+skipped and reported with their row number; the valid rows are committed
+together at the end.
+"""
+import csv
+import io
+from datetime import date, datetime
+
+from sqlalchemy import bindparam, func, insert, update
+
+from models import db, Medicine
+import changes
+
+# Rows applied per lookup/INSERT/UPDATE round
+IMPORT_BATCH_SIZE = 1000
+
+COLUMNS = ('name', 'brand', 'category', 'cost_price', 'price', 'quantity', 'expiry_date', 'description')
+
+_NAME_LENGTH = Medicine.__table__.c.name.type.length
+
+
+class ImportFileError(Exception):
+    """The file as a whole cannot be imported (unknown format, missing columns)."""
+
+
+def _header_key(value):
+    return str(value or '').strip().lower().replace(' ', '_')
+
+
+def _match_key(name, brand):
+    return (name.strip().lower(), (brand or '').strip().lower())
+
+
+def _dict_rows(header, rows):
+    """Yield (row number, {column: value}) pairs; row 1 is the header."""
+    keys = [_header_key(h) for h in header]
+    missing = {'name', 'quantity'} - set(keys)
+    if missing:
+        raise ImportFileError(f"Missing column(s): {', '.join(sorted(missing))}")
+    for number, values in enumerate(rows, start=2):
+        if not values or all(v is None or str(v).strip() == '' for v in values):
+            continue
+        yield number, {k: v for k, v in zip(keys, values) if k in COLUMNS}
+
+
+def read_rows(stream, filename):
+    """Yield (row number, raw values) from a binary CSV or XLSX stream."""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if ext == 'csv':
+        reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        header = next(reader, None)
+        if header is None:
+            raise ImportFileError('The file is empty.')
+        yield from _dict_rows(header, reader)
+    elif ext in ('xlsx', 'xlsm'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFileError('Excel import requires the openpyxl package.')
+        wb = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                raise ImportFileError('The sheet is empty.')
+            yield from _dict_rows(header, rows)
+        finally:
+            wb.close()
+    else:
+        raise ImportFileError('Upload a .csv or .xlsx file.')
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _number(raw, field, cast):
+    if raw is None or str(raw).strip() == '':
+        return None
+    try:
+        value = cast(float(raw)) if cast is int else cast(raw)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'{field} must be a number')
+    if cast is int and float(raw) != value:
+        raise ValueError(f'{field} must be a whole number')
+    if value < 0:
+        raise ValueError(f'{field} cannot be negative')
+    return value
+
+
+def _expiry(raw):
+    if raw is None or str(raw).strip() == '':
+        return None
+    if isinstance(raw, datetime):
+        return raw.date()
+    if isinstance(raw, date):
+        return raw
+    try:
+        return datetime.strptime(str(raw).strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('expiry_date must be YYYY-MM-DD')
+
+
+def parse_row(raw):
+    """Validate one row; returns the cleaned values or raises ValueError."""
+    name = _text(raw.get('name'))
+    if not name:
+        raise ValueError('name is required')
+    if len(name) > _NAME_LENGTH:
+        raise ValueError(f'name is longer than {_NAME_LENGTH} characters')
+    quantity = _number(raw.get('quantity'), 'quantity', int)
+    if quantity is None:
+        raise ValueError('quantity is required')
+    return {
+        'name': name,
+        'brand': _text(raw.get('brand')),
+        'category': _text(raw.get('category')),
+        'cost_price': _number(raw.get('cost_price'), 'cost_price', float),
+        'price': _number(raw.get('price'), 'price', float),
+        'quantity': quantity,
+        'expiry_date': _expiry(raw.get('expiry_date')),
+        'description': _text(raw.get('description')),
+    }
+
+
+def _merge(into, row, set_quantity):
+    """Fold a repeated row for the same medicine into the pending one."""
+    into['quantity'] = row['quantity'] if set_quantity else into['quantity'] + row['quantity']
+    for field in ('brand', 'category', 'cost_price', 'price', 'expiry_date', 'description'):
+        if row[field] is not None:
+            into[field] = row[field]
+
+
+def _update_statement(set_quantity, version):
+    """UPDATE run once per batch with executemany; blank file values keep the current ones."""
+    t = Medicine.__table__
+    keep = lambda col: func.coalesce(bindparam(f'b_{col}', type_=t.c[col].type), t.c[col])
+    delivered = bindparam('b_quantity', type_=t.c.quantity.type)
+    quantity = delivered if set_quantity else t.c.quantity + delivered
+    return update(t).where(t.c.id == bindparam('b_id')).values(
+        quantity=quantity,
+        cost_price=keep('cost_price'),
+        price=keep('price'),
+        expiry_date=keep('expiry_date'),
+        category=keep('category'),
+        description=keep('description'),
+        version=version,
+    )
+
+
+def _apply_batch(batch, set_quantity, result):
+    """Insert or update one batch of (row number, cleaned row) pairs."""
+    # Names are stored trimmed, so comparing lower(name) lets ix_medicine_name_lower serve the lookup
+    names = {_match_key(row['name'], None)[0] for _, row in batch}
+    existing = {}
+    for med_id, name, brand in db.session.query(Medicine.id, Medicine.name, Medicine.brand).filter(
+        func.lower(Medicine.name).in_(names)
+    ):
+        existing.setdefault(_match_key(name, brand), med_id)
+
+    version = changes.next_version()
+    inserts, updates = {}, {}
+    for number, row in batch:
+        key = _match_key(row['name'], row['brand'])
+        if key in existing:
+            pending = updates.get(key)
+            if pending is None:
+                updates[key] = dict(row, id=existing[key])
+            else:
+                _merge(pending, row, set_quantity)
+        elif key in inserts:
+            _merge(inserts[key], row, set_quantity)
+        elif row['price'] is None:
+            result['errors'].append((number, 'price is required for a new medicine'))
+        else:
+            inserts[key] = dict(row, cost_price=row['cost_price'] or 0, version=version)
+
+    if inserts:
+        db.session.execute(insert(Medicine), list(inserts.values()))
+    if updates:
+        db.session.execute(_update_statement(set_quantity, version), [
+            {f'b_{k}': v for k, v in row.items() if k not in ('name', 'brand')}
+            for row in updates.values()
+        ])
+    result['inserted'] += len(inserts)
+    result['updated'] += len(updates)
+
+
+def import_medicines(rows, set_quantity=False, batch_size=IMPORT_BATCH_SIZE):
+    """Apply (row number, raw values) pairs from `read_rows` and commit.
+
+    By default a row's quantity is a delivery and is added to the stock of
+    an existing medicine; with `set_quantity` it replaces it (stock take).
+    Returns {'rows', 'inserted', 'updated', 'errors': [(row number, message)]}.
+    """
+    result = {'rows': 0, 'inserted': 0, 'updated': 0, 'errors': []}
+    batch = []
+    try:
+        for number, raw in rows:
+            result['rows'] += 1
+            try:
+                row = parse_row(raw)
+            except ValueError as e:
+                result['errors'].append((number, str(e)))
+                continue
+            batch.append((number, row))
+            if len(batch) >= batch_size:
+                _apply_batch(batch, set_quantity, result)
+                batch = []
+        if batch:
+            _apply_batch(batch, set_quantity, result)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    result['errors'].sort()
+    return result
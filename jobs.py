@@ -0,0 +1,322 @@
+"""
+jobs.py
+
+Background jobs for the slow admin downloads: sales exports and report
+snapshots.
+
+The `job` table is the queue. `enqueue()` stores a job and wakes this
+process's runner; a runner thread claims the oldest queued job with a
+conditional UPDATE (so two workers can never both take it), runs it inside
+its own app context and writes the finished file to JOB_RESULTS_DIR. The
+browser polls /jobs/<id> for progress and downloads the file from
+/jobs/<id>/download when it is done - the request that asked for it
+returns at once instead of holding a gunicorn worker until the timeout.
+
+- Deduplication: a job is keyed on its kind, its parameters and the data
+  version (http_cache.data_version). Asking again for the same export
+  while it is queued or running, or after it finished with no sales or
+  catalog change since, returns the existing job and file.
+- Concurrency: each process runs at most JOB_WORKERS jobs at a time
+  (default 1), so however many exports are queued, the remaining gunicorn
+  threads and database connections stay free for sales. Runner threads
+  only exist while there is work.
+- Crashes: a running job that has not reported progress for STALE_SECONDS
+  is taken over by the next runner; jobs queued by a worker that died are
+  picked up on the next enqueue or status poll by any worker.
+- Finished jobs and their files are deleted after RESULT_TTL_SECONDS.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from flask import g
+from sqlalchemy import delete, or_, select, update
+
+from models import db, Job
+import analytics
+import exports
+import http_cache
+
+JOB_WORKERS = max(int(os.environ.get('JOB_WORKERS', '1')), 1)
+RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR') or os.path.join(tempfile.gettempdir(), 'pharmacy-jobs')
+STALE_SECONDS = 300
+RESULT_TTL_SECONDS = 24 * 3600
+# Progress is written to the job row at most this often
+PROGRESS_INTERVAL = 1.0
+
+FORMATS = ('xlsx', 'csv')
+ACTIVE = ('queued', 'running')
+
+_jobs = Job.__table__
+
+
+def _date_param(params, name):
+    value = (params.get(name) or '').strip()
+    if value:
+        date.fromisoformat(value)  # ValueError for anything else
+    return value
+
+
+def _format_param(params):
+    fmt = (params.get('format') or 'xlsx').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt!r}; use {", ".join(FORMATS)}')
+    return fmt
+
+
+def _export_params(params):
+    return {
+        'q': (params.get('q') or '').strip(),
+        'from_date': _date_param(params, 'from_date'),
+        'to_date': _date_param(params, 'to_date'),
+        'format': _format_param(params),
+    }
+
+
+def _report_params(params):
+    group = params.get('group') or []
+    if isinstance(group, str):
+        group = [d.strip() for d in group.split(',') if d.strip()]
+    for dimension in group:
+        if dimension not in analytics.DIMENSIONS:
+            raise ValueError(f'Unknown dimension {dimension!r}; use {", ".join(analytics.DIMENSIONS)}')
+    bucket = params.get('bucket') or None
+    if bucket is not None and bucket not in analytics.BUCKETS:
+        raise ValueError(f'Unknown bucket {bucket!r}; use {", ".join(analytics.BUCKETS)}')
+    return {
+        'group': list(group),
+        'bucket': bucket,
+        'from': _date_param(params, 'from'),
+        'to': _date_param(params, 'to'),
+        'format': _format_param(params),
+    }
+
+
+class _Progress:
+    """Passes rows through, writing the share done to the job row now and then."""
+
+    def __init__(self, job_id, total):
+        self.job_id = job_id
+        self.total = max(total, 1)
+        self.done = 0
+        self._last = time.monotonic()
+
+    def __call__(self, rows):
+        for row in rows:
+            self.done += 1
+            if time.monotonic() - self._last >= PROGRESS_INTERVAL:
+                # The last few percent are writing the file
+                _set(self.job_id, progress=min(int(self.done * 95 / self.total), 95))
+                self._last = time.monotonic()
+            yield row
+
+
+def _write(path, fmt, title, headers, rows, widths=None):
+    if fmt == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8') as out:
+            for chunk in exports.csv_chunks(headers, rows):
+                out.write(chunk)
+    else:
+        with open(path, 'wb') as out:
+            exports.write_xlsx(out, title, headers, rows, widths)
+
+
+def _run_export(job_id, params, path):
+    """Sales lines matching the search filters, as on /sales/export."""
+    args = params['q'], params['from_date'], params['to_date']
+    progress = _Progress(job_id, exports.sales_lines_query(*args).count())
+    rows = exports.sales_cells(progress(exports.sales_lines(*args)))
+    _write(path, params['format'], 'Sales', exports.SALES_HEADERS, rows, exports.SALES_WIDTHS)
+    return 'sales_export'
+
+
+def _run_report(job_id, params, path):
+    """A saved copy of /api/reports/custom for the same parameters."""
+    rows = analytics.report(
+        group_by=tuple(params['group']), bucket=params['bucket'],
+        start=date.fromisoformat(params['from']) if params['from'] else None,
+        end=date.fromisoformat(params['to']) if params['to'] else None,
+    )
+    _set(job_id, progress=50)
+    keys = list(rows[0]) if rows else [k for k in [params['bucket'], *params['group']] if k] + ['revenue']
+    headers = [k.replace('_', ' ').title() for k in keys]
+    _write(path, params['format'], 'Report', headers, ([row[k] for k in keys] for row in rows))
+    return 'sales_report'
+
+
+# kind -> (parameter check, run function)
+KINDS = {
+    'export': (_export_params, _run_export),
+    'report': (_report_params, _run_report),
+}
+
+
+def _set(job_id, **values):
+    """Update the job row in its own short transaction (also the running job's heartbeat)."""
+    with db.engine.begin() as conn:
+        conn.execute(update(_jobs).where(_jobs.c.id == job_id).values(updated_at=datetime.now(), **values))
+
+
+def _claim():
+    """Take the oldest queued (or abandoned running) job; returns its id or None."""
+    stale = datetime.now() - timedelta(seconds=STALE_SECONDS)
+    claimable = or_(_jobs.c.status == 'queued', (_jobs.c.status == 'running') & (_jobs.c.updated_at < stale))
+    with db.engine.begin() as conn:
+        candidates = conn.execute(select(_jobs.c.id).where(claimable).order_by(_jobs.c.id).limit(5)).scalars().all()
+        for job_id in candidates:
+            now = datetime.now()
+            taken = conn.execute(update(_jobs).where(_jobs.c.id == job_id, claimable).values(
+                status='running', progress=0, error=None, started_at=now, updated_at=now))
+            if taken.rowcount == 1:
+                return job_id
+    return None
+
+
+def _execute(job_id):
+    job = db.session.get(Job, job_id)
+    params = json.loads(job.params)
+    run = KINDS[job.kind][1]
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    fmt = params['format']
+    path = os.path.join(RESULTS_DIR, f'job-{job_id}.{fmt}')
+    partial = path + '.part'
+    try:
+        # Job reads may use the read replica, like the routes they replace
+        g.use_replica = True
+        prefix = run(job_id, params, partial)
+        g.use_replica = False
+        os.replace(partial, path)
+    except Exception as e:
+        g.use_replica = False
+        db.session.rollback()
+        print(f"Warning: job {job_id} ({job.kind}) failed: {e}")
+        if os.path.exists(partial):
+            os.remove(partial)
+        _set(job_id, status='failed', error=str(e), finished_at=datetime.now())
+        return
+    name = f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    _set(job_id, status='done', progress=100, result_path=path, result_name=name, finished_at=datetime.now())
+
+
+class Runner:
+    """Up to JOB_WORKERS threads in this process, started on demand."""
+
+    def __init__(self, app, workers=JOB_WORKERS):
+        self.app = app
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._active = 0
+        self._wanted = False
+
+    def kick(self):
+        """There may be work: make sure a runner thread will look for it."""
+        with self._lock:
+            self._wanted = True
+            if self._active >= self.workers:
+                return
+            self._active += 1
+        threading.Thread(target=self._work, name='job-runner', daemon=True).start()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._wanted = False
+            try:
+                with self.app.app_context():
+                    job_id = _claim()
+                    if job_id is not None:
+                        _execute(job_id)
+            except Exception as e:
+                print(f"Warning: job runner error: {e}")
+                job_id = None
+            if job_id is not None:
+                continue
+            with self._lock:
+                # A kick that arrived while we were looking may have found no free thread
+                if not self._wanted:
+                    self._active -= 1
+                    return
+
+
+_runner = None
+
+
+def init_app(app):
+    """Create this process's runner."""
+    global _runner
+    _runner = Runner(app)
+    return _runner
+
+
+def _dedupe_key(kind, params):
+    raw = json.dumps([kind, params, http_cache.data_version()], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _reusable(job):
+    if job.status == 'done':
+        return bool(job.result_path) and os.path.exists(job.result_path)
+    if job.status == 'running':
+        return job.updated_at >= datetime.now() - timedelta(seconds=STALE_SECONDS)
+    return job.status == 'queued'
+
+
+def prune():
+    """Delete finished jobs older than RESULT_TTL_SECONDS and their files; returns how many."""
+    cutoff = datetime.now() - timedelta(seconds=RESULT_TTL_SECONDS)
+    old = db.session.query(Job.id, Job.result_path).filter(
+        Job.status.in_(('done', 'failed')), Job.finished_at < cutoff
+    ).limit(500).all()
+    for _, path in old:
+        if path and os.path.exists(path):
+            os.remove(path)
+    if old:
+        db.session.execute(delete(Job).where(Job.id.in_([job_id for job_id, _ in old])))
+        db.session.commit()
+    return len(old)
+
+
+def enqueue(kind, params):
+    """Queue a job, or find an identical one; returns (job, created).
+
+    Raises ValueError for an unknown kind or bad parameters.
+    """
+    if kind not in KINDS:
+        raise ValueError(f'Unknown job kind {kind!r}; use {", ".join(KINDS)}')
+    params = KINDS[kind][0](params)
+    key = _dedupe_key(kind, params)
+    for job in Job.query.filter(Job.dedupe_key == key, Job.status.in_(ACTIVE + ('done',))).order_by(Job.id.desc()):
+        if _reusable(job):
+            if job.status in ACTIVE:
+                kick()
+            return job, False
+    prune()
+    job = Job(kind=kind, params=json.dumps(params, sort_keys=True), dedupe_key=key, status='queued')
+    db.session.add(job)
+    db.session.commit()
+    kick()
+    return job, True
+
+
+def kick():
+    if _runner is not None:
+        _runner.kick()
+
+
+def describe(job):
+    """JSON-ready status of `job`."""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'filename': job.result_name,
+    }
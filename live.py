@@ -0,0 +1,177 @@
+"""
+live.py
+
+Server-Sent Events for open dashboards and report pages (/api/live).
+
+One publisher thread per worker process watches the data version
+(http_cache.data_version: a single cheap query). When it changes, the
+publisher rebuilds the dashboard payload once, compares it with the
+previous one and publishes only the sections that changed:
+
+    sales   - sales_dates, sales_amounts, total_sales
+    stock   - stock_labels, stock_quantities, total_medicines, total_stock
+    expiry  - expiring_soon, expired
+
+Every connected screen in the worker reads the same event from a shared
+buffer, so N open dashboards cost one computation. Commits in this process
+that bump the catalog version (sales, stock and medicine edits) wake the
+publisher at once; changes made by other workers are seen on the next poll.
+The thread only runs while someone is listening.
+
+Each open stream holds a worker thread, so serve the app with a threaded
+(gthread) or async (gevent) gunicorn worker class. So that open screens
+can never take every thread from the sales path, a process serves at most
+MAX_STREAMS streams (LIVE_MAX_STREAMS); further screens get 204 No
+Content, which stops their EventSource, and fall back to polling
+/api/dashboard. Streams end after STREAM_SECONDS and the browser's
+EventSource reconnects with Last-Event-ID, replaying anything it missed
+from the buffer. When that is not possible (another worker answered, or
+the buffer moved on) the client gets a `resync` event and fetches
+/api/dashboard once.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import http_cache
+
+POLL_SECONDS = 2
+HEARTBEAT_SECONDS = 15
+STREAM_SECONDS = 300
+BUFFER_SIZE = 100
+# Open streams per process; keep it well below the gunicorn thread count (Procfile)
+MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', '3'))
+
+# Event name -> dashboard payload keys it carries
+SECTIONS = {
+    'sales': ('sales_dates', 'sales_amounts', 'total_sales'),
+    'stock': ('stock_labels', 'stock_quantities', 'total_medicines', 'total_stock'),
+    'expiry': ('expiring_soon', 'expired'),
+}
+
+
+class Publisher:
+    """Computes each change once and fans it out to every stream of this process."""
+
+    def __init__(self, app, compute):
+        self.app = app
+        self.compute = compute
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._events = deque(maxlen=BUFFER_SIZE)  # (seq, name, json data)
+        self._seq = 0
+        self._subscribers = 0
+        self._slots = threading.BoundedSemaphore(MAX_STREAMS) if MAX_STREAMS > 0 else None
+        self._thread = None
+        self._version = None
+        self._payload = None
+        # Event ids are '<token>-<seq>'; a different token means another process
+        self.token = uuid.uuid4().hex[:8]
+
+    def acquire_slot(self):
+        """Reserve one of this process's MAX_STREAMS stream slots; False when all are taken."""
+        return self._slots is not None and self._slots.acquire(blocking=False)
+
+    def release_slot(self):
+        self._slots.release()
+
+    def notify(self):
+        """Something changed in this process; check now instead of at the next poll."""
+        self._wake.set()
+
+    def _publish(self, name, data):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, name, json.dumps(data)))
+            self._cond.notify_all()
+
+    def _check(self):
+        with self.app.app_context():
+            version = http_cache.data_version()
+            if version == self._version:
+                return
+            payload = self.compute()
+        previous, self._version, self._payload = self._payload, version, payload
+        if previous is None:
+            return  # first look: the screens already show this state
+        for name, keys in SECTIONS.items():
+            if any(payload[k] != previous[k] for k in keys):
+                self._publish(name, {k: payload[k] for k in keys})
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._subscribers:
+                    self._thread = None
+                    self._version = self._payload = None
+                    return
+            try:
+                self._check()
+            except Exception as e:
+                print(f"Warning: live update check failed: {e}")
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+
+    def _resume_from(self, last_event_id):
+        """Sequence number to continue after, or None when the client must resync."""
+        token, _, seq = (last_event_id or '').partition('-')
+        if token != self.token or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._events[0][0] if self._events else self._seq + 1
+        if seq > self._seq or seq < oldest - 1:
+            return None
+        return seq
+
+    def stream(self, last_event_id=None):
+        """SSE text chunks for one client, continuing after `last_event_id` (the Last-Event-ID header)."""
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-publisher', daemon=True)
+                self._thread.start()
+            seen = self._resume_from(last_event_id) if last_event_id else self._seq
+            resync = seen is None
+            if resync:
+                seen = self._seq
+        try:
+            yield 'retry: 3000\n\n'
+            if resync:
+                yield f'id: {self.token}-{seen}\nevent: resync\ndata: {{}}\n\n'
+            deadline = time.monotonic() + STREAM_SECONDS
+            while time.monotonic() < deadline:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._seq > seen, timeout=HEARTBEAT_SECONDS)
+                    new = [e for e in self._events if e[0] > seen]
+                if not new:
+                    yield ': keepalive\n\n'
+                for seq, name, data in new:
+                    yield f'id: {self.token}-{seq}\nevent: {name}\ndata: {data}\n\n'
+                    seen = seq
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+
+_publisher = None
+
+
+def _after_commit(session):
+    # changes.next_version() ran in this transaction: a sale or catalog write
+    if _publisher is not None and 'change_version' in session.info:
+        _publisher.notify()
+
+
+def init_app(app, compute):
+    """Create this process's publisher; `compute()` returns the dashboard payload."""
+    global _publisher
+    _publisher = Publisher(app, compute)
+    if not event.contains(Session, 'after_commit', _after_commit):
+        event.listen(Session, 'after_commit', _after_commit)
+    return _publisher
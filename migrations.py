@@ -0,0 +1,214 @@
+"""
+migrations.py
+
+Schema migrations tracked in the `schema_version` table.
+
+`MIGRATIONS` is an ordered list of (version, name, function) steps. Each
+applied step leaves a row in `schema_version`, so a worker booting against
+an up-to-date database runs a single `SELECT max(version)` instead of
+probing every table and column. Pending steps run from
+`flask --app app migrate`, or at startup by whichever process takes the
+migration lock first (a Postgres advisory lock, or a lock file next to a
+SQLite database); the others wait for it and then find nothing to do.
+
+Steps must be idempotent: versions 1-5 bring a database from any earlier
+release up to date whatever state it is in, and a step that fails is
+retried on the next run.
+Add new schema changes as new steps at the end of the list.
+"""
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import func, inspect, insert, select, text
+
+from models import db, Sale, ArchivedSale, SchemaVersion
+import business_day
+import changes
+import rollups
+import sales
+import search_index
+
+# Arbitrary key for pg_advisory_lock, shared by every process of the app
+ADVISORY_LOCK_KEY = 724_011_019
+
+# Columns added after the first release: (table, column, sqlite type, postgres type)
+ADDED_COLUMNS = [
+    ('medicine', 'cost_price', 'FLOAT DEFAULT 0', 'DOUBLE PRECISION DEFAULT 0'),
+    ('sale', 'client_ref', 'VARCHAR(64)', 'VARCHAR(64)'),
+    ('medicine', 'version', 'BIGINT NOT NULL DEFAULT 0', 'BIGINT NOT NULL DEFAULT 0'),
+    ('customer', 'version', 'BIGINT NOT NULL DEFAULT 0', 'BIGINT NOT NULL DEFAULT 0'),
+    ('sale', 'sale_date', 'DATE', 'DATE'),
+    ('sale_archive', 'sale_date', 'DATE', 'DATE'),
+    ('sale', 'cost_per_unit', 'FLOAT', 'DOUBLE PRECISION'),
+    ('sale', 'total_cost', 'FLOAT', 'DOUBLE PRECISION'),
+    ('sale_item', 'cost_per_unit', 'FLOAT', 'DOUBLE PRECISION'),
+    ('sale_item', 'total_cost', 'FLOAT', 'DOUBLE PRECISION'),
+    ('sale_archive', 'cost_per_unit', 'FLOAT', 'DOUBLE PRECISION'),
+    ('sale_archive', 'total_cost', 'FLOAT', 'DOUBLE PRECISION'),
+    ('sale_item_archive', 'cost_per_unit', 'FLOAT', 'DOUBLE PRECISION'),
+    ('sale_item_archive', 'total_cost', 'FLOAT', 'DOUBLE PRECISION'),
+]
+
+
+def _create_tables():
+    db.create_all()
+
+
+def _add_columns():
+    with db.engine.begin() as conn:
+        dialect = conn.dialect.name
+        for table, column, sqlite_type, pg_type in ADDED_COLUMNS:
+            if dialect == 'sqlite':
+                cols = [r[1] for r in conn.execute(text(f"PRAGMA table_info('{table}')"))]
+                if column not in cols:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sqlite_type}"))
+                    print(f'Added {column} column to {table} (sqlite)')
+            elif dialect in ('postgres', 'postgresql'):
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {pg_type}"))
+
+
+def _create_indexes():
+    """Create every index declared in models.py that an older database lacks."""
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            if conn.dialect.name == 'sqlite':
+                # The SQLite inspector skips expression indexes such as lower(name)
+                existing = {name for (name,) in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"), {'t': table.name})}
+            else:
+                existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+                    print(f'Created index {index.name} on {table.name}')
+
+
+def _name_search_index():
+    # FTS5 on SQLite, pg_trgm on Postgres; searches fall back to LIKE without it
+    with db.engine.begin() as conn:
+        reason = search_index.unavailable_reason(conn)
+        if reason:
+            print(f"Warning: skipping name search index: {reason}")
+            return
+        for table in search_index.ensure_index(conn):
+            print(f'Built name search index for {table}')
+
+
+def _backfill_sales():
+    """Line items, cost snapshots and business dates for sales from older releases."""
+    added = sales.backfill_items()
+    if added:
+        print(f'Added line items for {added} existing sales')
+    costed = sales.backfill_costs()
+    if costed:
+        print(f'Stored cost prices on {costed} existing sales')
+    filled = business_day.backfill(Sale) + business_day.backfill(ArchivedSale)
+    if filled:
+        print(f'Set business date on {filled} existing sales')
+    if filled or rollups.is_empty():
+        # Rollups built before business dates were bucketed by calendar date
+        days = rollups.rebuild()
+        print(f'Built sales rollups for {days} days of history')
+
+
+def _catalog_sequence():
+    with db.engine.begin() as conn:
+        if conn.dialect.name in ('postgres', 'postgresql'):
+            changes.create_sequence(conn)
+
+
+MIGRATIONS = [
+    (1, 'create tables', _create_tables),
+    (2, 'add columns from earlier releases', _add_columns),
+    (3, 'create declared indexes', _create_indexes),
+    (4, 'name search index', _name_search_index),
+    (5, 'backfill sales and rollups', _backfill_sales),
+    (6, 'background job table', _create_tables),
+    (7, 'index archived client refs', _create_indexes),
+    (8, 'catalog version sequence', _catalog_sequence),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version():
+    """Highest applied migration, or 0 for a database that has never been migrated."""
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+    except Exception:
+        # No schema_version table yet
+        return 0
+
+
+@contextmanager
+def _migration_lock():
+    """Hold the app-wide migration lock (blocks until it is free)."""
+    engine = db.engine
+    if engine.dialect.name in ('postgres', 'postgresql'):
+        with engine.connect() as conn:
+            conn.execute(text('SELECT pg_advisory_lock(:k)'), {'k': ADVISORY_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text('SELECT pg_advisory_unlock(:k)'), {'k': ADVISORY_LOCK_KEY})
+        return
+    path = engine.url.database if engine.dialect.name == 'sqlite' else None
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        fcntl = None
+    if not path or path == ':memory:' or fcntl is None:
+        yield
+        return
+    with open(path + '.migrate.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate():
+    """Apply pending migrations in order under the migration lock; returns the names applied.
+
+    Stops at the first failing step (after printing it) so later steps never
+    run against a half-migrated schema.
+    """
+    applied = []
+    with _migration_lock():
+        # Another process may have migrated while we waited for the lock
+        done = current_version()
+        for version, name, step in MIGRATIONS:
+            if version <= done:
+                continue
+            try:
+                step()
+                with db.engine.begin() as conn:
+                    conn.execute(insert(SchemaVersion).values(version=version, name=name, applied_at=datetime.now()))
+            except Exception as e:
+                db.session.rollback()
+                print(f"Warning: migration {version} ({name}) failed: {e}")
+                break
+            applied.append(name)
+            print(f'Applied migration {version}: {name}')
+        db.session.remove()
+    return applied
+
+
+def ensure_current():
+    """Startup check: one version query, migrating first if the database is behind.
+
+    Set AUTO_MIGRATE=0 to leave migrations to `flask --app app migrate`
+    (for deployments that migrate in a release step).
+    """
+    version = current_version()
+    if version >= LATEST:
+        return
+    if os.environ.get('AUTO_MIGRATE', '1') == '0':
+        print(f"Warning: database schema is at version {version}, app expects {LATEST}; "
+              "run `flask --app app migrate`")
+        return
+    migrate()
@@ -8,8 +8,11 @@ from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from engine_profiles import RoutingSession
+
 # SQLAlchemy object created here and initialized in app.py
-db = SQLAlchemy()
+# (its session can route read-only requests to a replica, see engine_profiles.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Admin(db.Model):
@@ -29,14 +32,16 @@ class Admin(db.Model):
 class Medicine(db.Model):
     """Medicine inventory record."""
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     brand = db.Column(db.String(120))
     cost_price = db.Column(db.Float, nullable=True, default=0)
     price = db.Column(db.Float, nullable=False)
-    quantity = db.Column(db.Integer, nullable=False, default=0)
-    expiry_date = db.Column(db.Date, nullable=True)
-    category = db.Column(db.String(80))
+    quantity = db.Column(db.Integer, nullable=False, default=0, index=True)
+    expiry_date = db.Column(db.Date, nullable=True, index=True)
+    category = db.Column(db.String(80), index=True)
     description = db.Column(db.Text)
+    # Catalog change version of the last write (see changes.py)
+    version = db.Column(db.BigInteger, nullable=False, default=0, index=True)
     
     def get_cost_price(self):
         """Get cost price with fallback to 0 if column doesn't exist"""
@@ -55,22 +60,164 @@ class Medicine(db.Model):
         return today <= self.expiry_date <= (today + timedelta(days=days))
 
 
+# Case-insensitive name prefix filter and lookup (range scan on lower(name))
+db.Index('ix_medicine_name_lower', db.func.lower(Medicine.name))
+
+
 class Customer(db.Model):
     """Simple customer record (optional info)."""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
-    phone = db.Column(db.String(30))
+    phone = db.Column(db.String(30), index=True)
+    # Catalog change version of the last write (see changes.py)
+    version = db.Column(db.BigInteger, nullable=False, default=0, index=True)
+
+
+# Case-insensitive name prefix lookup on the new-sale screen
+db.Index('ix_customer_name_lower', db.func.lower(Customer.name))
 
 
 class Sale(db.Model):
-    """A recorded sale. Stock is reduced when sale is created."""
+    """A recorded sale (one counter transaction). Stock is reduced when sale is created.
+
+    The medicines sold are the `items` lines. `medicine_id`, `quantity` and
+    `price_per_unit` predate multi-line sales and describe the first line;
+    `quantity`, `total_price` and `total_cost` are totals over all lines.
+    """
+    __table_args__ = (
+        # Covers the date-grouped revenue sums without touching the table
+        db.Index('ix_sale_timestamp_total_price', 'timestamp', 'total_price'),
+        # Same for revenue and cost (profit) per business date
+        db.Index('ix_sale_date_totals', 'sale_date', 'total_price', 'total_cost'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    medicine_id = db.Column(db.Integer, db.ForeignKey("medicine.id"), nullable=False)
+    medicine_id = db.Column(db.Integer, db.ForeignKey("medicine.id"), nullable=False, index=True)
     medicine = db.relationship("Medicine")
     quantity = db.Column(db.Integer, nullable=False)
     price_per_unit = db.Column(db.Float, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
+    # Cost price snapshot taken at sale time, so later cost changes don't rewrite past margins
+    cost_per_unit = db.Column(db.Float, nullable=True)
+    total_cost = db.Column(db.Float, nullable=True)
     # Store timestamp in local server time (not UTC)
-    timestamp = db.Column(db.DateTime, default=datetime.now)
-    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id"), nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.now, index=True)
+    # Business date of `timestamp` (shop timezone and day cutoff, see business_day.py)
+    sale_date = db.Column(db.Date, nullable=True, index=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id"), nullable=True, index=True)
     customer = db.relationship("Customer")
+    # Client-side key of an offline-queued sale; makes sync retries idempotent
+    client_ref = db.Column(db.String(64), unique=True, index=True, nullable=True)
+    items = db.relationship("SaleItem", back_populates="sale", order_by="SaleItem.id", cascade="all, delete-orphan")
+
+
+class SaleItem(db.Model):
+    """One line of a sale: a medicine, how many and at what price."""
+    __tablename__ = 'sale_item'
+    id = db.Column(db.Integer, primary_key=True)
+    sale_id = db.Column(db.Integer, db.ForeignKey("sale.id"), nullable=False, index=True)
+    sale = db.relationship("Sale", back_populates="items")
+    medicine_id = db.Column(db.Integer, db.ForeignKey("medicine.id"), nullable=False, index=True)
+    medicine = db.relationship("Medicine")
+    quantity = db.Column(db.Integer, nullable=False)
+    price_per_unit = db.Column(db.Float, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    cost_per_unit = db.Column(db.Float, nullable=True)
+    total_cost = db.Column(db.Float, nullable=True)
+
+
+class ArchivedSale(db.Model):
+    """A sale moved out of `sale` by the archive (see archive.py). Same columns, no foreign keys."""
+    __tablename__ = 'sale_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    medicine_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price_per_unit = db.Column(db.Float, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    cost_per_unit = db.Column(db.Float, nullable=True)
+    total_cost = db.Column(db.Float, nullable=True)
+    timestamp = db.Column(db.DateTime, index=True)
+    sale_date = db.Column(db.Date, nullable=True, index=True)
+    customer_id = db.Column(db.Integer, nullable=True)
+    # Looked up by sync retries (sales.recorded_refs). Not unique: archives made before
+    # that lookup existed can hold a retried sale twice.
+    client_ref = db.Column(db.String(64), nullable=True, index=True)
+
+
+class ArchivedSaleItem(db.Model):
+    """A line of an archived sale."""
+    __tablename__ = 'sale_item_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sale_id = db.Column(db.Integer, nullable=False, index=True)
+    medicine_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price_per_unit = db.Column(db.Float, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    cost_per_unit = db.Column(db.Float, nullable=True)
+    total_cost = db.Column(db.Float, nullable=True)
+
+
+class SchemaVersion(db.Model):
+    """One row per applied schema migration (see migrations.py)."""
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(120), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class ChangeCounter(db.Model):
+    """Named counters; the 'catalog' row hands out medicine/customer change versions on SQLite."""
+    __tablename__ = 'change_counter'
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class SyncTombstone(db.Model):
+    """Marks a deleted medicine or customer so offline clients can drop their copy."""
+    __tablename__ = 'sync_tombstone'
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(40), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.BigInteger, nullable=False, index=True)
+
+
+class DailySalesRollup(db.Model):
+    """Running sales totals per business day (`Sale.sale_date`).
+
+    Updated in the same transaction as every sale so reports can read a
+    handful of rows instead of scanning the whole sales table.
+    """
+    __tablename__ = 'daily_sales_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MedicineSalesRollup(db.Model):
+    """Running all-time sales totals per medicine (used for best-sellers)."""
+    __tablename__ = 'medicine_sales_rollup'
+    medicine_id = db.Column(db.Integer, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    """A background export or report run by jobs.py; polled at /jobs/<id>."""
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    # Hash of kind, params and data version: identical requests share one job
+    dedupe_key = db.Column(db.String(40), nullable=False, index=True)
+    status = db.Column(db.String(10), nullable=False, default='queued', index=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)  # percent
+    error = db.Column(db.Text, nullable=True)
+    result_path = db.Column(db.String(255), nullable=True)
+    result_name = db.Column(db.String(120), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    finished_at = db.Column(db.DateTime, nullable=True)
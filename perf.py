@@ -0,0 +1,131 @@
+"""
+perf.py
+
+Opt-in request/SQL profiling (enable with PERF_PROFILING=1).
+
+For every request it records wall time, number of SQL statements and time
+spent in SQL (via SQLAlchemy engine events), and flags statements executed
+many times with identical SQL - the usual sign of an N+1 lazy-load loop.
+Results go out as `Server-Timing` / `X-SQL-*` response headers and are
+kept per route so /admin/perf can show percentiles.
+"""
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Identical statements run this many times in one request are flagged as N+1
+REPEAT_THRESHOLD = 5
+
+# Samples kept per route for percentiles
+SAMPLES_PER_ROUTE = 500
+
+
+class RouteStats:
+    """Rolling samples for one endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.wall_ms = deque(maxlen=SAMPLES_PER_ROUTE)
+        self.sql_ms = deque(maxlen=SAMPLES_PER_ROUTE)
+        self.queries = deque(maxlen=SAMPLES_PER_ROUTE)
+        self.n_plus_one = 0
+        self.last_repeated = None
+
+
+_stats = defaultdict(RouteStats)
+_lock = threading.Lock()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'perf_sql' in g:
+        conn.info.setdefault('perf_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'perf_sql' in g:
+        starts = conn.info.get('perf_start')
+        if starts:
+            g.perf_sql_time += time.perf_counter() - starts.pop()
+        g.perf_sql[statement] += 1
+
+
+def _start_request():
+    g.perf_start = time.perf_counter()
+    g.perf_sql = Counter()
+    g.perf_sql_time = 0.0
+
+
+def _finish_request(response):
+    if 'perf_sql' not in g:
+        return response
+    wall_ms = (time.perf_counter() - g.perf_start) * 1000
+    sql_ms = g.perf_sql_time * 1000
+    queries = sum(g.perf_sql.values())
+    repeated = [(stmt, n) for stmt, n in g.perf_sql.items() if n >= REPEAT_THRESHOLD]
+
+    response.headers['Server-Timing'] = (
+        f'app;dur={wall_ms:.1f}, db;dur={sql_ms:.1f};desc="{queries} queries"'
+    )
+    response.headers['X-SQL-Queries'] = str(queries)
+    if repeated:
+        response.headers['X-SQL-Repeated'] = str(len(repeated))
+
+    endpoint = request.endpoint or request.path
+    with _lock:
+        stats = _stats[endpoint]
+        stats.count += 1
+        stats.wall_ms.append(wall_ms)
+        stats.sql_ms.append(sql_ms)
+        stats.queries.append(queries)
+        if repeated:
+            stats.n_plus_one += 1
+            stmt, n = max(repeated, key=lambda r: r[1])
+            stats.last_repeated = (n, ' '.join(stmt.split())[:300])
+    return response
+
+
+def init_app(app):
+    """Register the profiling hooks on `app` (all engines are instrumented)."""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def snapshot():
+    """Per-route summary rows for the /admin/perf page, slowest p95 first."""
+    rows = []
+    with _lock:
+        for endpoint, s in _stats.items():
+            wall = list(s.wall_ms)
+            rows.append({
+                'endpoint': endpoint,
+                'count': s.count,
+                'p50': percentile(wall, 50),
+                'p95': percentile(wall, 95),
+                'p99': percentile(wall, 99),
+                'avg_queries': sum(s.queries) / len(s.queries) if s.queries else 0,
+                'avg_sql_ms': sum(s.sql_ms) / len(s.sql_ms) if s.sql_ms else 0,
+                'n_plus_one': s.n_plus_one,
+                'last_repeated': s.last_repeated,
+            })
+    return sorted(rows, key=lambda r: r['p95'], reverse=True)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,163 @@
+"""
+rollups.py
+
+Pre-aggregated sales totals (per day and per medicine).
+
+Every sale write calls `record_sale()` before committing, so the rollup
+rows always move together with the `Sale` table. Reports then read a few
+summary rows instead of loading every sale. `rebuild()` recomputes
+everything from the sale lines (used by `flask rebuild-rollups`).
+Archived sales stay counted: archiving moves rows, not totals.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, insert, delete
+
+from models import (db, Medicine, Sale, SaleItem, ArchivedSale, ArchivedSaleItem,
+                    DailySalesRollup, MedicineSalesRollup)
+import business_day
+
+_COUNTERS = ('revenue', 'cost', 'quantity', 'sale_count')
+
+
+def _upsert(model, key_name, key_value, values):
+    """Add `values` to the counters of one rollup row, creating it if needed."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect in ('postgres', 'postgresql'):
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    if dialect_insert is not None:
+        stmt = dialect_insert(model).values(**{key_name: key_value}, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key_name],
+            set_={c: getattr(model, c) + stmt.excluded[c] for c in _COUNTERS},
+        )
+        db.session.execute(stmt)
+        return
+
+    # Generic fallback: read-modify-write inside the current transaction
+    row = db.session.get(model, key_value)
+    if row is None:
+        db.session.add(model(**{key_name: key_value}, **values))
+    else:
+        for c in _COUNTERS:
+            setattr(row, c, getattr(row, c) + values[c])
+
+
+def record_sale(sale):
+    """Add one sale to the rollups. Call before `db.session.commit()`.
+
+    Uses the cost snapshot already set on the sale and its lines (`total_cost`).
+    """
+    if sale.timestamp is None:
+        sale.timestamp = datetime.now()
+    if sale.sale_date is None:
+        sale.sale_date = business_day.business_date(sale.timestamp)
+    _upsert(DailySalesRollup, 'day', sale.sale_date, {
+        'revenue': sale.total_price,
+        'cost': sale.total_cost or 0.0,
+        'quantity': sum(item.quantity for item in sale.items),
+        'sale_count': 1,
+    })
+    for item in sale.items:
+        _upsert(MedicineSalesRollup, 'medicine_id', item.medicine_id, {
+            'revenue': item.total_price,
+            'cost': item.total_cost or 0.0,
+            'quantity': item.quantity,
+            'sale_count': 1,
+        })
+
+
+def _grouped(key, count, lines, *criteria, sale_model=Sale):
+    """Aggregate `lines` (the sale model itself, or its line model) matching `criteria` grouped by `key`.
+
+    Cost is the snapshot stored on each row, so no medicine join is needed.
+    """
+    q = db.session.query(
+        key.label('key'),
+        func.coalesce(func.sum(lines.total_price), 0.0),
+        func.coalesce(func.sum(func.coalesce(lines.total_cost, 0.0)), 0.0),
+        func.coalesce(func.sum(lines.quantity), 0),
+        count,
+    ).select_from(lines)
+    if lines is not sale_model:
+        q = q.join(sale_model, lines.sale_id == sale_model.id)
+    return q.filter(*criteria).group_by(key)
+
+
+def _rollup_groups(sale_model=Sale, item_model=SaleItem):
+    """(model, key column name, group key, count expression, rows summed) for both rollups.
+
+    Days sum the sale headers and count sales (transactions); medicines sum
+    the lines and count the lines they appear on.
+    """
+    return (
+        (DailySalesRollup, 'day', sale_model.sale_date, func.count(sale_model.id), sale_model),
+        (MedicineSalesRollup, 'medicine_id', item_model.medicine_id, func.count(item_model.id), item_model),
+    )
+
+
+def rebuild():
+    """Recompute both rollup tables from the full sales history (live and archived) and commit."""
+    db.session.execute(delete(DailySalesRollup))
+    db.session.execute(delete(MedicineSalesRollup))
+    for model, key_name, key, count, lines in _rollup_groups():
+        db.session.execute(
+            insert(model).from_select([key_name, *_COUNTERS], _grouped(key, count, lines, Sale.sale_date.isnot(None)).statement)
+        )
+    # Archived sales are no longer in `sale` but still count towards the totals
+    for model, key_name, key, count, lines in _rollup_groups(ArchivedSale, ArchivedSaleItem):
+        rows = _grouped(key, count, lines, ArchivedSale.sale_date.isnot(None), sale_model=ArchivedSale).all()
+        for k, revenue, cost, qty, n in rows:
+            _upsert(model, key_name, k, {'revenue': revenue, 'cost': cost, 'quantity': qty, 'sale_count': n})
+    db.session.commit()
+    return DailySalesRollup.query.count()
+
+
+def is_empty():
+    """True when the rollups have never been built but sales exist."""
+    return (db.session.query(DailySalesRollup.day).first() is None
+            and db.session.query(Sale.id).first() is not None)
+
+
+def totals(start_day=None, end_day=None):
+    """Summed revenue/cost/quantity/count over the daily rollup, optionally by date range."""
+    q = db.session.query(
+        func.coalesce(func.sum(DailySalesRollup.revenue), 0.0),
+        func.coalesce(func.sum(DailySalesRollup.cost), 0.0),
+        func.coalesce(func.sum(DailySalesRollup.quantity), 0),
+        func.coalesce(func.sum(DailySalesRollup.sale_count), 0),
+    )
+    if start_day is not None:
+        q = q.filter(DailySalesRollup.day >= start_day)
+    if end_day is not None:
+        q = q.filter(DailySalesRollup.day <= end_day)
+    revenue, cost, qty, count = q.one()
+    return {'revenue': float(revenue), 'cost': float(cost), 'quantity': int(qty), 'sale_count': int(count)}
+
+
+def daily(start_day, end_day=None):
+    """(day, revenue, sale_count) rows in date order, like the old GROUP BY queries."""
+    q = db.session.query(
+        DailySalesRollup.day, DailySalesRollup.revenue, DailySalesRollup.sale_count
+    ).filter(DailySalesRollup.day >= start_day)
+    if end_day is not None:
+        q = q.filter(DailySalesRollup.day <= end_day)
+    return q.order_by(DailySalesRollup.day).all()
+
+
+def best_sellers(limit=10):
+    """(id, name, price, total_qty, total_revenue) for the top medicines by units sold."""
+    return db.session.query(
+        Medicine.id,
+        Medicine.name,
+        Medicine.price,
+        MedicineSalesRollup.quantity.label('total_qty'),
+        MedicineSalesRollup.revenue.label('total_revenue'),
+    ).join(MedicineSalesRollup, MedicineSalesRollup.medicine_id == Medicine.id).filter(
+        MedicineSalesRollup.quantity > 0
+    ).order_by(MedicineSalesRollup.quantity.desc()).limit(limit).all()
@@ -0,0 +1,212 @@
+"""
+sales.py
+
+The one place where a sale is recorded.
+
+Stock is taken with a single conditional UPDATE
+(`quantity = quantity - :q WHERE id = :id AND quantity >= :q RETURNING ...`):
+a returned row means it succeeded, so two workers selling the last units
+at the same moment can never both win, and only a failed UPDATE is
+followed by a SELECT to tell an unknown medicine from too little stock.
+On Postgres the medicine rows are also locked with SELECT ... FOR UPDATE
+first, once per transaction: `lock_medicines` remembers what it locked
+and later calls skip those rows. The new stock level gets a catalog
+change version (changes.py) so offline tills pick it up.
+
+Functions here add to the session but never commit; the caller owns the
+transaction (one sale per commit, or a whole offline batch per commit).
+"""
+from datetime import datetime
+
+from sqlalchemy import event, update, insert, select, func
+from sqlalchemy.orm import Session
+
+from models import db, Medicine, Sale, SaleItem, ArchivedSale, ArchivedSaleItem
+import rollups
+import changes
+import business_day
+
+
+class SaleError(Exception):
+    """A sale that cannot be recorded. `status` is the machine-readable reason."""
+    status = 'invalid'
+
+
+class UnknownMedicine(SaleError):
+    status = 'unknown_medicine'
+
+    def __init__(self):
+        super().__init__('Medicine not found')
+
+
+class InsufficientStock(SaleError):
+    status = 'insufficient_stock'
+
+    def __init__(self, available, requested):
+        super().__init__(f'Insufficient stock. Available: {available}, Requested: {requested}')
+        self.available = available
+        self.requested = requested
+
+
+def _is_postgres():
+    return db.session.get_bind().dialect.name in ('postgres', 'postgresql')
+
+
+# session.info key: ids of the medicine rows this transaction has locked
+LOCKED = 'locked_medicines'
+
+
+def _medicine_row(med_id):
+    return db.session.query(
+        Medicine.id, Medicine.price, Medicine.cost_price, Medicine.quantity
+    ).filter(Medicine.id == med_id).first()
+
+
+def lock_medicines(med_ids):
+    """Lock several medicine rows at once (Postgres only; SQLite locks the whole file on write).
+
+    Rows this transaction already locked are skipped.
+    """
+    if not med_ids or not _is_postgres():
+        return
+    locked = db.session.info.setdefault(LOCKED, set())
+    wanted = set(med_ids) - locked
+    if wanted:
+        db.session.query(Medicine.id).filter(Medicine.id.in_(wanted)).order_by(Medicine.id).with_for_update().all()
+        locked.update(wanted)
+
+
+def take_stock(med_id, qty):
+    """Atomically remove `qty` units of a medicine and return its row (id, price, cost_price, quantity)."""
+    lock_medicines([med_id])
+    taken = update(Medicine).where(Medicine.id == med_id, Medicine.quantity >= qty).values(
+        quantity=Medicine.quantity - qty, version=changes.next_version()
+    )
+    if db.session.get_bind().dialect.update_returning:
+        row = db.session.execute(
+            taken.returning(Medicine.id, Medicine.price, Medicine.cost_price, Medicine.quantity)
+        ).first()
+        if row is not None:
+            return row
+    elif db.session.execute(taken).rowcount == 1:
+        return _medicine_row(med_id)
+    row = _medicine_row(med_id)
+    if row is None:
+        raise UnknownMedicine()
+    raise InsufficientStock(row.quantity, qty)
+
+
+def record_cart(lines, customer_id=None, client_ref=None):
+    """Record one sale with several lines [(medicine_id, quantity), ...]. Does not commit.
+
+    Every line takes its stock atomically; if any line fails a SaleError is
+    raised and the caller must roll back, so a cart is all-or-nothing.
+    """
+    if not lines:
+        raise SaleError('A sale needs at least one item.')
+    for _, qty in lines:
+        if qty <= 0:
+            raise SaleError('Quantity must be positive.')
+    lock_medicines({med_id for med_id, _ in lines})
+
+    now = datetime.now()
+    sale = Sale(customer_id=customer_id, client_ref=client_ref, timestamp=now,
+                sale_date=business_day.business_date(now))
+    for med_id, qty in lines:
+        med = take_stock(med_id, qty)
+        cost = med.cost_price or 0
+        sale.items.append(SaleItem(medicine_id=med.id, quantity=qty, price_per_unit=med.price,
+                                   total_price=round(med.price * qty, 2),
+                                   cost_per_unit=cost, total_cost=round(cost * qty, 2)))
+
+    # Header columns: first line for the legacy single-item fields, totals for the rest
+    first = sale.items[0]
+    sale.medicine_id = first.medicine_id
+    sale.price_per_unit = first.price_per_unit
+    sale.cost_per_unit = first.cost_per_unit
+    sale.quantity = sum(item.quantity for item in sale.items)
+    sale.total_price = round(sum(item.total_price for item in sale.items), 2)
+    sale.total_cost = round(sum(item.total_cost for item in sale.items), 2)
+    db.session.add(sale)
+    rollups.record_sale(sale)
+    return sale
+
+
+def record_sale(med_id, qty, customer_id=None, client_ref=None):
+    """Validate, take stock, add a single-item Sale and update the rollups. Does not commit."""
+    return record_cart([(med_id, qty)], customer_id=customer_id, client_ref=client_ref)
+
+
+def recorded_refs(client_refs):
+    """{client_ref: (sale id, total)} for offline sales already recorded, live or archived.
+
+    Archiving keeps a sale's client_ref, so a till retrying an old queue
+    entry still gets the original sale back instead of selling it twice.
+    """
+    refs = [r for r in set(client_refs) if r]
+    if not refs:
+        return {}
+    rows = db.session.execute(
+        select(Sale.client_ref, Sale.id, Sale.total_price).where(Sale.client_ref.in_(refs))
+        .union_all(select(ArchivedSale.client_ref, ArchivedSale.id, ArchivedSale.total_price)
+                   .where(ArchivedSale.client_ref.in_(refs)))
+    ).all()
+    return {ref: (sale_id, total) for ref, sale_id, total in rows}
+
+
+def backfill_items():
+    """Give every sale recorded before multi-line sales its single SaleItem line.
+
+    Only runs when the sale_item table is still empty; returns rows added.
+    """
+    if db.session.query(SaleItem.id).first() is not None or db.session.query(Sale.id).first() is None:
+        return 0
+    result = db.session.execute(
+        insert(SaleItem).from_select(
+            ['sale_id', 'medicine_id', 'quantity', 'price_per_unit', 'total_price'],
+            select(Sale.id, Sale.medicine_id, Sale.quantity, Sale.price_per_unit, Sale.total_price),
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def backfill_costs():
+    """Snapshot cost prices on sales (live and archived) recorded before they were stored.
+
+    Lines take the medicine's current cost price - the best figure left for
+    them - and each sale's total is the sum of its lines. Returns sales updated.
+    """
+    updated = 0
+    for sale_model, item_model in ((Sale, SaleItem), (ArchivedSale, ArchivedSaleItem)):
+        unit_cost = func.coalesce(
+            select(Medicine.cost_price).where(Medicine.id == item_model.medicine_id).scalar_subquery(), 0.0
+        )
+        db.session.execute(
+            update(item_model).where(item_model.total_cost.is_(None))
+            .values(cost_per_unit=unit_cost, total_cost=func.round(unit_cost * item_model.quantity, 2))
+        )
+        line_costs = select(func.coalesce(func.sum(item_model.total_cost), 0.0)).where(
+            item_model.sale_id == sale_model.id
+        ).scalar_subquery()
+        first_cost = select(item_model.cost_per_unit).where(item_model.sale_id == sale_model.id).order_by(
+            item_model.id
+        ).limit(1).scalar_subquery()
+        result = db.session.execute(
+            update(sale_model).where(sale_model.total_cost.is_(None))
+            .values(cost_per_unit=first_cost, total_cost=func.round(line_costs, 2))
+        )
+        updated += result.rowcount
+    db.session.commit()
+    return updated
+
+
+def _end_transaction(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(LOCKED, None)
+
+
+def init_app(app):
+    """Forget locked medicine rows when their transaction ends (registered once per process)."""
+    if not event.contains(Session, 'after_transaction_end', _end_transaction):
+        event.listen(Session, 'after_transaction_end', _end_transaction)
@@ -0,0 +1,127 @@
+"""
+search_index.py
+
+Name search for medicines and customers that does not scan the sales table.
+
+- SQLite: FTS5 virtual tables with the trigram tokenizer (`medicine_fts`,
+  `customer_fts`), kept in sync with the base tables by triggers.
+- Postgres: GIN trigram indexes (pg_trgm) on `medicine.name` and
+  `customer.name`, which serve `ILIKE '%q%'` directly.
+
+Sales searches filter `Sale.medicine_id` / `Sale.customer_id` through
+their regular indexes with `IN (subquery)`, the subquery built here
+finding the medicine/customer ids by name.
+"""
+from sqlalchemy import Integer, bindparam, select, text
+
+from models import db, Medicine, Customer
+
+# Tables indexed for name search: (model, table name)
+INDEXED = ((Medicine, 'medicine'), (Customer, 'customer'))
+
+# Trigram matching needs at least this many characters
+MIN_TRIGRAM_LENGTH = 3
+
+# FTS tables available on the current SQLite database (set by ensure_index, or
+# looked up on the first search in processes that did not build the index)
+_fts_tables = None
+
+
+def _ensure_sqlite(conn, table):
+    fts = f'{table}_fts'
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': fts}
+    ).first()
+    if exists:
+        return False
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE {fts} USING fts5(name, content='{table}', content_rowid='id', tokenize='trigram')"
+    ))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name);
+        END"""))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name);
+        END"""))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name);
+        END"""))
+    # Index the rows that already exist
+    conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    return True
+
+
+def unavailable_reason(conn):
+    """Why this database cannot have the name search index, or None when it can."""
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        if not conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+            return 'SQLite was built without FTS5'
+        version = conn.execute(text("SELECT sqlite_version()")).scalar()
+        if tuple(int(part) for part in version.split('.')[:2]) < (3, 34):
+            return f'SQLite {version} has no trigram tokenizer (needs 3.34)'
+    elif dialect in ('postgres', 'postgresql'):
+        if conn.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is None:
+            return 'the pg_trgm extension is not installed on this server'
+    return None
+
+
+def ensure_index(conn):
+    """Create the name search index for the connection's dialect if missing.
+
+    Returns the list of tables whose index was created.
+    """
+    global _fts_tables
+    created = []
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        _fts_tables = None  # a failure below leaves detection to the first search
+        for _, table in INDEXED:
+            if _ensure_sqlite(conn, table):
+                created.append(table)
+        _fts_tables = {table for _, table in INDEXED}
+    elif dialect in ('postgres', 'postgresql'):
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for _, table in INDEXED:
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)"
+            ))
+    return created
+
+
+def _has_fts(table):
+    global _fts_tables
+    if _fts_tables is None:
+        if db.session.get_bind().dialect.name == 'sqlite':
+            rows = db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN :names")
+                .bindparams(bindparam('names', expanding=True)),
+                {'names': [f'{t}_fts' for _, t in INDEXED]},
+            )
+            _fts_tables = {name[:-len('_fts')] for (name,) in rows}
+        else:
+            _fts_tables = set()
+    return table in _fts_tables
+
+
+def matching_ids(model, q):
+    """SELECT of the ids of `model` rows (Medicine or Customer) whose name contains `q`.
+
+    A statement, not a list, so the caller can use it as an `in_()` subquery:
+    a short query can match most of the catalog, and a bound parameter per id
+    would grow with it (past SQLite's variable limit on a large catalog).
+    """
+    table = model.__tablename__
+    if len(q) >= MIN_TRIGRAM_LENGTH and _has_fts(table):
+        phrase = '"' + q.replace('"', '""') + '"'
+        # Bind name per table: a search can hold a medicine and a customer subquery
+        return text(f"SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :{table}_q").bindparams(
+            **{f'{table}_q': phrase}
+        ).columns(rowid=Integer)
+    # Postgres trigram index serves this ILIKE; short queries scan the small name table.
+    # Never correlated: callers' queries may join `model` themselves.
+    return select(model.id).where(model.name.ilike(f'%{q}%')).correlate(None)
@@ -0,0 +1,49 @@
+// ======================================
+// Background jobs (exports, report snapshots)
+// ======================================
+// runBackgroundJob(fields, statusEl): queue a job at /jobs, show its progress
+// in statusEl and start the download when it is done.
+
+const JOB_POLL_MS = 1000;
+
+async function runBackgroundJob(fields, statusEl) {
+  const show = (text) => { if (statusEl) statusEl.textContent = text; };
+  const body = new FormData();
+  Object.entries(fields).forEach(([name, value]) => body.append(name, value ?? ''));
+  const token = document.querySelector('meta[name="csrf-token"]');
+  if (token) body.append('csrf_token', token.content);
+
+  show('Queuing…');
+  let response;
+  let job;
+  try {
+    response = await fetch('/jobs', { method: 'POST', body, headers: { 'Accept': 'application/json' } });
+    job = await response.json();
+  } catch (e) {
+    show('Could not start the job.');
+    return null;
+  }
+  if (!response.ok) {
+    show(job.error || 'Could not start the job.');
+    return null;
+  }
+
+  while (job.status === 'queued' || job.status === 'running') {
+    show(job.status === 'queued' ? 'Waiting for a free worker…' : `Preparing file… ${job.progress}%`);
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_MS));
+    response = await fetch(job.url, { headers: { 'Accept': 'application/json' }, cache: 'no-store' });
+    if (!response.ok) {
+      show('Lost track of the job; please try again.');
+      return null;
+    }
+    job = await response.json();
+  }
+
+  if (job.status === 'done') {
+    show(`Ready: ${job.filename}`);
+    window.location = job.download_url;
+  } else {
+    show(`Failed: ${job.error || 'unknown error'}`);
+  }
+  return job;
+}
@@ -2,7 +2,8 @@
 class OfflineDatabase {
   constructor() {
     this.dbName = 'PharmacyDB';
-    this.version = 1;
+    // 2: offlineSalesQueue indexed on pending entries; acknowledged sales are deleted
+    this.version = 2;
     this.db = null;
     this.available = typeof indexedDB !== 'undefined';
     this.readyPromise = null;
@@ -33,6 +34,7 @@ class OfflineDatabase {
 
         request.onupgradeneeded = (event) => {
           const db = event.target.result;
+          const upgrade = event.target.transaction;
           
           // Create object stores if they don't exist
           if (!db.objectStoreNames.contains('medicines')) {
@@ -50,6 +52,24 @@ class OfflineDatabase {
           if (!db.objectStoreNames.contains('metadata')) {
             db.createObjectStore('metadata', { keyPath: 'key' });
           }
+
+          // Version 2: index the queue on [pending, timestamp] so a sync reads only unsent
+          // sales, in queue order. Version 1 kept synced sales with synced=true; drop them.
+          const queue = upgrade.objectStore('offlineSalesQueue');
+          if (!queue.indexNames.contains('pending')) {
+            queue.createIndex('pending', ['pending', 'timestamp']);
+            queue.openCursor().onsuccess = (e) => {
+              const cursor = e.target.result;
+              if (!cursor) return;
+              if (cursor.value.synced) {
+                cursor.delete();
+              } else {
+                const { synced, ...sale } = cursor.value;
+                cursor.update({ ...sale, pending: 1 });
+              }
+              cursor.continue();
+            };
+          }
           
           console.log('IndexedDB stores created');
         };
@@ -83,6 +103,17 @@ class OfflineDatabase {
     });
   }
 
+  // Get all cached customers
+  async getCustomers() {
+    const transaction = this.db.transaction(['customers'], 'readonly');
+    const store = transaction.objectStore('customers');
+    return new Promise((resolve, reject) => {
+      const request = store.getAll();
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => reject(request.error);
+    });
+  }
+
   // Get single medicine
   async getMedicine(id) {
     const transaction = this.db.transaction(['medicines'], 'readonly');
@@ -94,6 +125,25 @@ class OfflineDatabase {
     });
   }
 
+  // Apply a /api/medicines/changes section: upsert rows, drop deleted ids, in one transaction.
+  // A full download (replace=true) clears the store first.
+  async applyChanges(storeName, { fields, rows, deleted }, replace = false) {
+    await this.ensureReady();
+    const transaction = this.db.transaction([storeName], 'readwrite');
+    const store = transaction.objectStore(storeName);
+    if (replace) store.clear();
+    for (const row of rows) {
+      const record = {};
+      fields.forEach((field, i) => { record[field] = row[i]; });
+      store.put(record);
+    }
+    for (const id of deleted) store.delete(id);
+    return new Promise((resolve, reject) => {
+      transaction.oncomplete = () => resolve(rows.length + deleted.length);
+      transaction.onerror = () => reject(transaction.error);
+    });
+  }
+
   // Ensure DB is ready before operations
   async ensureReady() {
     if (this.readyPromise) {
@@ -109,10 +159,12 @@ class OfflineDatabase {
     await this.ensureReady();
     const transaction = this.db.transaction(['offlineSalesQueue'], 'readwrite');
     const store = transaction.objectStore('offlineSalesQueue');
+    // The timestamp is the queue key; keep it unique when several cart lines are queued at once
+    this.lastQueueKey = Math.max(Date.now(), (this.lastQueueKey || 0) + 1);
     const queueItem = {
       ...saleData,
-      timestamp: Date.now(),
-      synced: false
+      timestamp: this.lastQueueKey,
+      pending: 1
     };
     return new Promise((resolve, reject) => {
       const request = store.add(queueItem);
@@ -124,35 +176,50 @@ class OfflineDatabase {
     });
   }
 
-  // Get all queued sales
-  async getQueuedSales() {
+  // Pending queued sales in queue order: up to `limit` of them, after queue key `after`.
+  // Reads the 'pending' index, so acknowledged history is never scanned.
+  async getQueuedSales(limit = undefined, after = undefined) {
     await this.ensureReady();
     const transaction = this.db.transaction(['offlineSalesQueue'], 'readonly');
-    const store = transaction.objectStore('offlineSalesQueue');
+    const index = transaction.objectStore('offlineSalesQueue').index('pending');
+    const range = after === undefined
+      ? IDBKeyRange.bound([1, -Infinity], [1, Infinity])
+      : IDBKeyRange.bound([1, after], [1, Infinity], true);
     return new Promise((resolve, reject) => {
-      const request = store.getAll();
-      request.onsuccess = () => resolve(request.result.filter(s => !s.synced));
+      const request = index.getAll(range, limit);
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => reject(request.error);
+    });
+  }
+
+  // Number of queued sales still waiting for the server
+  async countQueuedSales() {
+    await this.ensureReady();
+    const transaction = this.db.transaction(['offlineSalesQueue'], 'readonly');
+    const index = transaction.objectStore('offlineSalesQueue').index('pending');
+    return new Promise((resolve, reject) => {
+      const request = index.count(IDBKeyRange.bound([1, -Infinity], [1, Infinity]));
+      request.onsuccess = () => resolve(request.result);
       request.onerror = () => reject(request.error);
     });
   }
 
-  // Mark sale as synced
-  async markSaleSynced(timestamp) {
+  // Compact the queue after a sync batch starting at queue key `from`: everything up to the
+  // server's `ackedThrough` watermark goes in one range delete, other acknowledged keys one by one.
+  async acknowledgeSales(from, ackedThrough, keys = []) {
     await this.ensureReady();
     const transaction = this.db.transaction(['offlineSalesQueue'], 'readwrite');
     const store = transaction.objectStore('offlineSalesQueue');
+    const watermark = ackedThrough ?? null;
+    if (watermark !== null && watermark >= from) {
+      store.delete(IDBKeyRange.bound(from, watermark));
+    }
+    for (const key of keys) {
+      if (watermark === null || key > watermark) store.delete(key);
+    }
     return new Promise((resolve, reject) => {
-      const getRequest = store.get(timestamp);
-      getRequest.onsuccess = () => {
-        const sale = getRequest.result;
-        if (sale) {
-          sale.synced = true;
-          const updateRequest = store.put(sale);
-          updateRequest.onsuccess = () => resolve();
-          updateRequest.onerror = () => reject(updateRequest.error);
-        }
-      };
-      getRequest.onerror = () => reject(getRequest.error);
+      transaction.oncomplete = () => resolve();
+      transaction.onerror = () => reject(transaction.error);
     });
   }
 
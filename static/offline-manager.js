@@ -1,4 +1,11 @@
 // Offline Detection and Sync Manager
+
+// Number of queued sales sent per /sales/sync/batch request (server max is 500)
+const SYNC_CHUNK_SIZE = 100;
+
+// How often the medicine/customer catalog is refreshed from /api/medicines/changes
+const CATALOG_SYNC_INTERVAL = 60 * 1000;
+
 class OfflineManager {
   constructor() {
     this.isOnline = navigator.onLine;
@@ -21,7 +28,11 @@ class OfflineManager {
     // Attempt sync on page load if online
     if (this.isOnline) {
       setTimeout(() => this.syncOfflineData(), 1000);
+      setTimeout(() => this.syncCatalog(), 1500);
     }
+
+    // Keep the local medicine/customer catalog current while online
+    setInterval(() => this.syncCatalog(), CATALOG_SYNC_INTERVAL);
   }
 
   handleOnline() {
@@ -29,6 +40,29 @@ class OfflineManager {
     console.log('✓ Back online');
     this.updateOfflineBanner();
     this.syncOfflineData();
+    this.syncCatalog();
+  }
+
+  // Pull medicines/customers changed since the last pull into IndexedDB
+  async syncCatalog() {
+    if (this.catalogSyncing || !this.isOnline || !offlineDB || !offlineDB.available) return;
+    this.catalogSyncing = true;
+    try {
+      await offlineDB.ensureReady();
+      const since = await offlineDB.getMetadata('catalogVersion');
+      const url = since === undefined ? '/api/medicines/changes' : `/api/medicines/changes?since=${since}`;
+      const response = await fetch(url, { headers: { 'Accept': 'application/json' } });
+      if (response.status === 304 || !response.ok) return;
+
+      const changes = await response.json();
+      await offlineDB.applyChanges('medicines', changes.medicines, changes.full);
+      await offlineDB.applyChanges('customers', changes.customers, changes.full);
+      await offlineDB.setMetadata('catalogVersion', changes.version);
+    } catch (err) {
+      console.warn('Catalog sync failed:', err);
+    } finally {
+      this.catalogSyncing = false;
+    }
   }
 
   handleOffline() {
@@ -67,45 +101,65 @@ class OfflineManager {
     console.log('Starting offline data sync...');
     
     try {
-      const queuedSales = await offlineDB.getQueuedSales();
-      
-      if (queuedSales.length === 0) {
+      const pending = await offlineDB.countQueuedSales();
+
+      if (pending === 0) {
         console.log('No queued sales to sync');
         this.syncing = false;
         return;
       }
-      
-      console.log(`Syncing ${queuedSales.length} queued sales...`);
+
+      console.log(`Syncing ${pending} queued sales...`);
+      const deviceId = await this.getDeviceId();
       let synced = 0;
-      
-      for (const sale of queuedSales) {
-        try {
-          const payload = {
+      let after;
+
+      // Send the queue in chunks read from the pending index; each chunk is recorded in one
+      // server transaction and the acknowledged sales are then deleted from the queue
+      while (true) {
+        const chunk = await offlineDB.getQueuedSales(SYNC_CHUNK_SIZE, after);
+        if (chunk.length === 0) break;
+        after = chunk[chunk.length - 1].timestamp;
+        const payload = {
+          sales: chunk.map((sale) => ({
+            op_id: `${deviceId}:${sale.timestamp}`,
+            seq: sale.timestamp,
             medicine_id: sale.medicine_id,
             quantity: sale.quantity,
             customer_id: sale.customer_id || null
-          };
-          console.log('offline-manager.js:82 [SYNC] Sending payload:', payload);
-          
-          // Use /sales/sync endpoint which is CSRF exempt for offline sync
-          const response = await fetch('/sales/sync', {
+          }))
+        };
+
+        try {
+          // /sales/sync/batch is CSRF exempt for offline sync
+          const response = await fetch('/sales/sync/batch', {
             method: 'POST',
             headers: {
               'Content-Type': 'application/json'
             },
             body: JSON.stringify(payload)
           });
-          
+
           const responseData = await response.json();
-          console.log(`offline-manager.js:96 [SYNC] Response (${response.status}):`, responseData);
-          
-          if (response.ok) {
-            await offlineDB.markSaleSynced(sale.timestamp);
-            synced++;
-            console.log(`✓ Synced sale ${synced}/${queuedSales.length}`);
-          } else {
-            console.error(`Failed to sync sale: ${response.status} - ${responseData.error}`);
+          if (!response.ok) {
+            console.error(`Failed to sync batch: ${response.status} - ${responseData.error}`);
+            break;
+          }
+
+          // Results come back in the same order as the chunk
+          const acknowledged = [];
+          for (let j = 0; j < chunk.length; j++) {
+            const result = responseData.results[j] || {};
+            if (result.status === 'ok' || result.status === 'duplicate') {
+              acknowledged.push(chunk[j].timestamp);
+              synced++;
+            } else {
+              // Left in the queue and retried on the next sync
+              console.error(`Failed to sync sale ${chunk[j].timestamp}: ${result.status} - ${result.error}`);
+            }
           }
+          await offlineDB.acknowledgeSales(chunk[0].timestamp, responseData.acked_through, acknowledged);
+          console.log(`✓ Synced ${synced}/${pending} sales`);
         } catch (err) {
           console.error('Sync error:', err);
           break; // Stop if network error
@@ -116,6 +170,8 @@ class OfflineManager {
         console.log(`✓ Successfully synced ${synced} sales`);
         this.showSyncNotification(`${synced} offline sales synced successfully!`);
         await offlineDB.setMetadata('lastSync', new Date().toISOString());
+        // Pick up the stock levels the synced sales changed
+        this.syncCatalog();
       }
     } catch (err) {
       console.error('Sync failed:', err);
@@ -124,6 +180,16 @@ class OfflineManager {
     }
   }
 
+  // Stable per-browser id so queue keys from different tills never collide
+  async getDeviceId() {
+    let deviceId = await offlineDB.getMetadata('deviceId');
+    if (!deviceId) {
+      deviceId = Math.random().toString(36).slice(2, 10) + Date.now().toString(36);
+      await offlineDB.setMetadata('deviceId', deviceId);
+    }
+    return deviceId;
+  }
+
   showSyncNotification(message) {
     const notification = document.createElement('div');
     notification.className = 'alert alert-success alert-dismissible fade show';
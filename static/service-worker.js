@@ -1,5 +1,6 @@
 // Simple, reliable Service Worker for offline functionality
-const CACHE_NAME = 'pharmacy-v1';
+// Bump when static scripts change incompatibly so clients drop the old copies together
+const CACHE_NAME = 'pharmacy-v3';
 
 // Install
 self.addEventListener('install', (event) => {
@@ -35,6 +36,15 @@ self.addEventListener('fetch', (event) => {
     return;
   }
 
+  // Network only: job progress and downloads, JSON APIs (stock, prices, sync watermarks,
+  // dashboard figures) and event streams change on every request and must never be
+  // answered from the cache. Returning without respondWith lets the browser fetch them
+  // normally, so ETag/304 revalidation still reaches the server.
+  if (url.pathname.startsWith('/jobs/') || url.pathname.startsWith('/api/') ||
+      request.headers.get('accept')?.includes('text/event-stream')) {
+    return;
+  }
+
   // For HTML pages: network first
   if (request.headers.get('accept')?.includes('text/html')) {
     event.respondWith(
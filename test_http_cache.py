@@ -0,0 +1,47 @@
+"""
+Tests for conditional GET (http_cache.conditional).
+
+Run with pytest.
+"""
+from models import db, Medicine
+import exports
+
+PAGE = '/sales/search?per_page=5'
+
+
+def test_matching_etag_gets_304_without_running_the_view(admin_client, monkeypatch):
+    first = admin_client.get(PAGE)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+
+    calls = []
+    filter_sales = exports.filter_sales
+    monkeypatch.setattr(exports, 'filter_sales', lambda *a: calls.append(a) or filter_sales(*a))
+    again = admin_client.get(PAGE, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+    assert again.headers['ETag'] == etag
+    assert calls == []
+
+    # Any other tag renders the page
+    assert admin_client.get(PAGE, headers={'If-None-Match': 'W/"stale"'}).status_code == 200
+    assert calls
+
+
+def test_new_sale_or_catalog_change_changes_the_etag(app, admin_client, add_medicine):
+    med_id = add_medicine()
+    etag = admin_client.get(PAGE).headers['ETag']
+
+    assert admin_client.post('/sales/sync', json={'medicine_id': med_id, 'quantity': 1}).status_code == 201
+    after_sale = admin_client.get(PAGE, headers={'If-None-Match': etag})
+    assert after_sale.status_code == 200
+    assert after_sale.headers['ETag'] != etag
+
+    etag = after_sale.headers['ETag']
+    with app.app_context():
+        db.session.get(Medicine, med_id).price = 2.5
+        db.session.commit()
+    after_edit = admin_client.get(PAGE, headers={'If-None-Match': etag})
+    assert after_edit.status_code == 200
+    assert after_edit.headers['ETag'] != etag
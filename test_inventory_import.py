@@ -0,0 +1,98 @@
+"""
+Tests for the CSV/XLSX medicine import (inventory_import.py, /medicines/import).
+
+Run with pytest.
+"""
+import io
+import time
+
+import pytest
+
+from models import Medicine
+import inventory_import
+
+
+def _csv(*lines):
+    return io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+def _import(app, stream, filename='stock.csv', **kwargs):
+    with app.app_context():
+        return inventory_import.import_medicines(inventory_import.read_rows(stream, filename), **kwargs)
+
+
+def _find(app, name):
+    with app.app_context():
+        return [(m.name, m.brand, m.quantity, m.price) for m in Medicine.query.filter_by(name=name)]
+
+
+def test_bad_rows_are_reported_and_the_rest_imported(app, admin_client):
+    tag = time.time_ns()
+    client = admin_client
+    upload = _csv(
+        'Name,Brand,Price,Quantity,Expiry Date',
+        f'Good {tag},Acme,2.50,10,2030-01-31',
+        f'No price {tag},Acme,,5,',
+        ',Acme,1.00,5,',
+        f'Bad qty {tag},Acme,1.00,two,',
+        f'Bad date {tag},Acme,1.00,3,31/01/2030',
+    )
+    resp = client.post('/medicines/import', data={'file': (upload, 'stock.csv')},
+                       headers={'Accept': 'application/json'}, content_type='multipart/form-data')
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert (body['rows'], body['inserted'], body['updated']) == (5, 1, 0)
+    assert body['errors'] == [
+        {'row': 3, 'error': 'price is required for a new medicine'},
+        {'row': 4, 'error': 'name is required'},
+        {'row': 5, 'error': 'quantity must be a number'},
+        {'row': 6, 'error': 'expiry_date must be YYYY-MM-DD'},
+    ]
+    assert _find(app, f'Good {tag}') == [(f'Good {tag}', 'Acme', 10, 2.5)]
+    assert _find(app, f'No price {tag}') == []
+
+
+def test_existing_medicine_is_matched_ignoring_case_and_spaces(app, add_medicine):
+    name = f'Paracetamol {time.time_ns()}'
+    add_medicine(4, name=name, brand='Acme', price=1.0)
+    result = _import(app, _csv(
+        'name,brand,price,quantity',
+        f'  {name.upper()}  , acme ,1.20,6',
+        f'{name},Other,1.00,3',
+    ))
+    assert (result['inserted'], result['updated'], result['errors']) == (1, 1, [])
+    assert sorted(_find(app, name)) == [(name, 'Acme', 10, 1.2), (name, 'Other', 3, 1.0)]
+
+    # Stock take replaces the quantity instead of adding to it
+    _import(app, _csv('name,brand,quantity', f'{name},Acme,2'), set_quantity=True)
+    assert sorted(_find(app, name))[0][2] == 2
+
+
+def test_file_failing_halfway_leaves_the_catalog_unchanged(app):
+    tag = time.time_ns()
+    lines = ['name,price,quantity'] + [f'Rollback {tag} {n},1.00,1' for n in range(500)]
+    # Valid rows for several batches, then bytes that are not UTF-8
+    stream = io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8') + b'Broken \xff\xfe,1.00,1\n')
+    with pytest.raises(UnicodeDecodeError):
+        _import(app, stream, batch_size=50)
+    with app.app_context():
+        assert Medicine.query.filter(Medicine.name.like(f'Rollback {tag} %')).count() == 0
+
+
+def test_missing_columns_reject_the_whole_file(app):
+    with pytest.raises(inventory_import.ImportFileError, match='quantity'):
+        _import(app, _csv('name,price', 'Anything,1.00'))
+
+
+def test_xlsx_file_is_imported(app):
+    openpyxl = pytest.importorskip('openpyxl')
+    name = f'Sheet import {time.time_ns()}'
+    wb = openpyxl.Workbook()
+    wb.active.append(['Name', 'Price', 'Quantity', 'Expiry Date'])
+    wb.active.append([name, 3.0, 7, None])
+    stream = io.BytesIO()
+    wb.save(stream)
+    stream.seek(0)
+    result = _import(app, stream, 'stock.xlsx')
+    assert (result['inserted'], result['errors']) == (1, [])
+    assert _find(app, name) == [(name, None, 7, 3.0)]
@@ -0,0 +1,119 @@
+"""
+Tests for the background export/report jobs (jobs.py, /jobs).
+
+Jobs are run inline here (claim, then execute) instead of by the runner
+thread, so each test controls exactly when a job runs (the `inline_jobs`
+fixture).
+
+Run with pytest.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Job
+import jobs
+
+pytestmark = pytest.mark.usefixtures('inline_jobs')
+
+
+def _export(client, **params):
+    # A unique search term keeps each test's job apart from the others
+    return client.post('/jobs', json={'kind': 'export', 'format': 'csv', **params})
+
+
+def _run_until(app, job_id):
+    """Run queued jobs in order until `job_id` has run."""
+    with app.app_context():
+        while True:
+            claimed = jobs._claim()
+            assert claimed is not None, f'job {job_id} was never claimed'
+            jobs._execute(claimed)
+            if claimed == job_id:
+                return
+
+
+def _job(app, job_id):
+    with app.app_context():
+        return db.session.get(Job, job_id)
+
+
+def test_identical_request_returns_the_existing_job(app, admin_client):
+    client = admin_client
+    q = f'dedupe {time.time_ns()}'
+    first = _export(client, q=q)
+    assert first.status_code == 202
+    assert first.get_json()['deduplicated'] is False
+    again = _export(client, q=q)
+    assert again.get_json()['deduplicated'] is True
+    assert again.get_json()['id'] == first.get_json()['id']
+    assert _export(client, q=q + ' other').get_json()['id'] != first.get_json()['id']
+
+    job_id = first.get_json()['id']
+    _run_until(app, job_id)
+    # Finished and no data change since: still the same job and file
+    assert _export(client, q=q).get_json()['id'] == job_id
+
+
+def test_stale_running_job_is_taken_over(app):
+    with app.app_context():
+        # Claimed by a worker that then died without reporting progress
+        job = Job(kind='export', params='{"q": "stale", "from_date": "", "to_date": "", "format": "csv"}',
+                  dedupe_key=f'stale {time.time_ns()}', status='running',
+                  updated_at=datetime.now() - timedelta(seconds=30))
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+        # Still fresh: runners take everything else but leave it to its worker
+        claimed = jobs._claim()
+        while claimed is not None:
+            assert claimed != job_id
+            jobs._execute(claimed)
+            claimed = jobs._claim()
+        job.updated_at = datetime.now() - timedelta(seconds=jobs.STALE_SECONDS + 1)
+        db.session.commit()
+    _run_until(app, job_id)
+    assert _job(app, job_id).status == 'done'
+
+
+def test_failed_job_records_its_error(app, admin_client, monkeypatch):
+    def broken(job_id, params, path):
+        with open(path, 'w') as out:
+            out.write('half a file')
+        raise RuntimeError('disk full')
+
+    monkeypatch.setitem(jobs.KINDS, 'export', (jobs._export_params, broken))
+    client = admin_client
+    job_id = _export(client, q=f'failing {time.time_ns()}').get_json()['id']
+    _run_until(app, job_id)
+    status = client.get(f'/jobs/{job_id}').get_json()
+    assert status['status'] == 'failed'
+    assert status['error'] == 'disk full'
+    assert not any(f.endswith('.part') for f in os.listdir(jobs.RESULTS_DIR))
+    assert client.get(f'/jobs/{job_id}/download').status_code == 404
+
+
+def test_finished_job_can_be_downloaded(app, admin_client, add_medicine):
+    tag = f'Job download {time.time_ns()}'
+    client = admin_client
+    med_id = add_medicine(5, name=tag)
+    assert client.post('/sales/sync', json={'medicine_id': med_id, 'quantity': 2}).status_code == 201
+
+    job_id = _export(client, q=tag).get_json()['id']
+    assert client.get(f'/jobs/{job_id}/download').status_code == 404  # not run yet
+    _run_until(app, job_id)
+    status = client.get(f'/jobs/{job_id}').get_json()
+    assert (status['status'], status['progress']) == ('done', 100)
+
+    resp = client.get(f'/jobs/{job_id}/download')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/csv'
+    assert 'attachment' in resp.headers['Content-Disposition']
+    assert status['filename'] in resp.headers['Content-Disposition']
+    body = resp.get_data(as_text=True)
+    resp.close()
+    lines = body.strip().splitlines()
+    assert len(lines) == 2  # header and the one matching sale
+    assert tag in lines[1]
@@ -0,0 +1,140 @@
+"""
+Tests for the offline sync endpoints (/sales/sync, /sales/sync/batch).
+
+A retried queue entry (same op_id) must never be sold twice, whether the
+original sale is still live or has been archived since.
+
+Run with pytest.
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from models import db, Medicine, Sale, ArchivedSale
+import archive
+import sales
+
+
+def _stock(app, med_id):
+    with app.app_context():
+        return db.session.get(Medicine, med_id).quantity
+
+
+def _device():
+    return f'dev{time.time_ns()}'
+
+
+def _op(device, seq, med_id, qty=1):
+    return {'op_id': f'{device}:{seq}', 'seq': seq, 'medicine_id': med_id, 'quantity': qty}
+
+
+def test_retry_of_archived_sale_is_a_duplicate(fresh_app, add_medicine):
+    med_id = add_medicine(10, flask_app=fresh_app)
+    client = fresh_app.test_client()
+    op = _op(_device(), 1, med_id, qty=2)
+    first = client.post('/sales/sync', json=op)
+    assert first.status_code == 201
+    sale_id = first.get_json()['sale_id']
+    # A later sale, so the synced one is not the newest (SQLite keeps the newest sale live)
+    assert client.post('/sales/sync', json={'medicine_id': med_id, 'quantity': 1}).status_code == 201
+
+    with fresh_app.app_context():
+        assert archive.archive_sales(datetime.now()) == 1
+        assert db.session.get(Sale, sale_id) is None
+        assert db.session.get(ArchivedSale, sale_id) is not None
+
+    retry = client.post('/sales/sync', json=op)
+    assert retry.status_code == 200
+    assert retry.get_json()['duplicate'] is True
+    assert retry.get_json()['sale_id'] == sale_id
+
+    batch = client.post('/sales/sync/batch', json={'sales': [op]}).get_json()
+    assert batch['results'][0]['status'] == 'duplicate'
+    assert batch['results'][0]['sale_id'] == sale_id
+    assert _stock(fresh_app, med_id) == 7
+
+
+def test_batch_reports_each_op_and_acks_the_whole_queue(app, client, add_medicine):
+    med_id = add_medicine(10)
+    device = _device()
+    ops = [_op(device, seq, med_id) for seq in (1, 2, 3)]
+    resp = client.post('/sales/sync/batch', json={'sales': ops})
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert [r['op_id'] for r in body['results']] == [op['op_id'] for op in ops]
+    assert [r['status'] for r in body['results']] == ['ok', 'ok', 'ok']
+    assert len({r['sale_id'] for r in body['results']}) == 3
+    assert body['synced'] == 3
+    assert body['acked_through'] == 3
+    assert _stock(app, med_id) == 7
+
+
+def test_duplicate_op_id_within_a_batch_is_sold_once(app, client, add_medicine):
+    med_id = add_medicine(10)
+    device = _device()
+    op = _op(device, 1, med_id, qty=2)
+    body = client.post('/sales/sync/batch', json={'sales': [op, op, _op(device, 2, med_id)]}).get_json()
+    first, repeat, last = body['results']
+    assert (first['status'], repeat['status'], last['status']) == ('ok', 'duplicate', 'ok')
+    assert repeat['sale_id'] == first['sale_id']
+    assert body['acked_through'] == 2
+    assert _stock(app, med_id) == 7
+
+
+def test_duplicate_op_id_across_batches_is_sold_once(app, client, add_medicine):
+    med_id = add_medicine(10)
+    device = _device()
+    first = client.post('/sales/sync/batch', json={'sales': [_op(device, 1, med_id), _op(device, 2, med_id)]}).get_json()
+    # The till never saw the reply and resends the whole queue plus a new sale
+    again = client.post('/sales/sync/batch', json={
+        'sales': [_op(device, 1, med_id), _op(device, 2, med_id), _op(device, 3, med_id)],
+    }).get_json()
+    assert [r['status'] for r in again['results']] == ['duplicate', 'duplicate', 'ok']
+    assert [r['sale_id'] for r in again['results'][:2]] == [r['sale_id'] for r in first['results']]
+    assert again['acked_through'] == 3
+    assert _stock(app, med_id) == 7
+
+
+def test_out_of_stock_op_stops_the_ack_but_not_the_batch(app, client, add_medicine):
+    scarce = add_medicine(1)
+    plenty = add_medicine(10)
+    device = _device()
+    ops = [_op(device, 1, plenty), _op(device, 2, scarce, qty=2), _op(device, 3, plenty)]
+    body = client.post('/sales/sync/batch', json={'sales': ops}).get_json()
+    assert [r['status'] for r in body['results']] == ['ok', 'insufficient_stock', 'ok']
+    assert body['results'][1]['error']
+    assert 'sale_id' not in body['results'][1]
+    assert body['synced'] == 2
+    # Only the run before the rejected op can be dropped from the queue
+    assert body['acked_through'] == 1
+    assert _stock(app, scarce) == 1
+    assert _stock(app, plenty) == 8
+
+
+def test_batch_locks_each_medicine_once(app, client, add_medicine, monkeypatch):
+    # The Postgres path: SQLite leaves out FOR UPDATE, so the lock queries run but lock nothing
+    monkeypatch.setattr(sales, '_is_postgres', lambda: True)
+    first, second = add_medicine(10), add_medicine(10)
+    device = _device()
+    ops = [_op(device, seq, med_id) for seq, med_id in enumerate([first, second, first, second, first], 1)]
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(' '.join(statement.split()))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        body = client.post('/sales/sync/batch', json={'sales': ops}).get_json()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert body['synced'] == 5
+    medicine_reads = [s for s in statements if s.startswith('SELECT') and 'FROM medicine' in s]
+    assert len(medicine_reads) == 1
+    assert 'medicine.id IN' in medicine_reads[0]
+    # One stock UPDATE per op, and no re-read of the sales after commit
+    assert len([s for s in statements if s.startswith('UPDATE medicine')]) == 5
+    assert not [s for s in statements if s.startswith('SELECT sale.id')]
+    assert _stock(app, first) == 7
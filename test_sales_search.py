@@ -0,0 +1,116 @@
+"""
+Tests for the keyset pagination of /sales/search.
+
+Sales recorded in the same instant share a timestamp; paging on
+(timestamp, id) must still list every one of them exactly once.
+
+Run with pytest.
+"""
+import html
+import re
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from models import db, Sale
+
+_ROW = re.compile(r'<tr>\s*<td>(\d+)</td>')
+
+
+def _link(page, label):
+    match = re.search(r'<a class="page-link" href="([^"]*)">' + re.escape(label), page)
+    href = html.unescape(match.group(1))
+    return None if href == '#' else href
+
+
+def _page(client, url):
+    resp = client.get(url)
+    assert resp.status_code == 200
+    page = resp.get_data(as_text=True)
+    return [int(sale_id) for sale_id in _ROW.findall(page)], _link(page, 'Next'), _link(page, '&laquo; Prev')
+
+
+def _sales_at(app, client, med_id, timestamps):
+    """One sale of medicine `med_id` per timestamp; returns their ids."""
+    ids = []
+    for _ in timestamps:
+        resp = client.post('/sales/sync', json={'medicine_id': med_id, 'quantity': 1})
+        assert resp.status_code == 201
+        ids.append(resp.get_json()['sale_id'])
+    with app.app_context():
+        for sale_id, ts in zip(ids, timestamps):
+            db.session.get(Sale, sale_id).timestamp = ts
+        db.session.commit()
+    return ids
+
+
+def test_equal_timestamps_across_pages_are_listed_once(app, admin_client, add_medicine):
+    name = f'Keyset {time.time_ns()}'
+    early = datetime(2024, 5, 1, 9, 0, 0)
+    late = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    # Seven sales in two instants: every page boundary falls inside a run of equal timestamps
+    ids = _sales_at(app, admin_client, add_medicine(7, name=name), [early] * 3 + [late] * 4)
+    expected = sorted(ids[3:], reverse=True) + sorted(ids[:3], reverse=True)
+    client = admin_client
+
+    seen, pages = [], []
+    url = f'/sales/search?q={name}&per_page=3'
+    while url:
+        page_ids, url, _ = _page(client, url)
+        pages.append(page_ids)
+        seen.extend(page_ids)
+    assert seen == expected
+    assert [len(p) for p in pages] == [3, 3, 1]
+
+    # Walking back from the last sale gives the earlier pages in reverse
+    back = []
+    url = f'/sales/search?q={name}&per_page=3&before={early.isoformat()}_{expected[-1]}'
+    while url:
+        page_ids, _, url = _page(client, url)
+        back.append(page_ids)
+    assert back == pages[:-1][::-1]
+
+
+def test_short_query_filters_through_subqueries(app, admin_client, add_medicine):
+    # One or two characters can match most of the catalog: no id list may reach the SQL
+    med_ids = [add_medicine(5, name=f'Zq short {n} {time.time_ns()}') for n in range(30)]
+    sale_ids = [admin_client.post('/sales/sync', json={'medicine_id': med_id, 'quantity': 1}).get_json()['sale_id']
+                for med_id in med_ids]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        page_ids, _, _ = _page(admin_client, '/sales/search?q=zq&per_page=200')
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert set(sale_ids) <= set(page_ids)
+    searches = [params for statement, params in statements if 'LIKE' in statement and 'sale' in statement]
+    assert searches
+    assert all(len(params) < 10 for params in searches)
+
+
+def test_name_search_matches_customers_in_joined_queries(app, add_medicine):
+    import exports
+    from models import Customer
+
+    tag = f'Custjoin {time.time_ns()}'
+    med_id = add_medicine(5)
+    with app.app_context():
+        customer = Customer(name=tag)
+        db.session.add(customer)
+        db.session.commit()
+        customer_id = customer.id
+    sale_id = app.test_client().post('/sales/sync', json={
+        'medicine_id': med_id, 'quantity': 1, 'customer_id': customer_id,
+    }).get_json()['sale_id']
+    with app.app_context():
+        # The export query joins customer itself; the name subquery must not correlate with it
+        for q in (tag, tag[:2]):
+            lines = exports.sales_lines_query(q, None, None).all()
+            assert sale_id in [line[0] for line in lines]
@@ -0,0 +1,100 @@
+"""
+Concurrent load test for the sale path.
+
+Many threads (each with its own database connection, like separate
+gunicorn workers) hammer /sales/sync and /sales/new for a medicine with
+limited stock. Stock must never go negative and exactly the available
+units must be sold.
+
+Run with pytest, or directly to print sustained sales per second:
+    python test_stock_concurrency.py [threads] [attempts_per_thread]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from models import db, Medicine, Sale, ArchivedSale, DailySalesRollup
+
+
+def _add_medicine(app, stock):
+    with app.app_context():
+        med = Medicine(name=f'Load test {time.time_ns()}', price=2.0, cost_price=1.0, quantity=stock)
+        db.session.add(med)
+        db.session.commit()
+        return med.id
+
+
+def run_load(app, stock=50, threads=8, attempts=20):
+    """Fire `threads * attempts` one-unit sales at a medicine holding `stock` units."""
+    med_id = _add_medicine(app, stock)
+    results = {'ok': 0, 'rejected': 0, 'errors': []}
+    lock = threading.Lock()
+
+    def worker(n):
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['is_admin'] = True
+        for i in range(attempts):
+            # Alternate between the online form post and the offline sync API
+            if i % 2:
+                resp = client.post('/sales/sync', json={'medicine_id': med_id, 'quantity': 1})
+                ok = resp.status_code == 201
+            else:
+                resp = client.post('/sales/new', json={'medicine_id': med_id, 'quantity': 1})
+                ok = resp.status_code == 201
+            with lock:
+                if ok:
+                    results['ok'] += 1
+                elif resp.status_code == 400:
+                    results['rejected'] += 1
+                else:
+                    results['errors'].append((resp.status_code, resp.get_data(as_text=True)[:200]))
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        remaining = db.session.get(Medicine, med_id).quantity
+        sold = db.session.query(db.func.coalesce(db.func.sum(Sale.quantity), 0)).filter(Sale.medicine_id == med_id).scalar()
+    results.update(med_id=med_id, remaining=remaining, sold=sold, elapsed=elapsed)
+    return results
+
+
+def test_stock_never_goes_negative(app):
+    stock, threads, attempts = 50, 8, 20
+    results = run_load(app, stock, threads, attempts)
+    assert not results['errors'], results['errors']
+    assert results['remaining'] == 0
+    assert results['sold'] == stock
+    assert results['ok'] == stock
+    assert results['rejected'] == threads * attempts - stock
+
+
+def test_rollups_match_sales_under_load(fresh_app):
+    # Its own database: the rollups are compared with every sale in it
+    run_load(fresh_app, 30, 6, 10)
+    with fresh_app.app_context():
+        rolled = db.session.query(db.func.sum(DailySalesRollup.sale_count)).scalar()
+        # Rollups keep counting sales after they are archived
+        assert rolled == Sale.query.count() + ArchivedSale.query.count() == 30
+
+
+if __name__ == '__main__':
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'concurrency.db')
+    from app import app  # builds the app from DATABASE_URL on import
+    app.config['WTF_CSRF_ENABLED'] = False
+    for limiter in app.extensions.get('limiter', ()):
+        limiter.enabled = False
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    attempts = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    # Enough stock that every attempt succeeds: measures sustained write throughput
+    r = run_load(app, stock=threads * attempts, threads=threads, attempts=attempts)
+    print(f"{threads} threads x {attempts} sales: {r['ok']} recorded, {len(r['errors'])} errors, "
+          f"stock left {r['remaining']}, {r['ok'] / r['elapsed']:.1f} sales/sec")